@@ -0,0 +1,273 @@
+"""Runs TensorFlow Model Analysis on the eval data, sliced by feature.
+
+The eval CSV is encoded into raw tf.Examples and run through the latest eval
+SavedModel exported by trainer/task.py. The expensive part, the model's
+predictions, is cached as pickled TFMA extracts under `--cache_dir`, keyed by a
+fingerprint of the model and the data. Analyzing the same model and data with
+another slice spec only re-computes the slice keys and metrics.
+
+  python analyze_model.py --input ../data/eval/eval.csv \
+      --schema_file ../data/tfdv_output/schema.pbtxt \
+      --eval_model_dir ../data/train/bookings_output/eval_model_dir \
+      --cache_dir ../data/eval/tfma_cache \
+      --output_dir ../data/eval/tfma_output \
+      --slice_columns city_id advertiser_id stars week_of_year
+
+Both pipelines run on a multi-process DirectRunner with `--num_workers`
+processes unless another runner is given; `--direct_num_workers` and
+`--direct_running_mode` override that default.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import time
+
+import apache_beam as beam
+import numpy as np
+import tensorflow as tf
+import tensorflow_model_analysis as tfma
+
+from apache_beam.options import pipeline_options
+
+import pipeline_metrics
+import stage_cache
+from trainer import bookings
+
+DEFAULT_SLICE_COLUMNS = ['city_id', 'advertiser_id', 'stars', 'week_of_year']
+
+# Written in a cache directory once all its extracts are.
+_CACHE_COMPLETE_FILE = 'COMPLETE'
+
+
+def latest_eval_model(eval_model_dir):
+  """Returns the most recent export under task.py's eval model directory."""
+  versions = [
+      version.strip('/') for version in tf.gfile.ListDirectory(eval_model_dir)
+      if version.strip('/').isdigit()
+  ]
+  if not versions:
+    raise ValueError('No exported eval model found in %s' % eval_model_dir)
+  return os.path.join(eval_model_dir, max(versions, key=int))
+
+
+def _direct_runner_args(pipeline_args, num_workers):
+  """Returns the flags running a DirectRunner on `num_workers` processes.
+
+  Args:
+    pipeline_args: The Beam pipeline arguments given by the user.
+    num_workers: Number of processes of the DirectRunner.
+
+  Returns:
+    The flags to add to `pipeline_args`: none if another runner is selected,
+    and only those the user has not set otherwise.
+  """
+  runner = pipeline_options.PipelineOptions(pipeline_args).view_as(
+      pipeline_options.StandardOptions).runner
+  if runner not in (None, 'DirectRunner', 'direct'):
+    return []
+  args = []
+  if not any(arg.startswith('--direct_num_workers') for arg in pipeline_args):
+    args.append('--direct_num_workers=%d' % num_workers)
+  if not any(arg.startswith('--direct_running_mode')
+             for arg in pipeline_args):
+    args.append('--direct_running_mode=multi_processing')
+  return args
+
+
+def _extracts_dir(cache_dir, eval_model, input_handle):
+  """Returns the cache directory of a (model, data) pair."""
+  return os.path.join(cache_dir,
+                      stage_cache.fingerprint([eval_model, input_handle]))
+
+
+def cache_extracts(input_handle, schema, eval_shared_model, extracts_dir,
+                   pipeline_args):
+  """Runs the model over the eval data and stores the TFMA extracts.
+
+  Args:
+    input_handle: Path to csv file with eval data.
+    schema: The schema of the input data.
+    eval_shared_model: The tfma.EvalSharedModel to run.
+    extracts_dir: Directory in which the pickled extracts are written.
+    pipeline_args: additional DataflowRunner or DirectRunner args passed to the
+      beam pipeline.
+  """
+  csv_coder = bookings.make_csv_coder(schema)
+  proto_coder = bookings.make_proto_coder(schema)
+  predict_extractor = tfma.extractors.PredictExtractor(eval_shared_model)
+  with beam.Pipeline(argv=pipeline_args) as pipeline:
+    _ = (
+        pipeline
+        | 'ReadInputText' >> beam.io.ReadFromText(
+            input_handle, skip_header_lines=1)
+        | 'DecodeCSV' >> beam.Map(csv_coder.decode)
+        | 'EncodeExamples' >> beam.Map(proto_coder.encode)
+        | 'InputsToExtracts' >> tfma.InputsToExtracts()
+        | predict_extractor.stage_name >> predict_extractor.ptransform
+        | 'CountPredicted' >> pipeline_metrics.Instrument('analyze_predict')
+        | 'WriteExtracts' >> beam.io.WriteToTFRecord(
+            os.path.join(extracts_dir, 'extracts'),
+            coder=beam.coders.PickleCoder()))
+  tf.gfile.GFile(os.path.join(extracts_dir, _CACHE_COMPLETE_FILE),
+                 'w').close()
+
+
+def _json_value(value):
+  if isinstance(value, (np.generic, np.ndarray)):
+    return value.tolist()
+  if isinstance(value, (int, float, str, list, dict)) or value is None:
+    return value
+  return str(value)
+
+
+def _format_slice_metrics(slice_key_and_metrics):
+  slice_key, metrics = slice_key_and_metrics
+  return json.dumps({
+      'slice': tfma.slicer.stringify_slice_key(slice_key),
+      'metrics': {name: _json_value(value) for name, value in metrics.items()},
+  }, sort_keys=True)
+
+
+def compute_slice_metrics(eval_shared_model, extracts_dir, slice_columns,
+                          output_dir, pipeline_args):
+  """Computes the metrics of each slice from cached extracts.
+
+  Args:
+    eval_shared_model: The tfma.EvalSharedModel whose metrics are computed.
+    extracts_dir: Directory of the extracts written by `cache_extracts`.
+    slice_columns: Raw feature columns to slice by, one slice spec each, in
+      addition to the overall slice.
+    output_dir: Directory in which `slice_metrics.json` is written, one JSON
+      object per slice and line.
+    pipeline_args: additional DataflowRunner or DirectRunner args passed to the
+      beam pipeline.
+  """
+  slice_spec = [tfma.slicer.SingleSliceSpec()] + [
+      tfma.slicer.SingleSliceSpec(columns=[column]) for column in slice_columns
+  ]
+  slice_extractor = tfma.extractors.SliceKeyExtractor(slice_spec)
+  evaluator = tfma.evaluators.MetricsAndPlotsEvaluator(eval_shared_model)
+  with beam.Pipeline(argv=pipeline_args) as pipeline:
+    evaluation = (
+        pipeline
+        | 'ReadExtracts' >> beam.io.ReadFromTFRecord(
+            os.path.join(extracts_dir, 'extracts-*'),
+            coder=beam.coders.PickleCoder())
+        | slice_extractor.stage_name >> slice_extractor.ptransform
+        | evaluator.stage_name >> evaluator.ptransform)
+    _ = (
+        evaluation[tfma.constants.METRICS_KEY]
+        | 'FormatMetrics' >> beam.Map(_format_slice_metrics)
+        | 'WriteMetrics' >> beam.io.WriteToText(
+            os.path.join(output_dir, 'slice_metrics.json'),
+            shard_name_template=''))
+
+
+def analyze(input_handle,
+            schema_file,
+            eval_model_dir,
+            cache_dir,
+            output_dir,
+            slice_columns=None,
+            pipeline_args=None):
+  """Computes sliced metrics, reusing cached predictions when possible.
+
+  Args:
+    input_handle: Path to csv file with eval data.
+    schema_file: An file path that contains a text-serialized TensorFlow
+      metadata schema of the input data.
+    eval_model_dir: The eval model directory of trainer/task.py, whose latest
+      export is analyzed.
+    cache_dir: Directory holding the cached extracts of each (model, data)
+      fingerprint.
+    output_dir: Directory in which the sliced metrics are written.
+    slice_columns: Raw feature columns to slice by. Defaults to
+      `DEFAULT_SLICE_COLUMNS`.
+    pipeline_args: additional DataflowRunner or DirectRunner args passed to the
+      beam pipeline.
+
+  Returns:
+    A dict with the wall time of each phase and whether the cache was used.
+  """
+  schema = bookings.read_schema(schema_file)
+  eval_model = latest_eval_model(eval_model_dir)
+  eval_shared_model = tfma.default_eval_shared_model(
+      eval_saved_model_path=eval_model)
+  extracts_dir = _extracts_dir(cache_dir, eval_model, input_handle)
+
+  timings = {'cached': tf.gfile.Exists(
+      os.path.join(extracts_dir, _CACHE_COMPLETE_FILE))}
+  start = time.time()
+  if not timings['cached']:
+    if tf.gfile.Exists(extracts_dir):
+      tf.gfile.DeleteRecursively(extracts_dir)
+    cache_extracts(input_handle, schema, eval_shared_model, extracts_dir,
+                   pipeline_args)
+  timings['predict_secs'] = time.time() - start
+
+  start = time.time()
+  compute_slice_metrics(eval_shared_model, extracts_dir,
+                        slice_columns or DEFAULT_SLICE_COLUMNS, output_dir,
+                        pipeline_args)
+  timings['slice_metrics_secs'] = time.time() - start
+  return timings
+
+
+def main():
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Input path to csv file with eval data.', required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--eval_model_dir',
+      help='Eval model directory written by trainer/task.py',
+      required=True)
+  parser.add_argument(
+      '--cache_dir',
+      help='Directory in which model predictions are cached',
+      required=True)
+  parser.add_argument(
+      '--output_dir',
+      help='Directory in which the sliced metrics are written',
+      required=True)
+  parser.add_argument(
+      '--slice_columns',
+      help='Raw feature columns to slice the metrics by',
+      nargs='+',
+      default=DEFAULT_SLICE_COLUMNS)
+  parser.add_argument(
+      '--num_workers',
+      help='Number of processes of the DirectRunner',
+      default=os.cpu_count(),
+      type=int)
+  parser.add_argument(
+      '--metrics_file',
+      help='If set, the wall time of each phase is written to this JSON file.',
+      default=None)
+
+  known_args, pipeline_args = parser.parse_known_args()
+  pipeline_args += _direct_runner_args(pipeline_args, known_args.num_workers)
+  timings = analyze(
+      input_handle=known_args.input,
+      schema_file=known_args.schema_file,
+      eval_model_dir=known_args.eval_model_dir,
+      cache_dir=known_args.cache_dir,
+      output_dir=known_args.output_dir,
+      slice_columns=known_args.slice_columns,
+      pipeline_args=pipeline_args)
+  print('Sliced metrics written to %s (%s)' % (known_args.output_dir,
+                                               json.dumps(timings)))
+  if known_args.metrics_file:
+    pipeline_metrics.write_metrics(known_args.metrics_file, timings)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,158 @@
+"""Reports the accuracy and time saved by analyzing a sample of the data.
+
+preprocess.py is run on the same input with a full analysis and with
+`--analyze_sample_rate` at each of `--sample_rates`, uniformly and, if
+`--stratify_by` is given, stratified. For each sampled run the report holds:
+
+  * seconds_saved: wall time saved against the full analysis.
+  * mean_error / std_error: for each z-scored feature, the error of the
+    sampled mean in units of the full standard deviation, and the relative
+    error of the sampled standard deviation. Both are read back from the
+    transform_fn by transforming rows whose columns are all 0 or all 1.
+  * bucket_mismatch: for each bucketized feature, the fraction of the first
+    `--num_rows` input rows put in another bucket than by the full analysis.
+
+  python analyze_sample_report.py --input ../data/train/train.csv \
+      --schema_file ../data/tfdv_output/schema.pbtxt \
+      --work_dir /tmp/sample_report --sample_rates 0.01 0.1 \
+      --stratify_by week_of_year city_id
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+import benchmark_stages
+import stream_preprocess
+from trainer import bookings
+
+
+def _probe_line(value):
+  return ','.join([value] * len(bookings.CSV_COLUMN_NAMES))
+
+
+def implied_moments(transformer):
+  """Returns the mean and std of each z-scored feature of a transform_fn."""
+  zeros = transformer.run([_probe_line('0')])
+  ones = transformer.run([_probe_line('1')])
+  moments = {}
+  for key in bookings.DENSE_FLOAT_FEATURE_KEYS:
+    name = bookings.transformed_name(key)
+    # z(x) = (x - mean) / std, so z(1) - z(0) = 1 / std.
+    std = 1 / float(ones[name][0] - zeros[name][0])
+    moments[key] = (-float(zeros[name][0]) * std, std)
+  return moments
+
+
+def compare(full_transformer, sampled_transformer, lines):
+  """Returns the statistic errors of a sampled transform_fn."""
+  full_moments = implied_moments(full_transformer)
+  sampled_moments = implied_moments(sampled_transformer)
+  full_outputs = full_transformer.run(lines)
+  sampled_outputs = sampled_transformer.run(lines)
+  report = {'mean_error': {}, 'std_error': {}, 'bucket_mismatch': {}}
+  for key in bookings.DENSE_FLOAT_FEATURE_KEYS:
+    full_mean, full_std = full_moments[key]
+    sampled_mean, sampled_std = sampled_moments[key]
+    report['mean_error'][key] = abs(sampled_mean - full_mean) / full_std
+    report['std_error'][key] = abs(sampled_std / full_std - 1)
+  for key in bookings.BUCKET_FEATURE_KEYS:
+    name = bookings.transformed_name(key)
+    report['bucket_mismatch'][key] = float(
+        np.mean(full_outputs[name] != sampled_outputs[name]))
+  for name in ('mean_error', 'std_error', 'bucket_mismatch'):
+    report['max_' + name] = max(report[name].values())
+  return report
+
+
+def main():
+  tf.logging.set_verbosity(tf.logging.WARN)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Input path to csv file with input data.',
+      required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--work_dir',
+      help='Directory in which the output of each run is written.',
+      required=True)
+  parser.add_argument(
+      '--sample_rates',
+      help='Analysis sample rates to compare with the full analysis',
+      nargs='+',
+      default=[0.01, 0.1],
+      type=float)
+  parser.add_argument(
+      '--stratify_by',
+      help='If set, each rate is also run stratified by these raw columns',
+      nargs='+',
+      default=None)
+  parser.add_argument(
+      '--num_rows', help='Number of rows compared for bucket mismatches',
+      default=10000, type=int)
+  parser.add_argument(
+      '--report', help='Path of the JSON report to write.', default=None)
+  args = parser.parse_args()
+
+  runs = [('full', [])]
+  for rate in args.sample_rates:
+    runs.append(('uniform_%g' % rate, ['--analyze_sample_rate', str(rate)]))
+    if args.stratify_by:
+      runs.append(('stratified_%g' % rate,
+                   ['--analyze_sample_rate', str(rate),
+                    '--analyze_stratify_by'] + args.stratify_by))
+
+  results = {}
+  for name, run_args in runs:
+    output_dir = os.path.join(os.path.abspath(args.work_dir), name)
+    if tf.gfile.Exists(output_dir):
+      tf.gfile.DeleteRecursively(output_dir)
+    results[name] = benchmark_stages.run_stage([
+        sys.executable, 'preprocess.py',
+        '--input', os.path.abspath(args.input),
+        '--schema_file', os.path.abspath(args.schema_file),
+        '--output_dir', output_dir,
+        '--outfile_prefix', 'sample_report',
+        '--runner', 'DirectRunner'] + run_args)
+
+  schema = bookings.read_schema(args.schema_file)
+  with open(args.input) as f:
+    next(f)  # Skip the header line.
+    lines = [line.rstrip('\r\n')
+             for line in itertools.islice(f, args.num_rows)
+             if line.rstrip('\r\n')]
+  full_transformer = stream_preprocess.StreamTransformer(
+      os.path.join(args.work_dir, 'full'), schema)
+  for name, _ in runs[1:]:
+    sampled_transformer = stream_preprocess.StreamTransformer(
+        os.path.join(args.work_dir, name), schema)
+    results[name].update(compare(full_transformer, sampled_transformer, lines))
+    sampled_transformer.close()
+    results[name]['seconds_saved'] = (
+        results['full']['seconds'] - results[name]['seconds'])
+    print('%-18s %.1fs (%.1fs saved), max mean error %.4f std, max std error '
+          '%.2f%%, max bucket mismatch %.2f%%' % (
+              name, results[name]['seconds'], results[name]['seconds_saved'],
+              results[name]['max_mean_error'],
+              100 * results[name]['max_std_error'],
+              100 * results[name]['max_bucket_mismatch']))
+  full_transformer.close()
+
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
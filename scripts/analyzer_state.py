@@ -0,0 +1,273 @@
+"""Mergeable analyzer state for incremental tf.transform analysis.
+
+`preprocessing_fn` needs the mean and variance of every dense float feature
+and quantile boundaries of every bucketized feature. Instead of letting the
+tf.transform analyzers recompute them over the full history, `AnalyzerState`
+keeps their accumulators (count/mean/M2 moments and a weighted quantile
+sketch), which can be computed over a single partition of the data and merged
+with the state stored by a previous run.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import math
+import os
+
+import apache_beam as beam
+import numpy as np
+import tensorflow as tf
+import tensorflow_transform as transform
+
+ANALYZER_STATE_FILE = 'analyzer_state.json'
+
+# Fingerprint of the transform_fn built from the AnalyzerState of a directory.
+TRANSFORM_FN_STAMP_FILE = 'analyzer_state.transform_fn'
+
+# Maximum number of weighted points kept by a quantile sketch.
+DEFAULT_SKETCH_SIZE = 2000
+
+
+class QuantileSketch(object):
+  """A bounded set of weighted points approximating a distribution."""
+
+  def __init__(self, values=(), weights=None, max_size=DEFAULT_SKETCH_SIZE):
+    self.values = np.asarray(values, dtype=np.float64)
+    if weights is None:
+      weights = np.ones_like(self.values)
+    self.weights = np.asarray(weights, dtype=np.float64)
+    self.max_size = max_size
+    self._compress()
+
+  def _compress(self):
+    order = np.argsort(self.values, kind='mergesort')
+    self.values = self.values[order]
+    self.weights = self.weights[order]
+    if len(self.values) <= self.max_size:
+      return
+    # Group the points into max_size bins of (roughly) equal weight, and
+    # replace each bin with its weighted mean.
+    cumulative = np.cumsum(self.weights) - self.weights
+    bins = np.floor(cumulative / cumulative[-1] * self.max_size)
+    bins = np.minimum(bins, self.max_size - 1)
+    starts = np.flatnonzero(np.diff(bins, prepend=-1))
+    weights = np.add.reduceat(self.weights, starts)
+    self.values = np.add.reduceat(self.values * self.weights, starts) / weights
+    self.weights = weights
+
+  def merge(self, other):
+    return QuantileSketch(
+        np.concatenate([self.values, other.values]),
+        np.concatenate([self.weights, other.weights]),
+        max(self.max_size, other.max_size))
+
+  def quantiles(self, ranks):
+    """Returns the values at the given ranks, each in [0, 1]."""
+    if not len(self.values):
+      return [0.0] * len(ranks)
+    cumulative = np.cumsum(self.weights) - self.weights / 2
+    return list(np.interp(np.asarray(ranks) * self.weights.sum(),
+                          cumulative, self.values))
+
+  def to_dict(self):
+    return {'values': self.values.tolist(), 'weights': self.weights.tolist(),
+            'max_size': self.max_size}
+
+  @classmethod
+  def from_dict(cls, value):
+    return cls(value['values'], value['weights'], value['max_size'])
+
+
+class AnalyzerState(object):
+  """Accumulators for the z-score and bucketize analyzers, by feature key."""
+
+  def __init__(self, moments=None, sketches=None):
+    # Maps a feature key to its [count, mean, M2] moments.
+    self.moments = moments or {}
+    # Maps a feature key to a QuantileSketch.
+    self.sketches = sketches or {}
+
+  @classmethod
+  def from_values(cls, moment_values, sketch_values):
+    """Builds the state of a single batch of values.
+
+    Args:
+      moment_values: A map from feature key to values whose mean and variance
+        are tracked.
+      sketch_values: A map from feature key to values whose quantiles are
+        tracked.
+
+    Returns:
+      An AnalyzerState.
+    """
+    moments = {}
+    for key, values in moment_values.items():
+      values = np.asarray(values, dtype=np.float64)
+      if len(values):
+        mean = values.mean()
+        moments[key] = [len(values), mean, ((values - mean)**2).sum()]
+      else:
+        moments[key] = [0, 0.0, 0.0]
+    sketches = {key: QuantileSketch(values)
+                for key, values in sketch_values.items()}
+    return cls(moments, sketches)
+
+  def merge(self, other):
+    """Returns the state of the union of the data behind self and other."""
+    moments = dict(self.moments)
+    for key, (count_b, mean_b, m2_b) in other.moments.items():
+      count_a, mean_a, m2_a = moments.get(key, (0, 0.0, 0.0))
+      count = count_a + count_b
+      if not count:
+        moments[key] = [0, 0.0, 0.0]
+        continue
+      delta = mean_b - mean_a
+      moments[key] = [
+          count, mean_a + delta * count_b / count,
+          m2_a + m2_b + delta**2 * count_a * count_b / count
+      ]
+    sketches = dict(self.sketches)
+    for key, sketch in other.sketches.items():
+      sketches[key] = sketches[key].merge(sketch) if key in sketches else sketch
+    return AnalyzerState(moments, sketches)
+
+  def mean_and_var(self, key):
+    count, mean, m2 = self.moments[key]
+    return mean, m2 / count if count else 0.0
+
+  def bucket_boundaries(self, key, num_buckets):
+    ranks = [i / num_buckets for i in range(1, num_buckets)]
+    return self.sketches[key].quantiles(ranks)
+
+  def scale_to_z_score(self, x, key):
+    """Constant-folded equivalent of `tft.scale_to_z_score`."""
+    mean, var = self.mean_and_var(key)
+    x = tf.cast(x, tf.float32) - mean
+    if var > 0:
+      x /= math.sqrt(var)
+    return x
+
+  def bucketize(self, x, key, num_buckets):
+    """Constant-folded equivalent of `tft.bucketize`."""
+    boundaries = tf.constant(self.bucket_boundaries(key, num_buckets),
+                             dtype=tf.float32)
+    return transform.apply_buckets(tf.cast(x, tf.float32), boundaries)
+
+  def to_json(self):
+    return json.dumps({
+        'moments': self.moments,
+        'sketches': {key: sketch.to_dict()
+                     for key, sketch in self.sketches.items()},
+    })
+
+  @classmethod
+  def from_json(cls, contents):
+    value = json.loads(contents)
+    return cls(value['moments'],
+               {key: QuantileSketch.from_dict(sketch)
+                for key, sketch in value['sketches'].items()})
+
+  def write(self, path):
+    tf.gfile.MakeDirs(path)
+    with tf.gfile.GFile(_state_file(path), 'w') as f:
+      f.write(self.to_json())
+
+  @classmethod
+  def read(cls, path):
+    with tf.gfile.GFile(_state_file(path)) as f:
+      return cls.from_json(f.read())
+
+
+def _state_file(path):
+  return os.path.join(path, ANALYZER_STATE_FILE)
+
+
+def transform_fn_fingerprint(transform_dir):
+  """Returns a digest of the files of the transform_fn in a directory."""
+  transform_fn_dir = os.path.join(
+      transform_dir, transform.TFTransformOutput.TRANSFORM_FN_DIR)
+  digest = hashlib.sha256()
+  for root, _, names in sorted(tf.gfile.Walk(transform_fn_dir)):
+    for name in sorted(names):
+      path = os.path.join(root, name)
+      digest.update(os.path.relpath(path, transform_fn_dir).encode('utf-8'))
+      with tf.gfile.GFile(path, 'rb') as f:
+        digest.update(f.read())
+  return digest.hexdigest()
+
+
+def stamp_transform_fn(transform_dir):
+  """Records that the transform_fn of a directory was built from its state.
+
+  Call once both the AnalyzerState and the transform_fn are written.
+  """
+  with tf.gfile.GFile(os.path.join(transform_dir, TRANSFORM_FN_STAMP_FILE),
+                      'w') as f:
+    f.write(transform_fn_fingerprint(transform_dir))
+
+
+def matches_transform_fn(transform_dir):
+  """Returns whether the AnalyzerState of a directory built its transform_fn.
+
+  A state left by an earlier --local_fast or --incremental run is not trusted
+  once another run has overwritten the transform_fn alone.
+  """
+  stamp_file = os.path.join(transform_dir, TRANSFORM_FN_STAMP_FILE)
+  if not (tf.gfile.Exists(_state_file(transform_dir)) and
+          tf.gfile.Exists(stamp_file)):
+    return False
+  with tf.gfile.GFile(stamp_file) as f:
+    return f.read().strip() == transform_fn_fingerprint(transform_dir)
+
+
+def _scalar_value(value):
+  """Returns an instance value as a float, with missing values as 0."""
+  value = np.asarray(value).ravel()
+  return float(value[0]) if len(value) else 0.0
+
+
+class AnalyzerStateCombineFn(beam.CombineFn):
+  """Combines tf.transform instance dicts into an AnalyzerState.
+
+  Missing values count as 0, as `preprocessing_fn` fills them in before
+  analysis.
+  """
+
+  def __init__(self, moment_keys, sketch_keys, buffer_size=100000):
+    super(AnalyzerStateCombineFn, self).__init__()
+    self._moment_keys = moment_keys
+    self._sketch_keys = sketch_keys
+    self._buffer_size = buffer_size
+
+  def _flush(self, accumulator):
+    state, buffer = accumulator
+    if buffer:
+      columns = np.array(buffer, dtype=np.float64).T
+      num_moments = len(self._moment_keys)
+      state = state.merge(AnalyzerState.from_values(
+          dict(zip(self._moment_keys, columns[:num_moments])),
+          dict(zip(self._sketch_keys, columns[num_moments:]))))
+    return [state, []]
+
+  def create_accumulator(self):
+    return [AnalyzerState(), []]
+
+  def add_input(self, accumulator, instance):
+    accumulator[1].append([
+        _scalar_value(instance[key])
+        for key in self._moment_keys + self._sketch_keys
+    ])
+    if len(accumulator[1]) >= self._buffer_size:
+      accumulator = self._flush(accumulator)
+    return accumulator
+
+  def merge_accumulators(self, accumulators):
+    merged = AnalyzerState()
+    for accumulator in accumulators:
+      merged = merged.merge(self._flush(accumulator)[0])
+    return [merged, []]
+
+  def extract_output(self, accumulator):
+    return self._flush(accumulator)[0]
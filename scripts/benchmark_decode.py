@@ -0,0 +1,79 @@
+"""Compares per-row CsvCoder decoding with block-wise NumPy decoding."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import itertools
+import time
+
+import tensorflow as tf
+
+import batched_csv
+from trainer import bookings
+
+
+def _read_lines(input_path, max_rows):
+  with tf.gfile.GFile(input_path) as f:
+    next(f)  # Skip the header line.
+    return [line.rstrip('\n') for line in itertools.islice(f, max_rows)]
+
+
+def _rows_per_sec(decode_fn, lines, repeats):
+  best = float('inf')
+  for _ in range(repeats):
+    start = time.time()
+    decode_fn(lines)
+    best = min(best, time.time() - start)
+  return len(lines) / best
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Path to csv file with input data.', required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--max_rows', help='Number of rows to decode', default=100000, type=int)
+  parser.add_argument(
+      '--batch_sizes',
+      help='Block sizes to benchmark for the batched decoder',
+      nargs='+',
+      default=[100, 1000, 10000],
+      type=int)
+  parser.add_argument(
+      '--repeats', help='Number of timed runs per decoder', default=3,
+      type=int)
+  args = parser.parse_args()
+
+  schema = bookings.read_schema(args.schema_file)
+  raw_feature_spec = bookings.get_raw_feature_spec(schema)
+  lines = _read_lines(args.input, args.max_rows)
+  print('Decoding %d rows.' % len(lines))
+
+  csv_coder = bookings.make_csv_coder(schema)
+  baseline = _rows_per_sec(
+      lambda block: [csv_coder.decode(line) for line in block], lines,
+      args.repeats)
+  print('CsvCoder: %.0f rows/sec' % baseline)
+
+  for batch_size in args.batch_sizes:
+
+    def decode_blocks(block, batch_size=batch_size):
+      for start in range(0, len(block), batch_size):
+        for _ in batched_csv.columns_to_instances(
+            batched_csv.decode_csv_block(
+                block[start:start + batch_size], bookings.CSV_COLUMN_NAMES,
+                raw_feature_spec),
+            raw_feature_spec):
+          pass
+
+    rate = _rows_per_sec(decode_blocks, lines, args.repeats)
+    print('Batched (batch_size=%d): %.0f rows/sec (%.1fx)' %
+          (batch_size, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+  main()
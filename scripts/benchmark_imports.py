@@ -0,0 +1,118 @@
+"""Measures the cold-start time of each pipeline entry point.
+
+For every entry point two commands are timed, each in a fresh interpreter:
+
+  * help:   `<script> --help`, i.e. the time before the flags are checked.
+  * import: importing the modules the entry point needs for its work, i.e.
+            the time before the first useful line of the job runs.
+
+The slowest top-level packages of the import, as `python -X importtime`
+reports them, are listed with each entry point.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Entry point: (directory it runs from, script, modules its work imports).
+ENTRY_POINTS = collections.OrderedDict([
+    ('tfdv', ('.', 'tfdv_bookings.py',
+              ['tfdv_bookings', 'tensorflow_data_validation',
+               'columnar_cache'])),
+    ('preprocess', ('.', 'preprocess.py', ['preprocess_pipeline'])),
+    ('train', ('trainer', 'task.py', ['task'])),
+    ('score', ('.', 'score.py', ['score'])),
+    ('serve', ('.', 'serve.py', ['serve'])),
+])
+
+
+def _run_secs(args, cwd):
+  start = time.time()
+  subprocess.check_call(args, cwd=cwd, stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL)
+  return time.time() - start
+
+
+def _slowest_packages(modules, cwd, top):
+  """Returns the packages with the largest cumulative import time, in ms."""
+  output = subprocess.run(
+      [sys.executable, '-X', 'importtime', '-c',
+       'import ' + ', '.join(modules)],
+      cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+      universal_newlines=True, check=True).stderr
+  packages = {}
+  for line in output.splitlines():
+    # import time: self [us] | cumulative | imported package
+    fields = line.split('|')
+    if len(fields) != 3 or not fields[0].startswith('import time:'):
+      continue
+    name = fields[2].rstrip()
+    if name.startswith(' ') and not name.startswith('  '):
+      # One leading space marks a package imported at the top level.
+      try:
+        packages[name.strip()] = int(fields[1]) / 1000
+      except ValueError:
+        continue  # The header line.
+  return sorted(packages.items(), key=lambda item: -item[1])[:top]
+
+
+def benchmark(name, repeats, top):
+  """Returns the median help and import times of an entry point."""
+  directory, script, modules = ENTRY_POINTS[name]
+  cwd = os.path.join(SCRIPTS_DIR, directory)
+  help_secs = [
+      _run_secs([sys.executable, script, '--help'], cwd)
+      for _ in range(repeats)
+  ]
+  import_secs = [
+      _run_secs([sys.executable, '-c', 'import ' + ', '.join(modules)], cwd)
+      for _ in range(repeats)
+  ]
+  return {
+      'help_secs': statistics.median(help_secs),
+      'import_secs': statistics.median(import_secs),
+      'slowest_packages_ms': _slowest_packages(modules, cwd, top),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--entry_points',
+      help='Entry points to benchmark',
+      nargs='+',
+      choices=list(ENTRY_POINTS),
+      default=list(ENTRY_POINTS))
+  parser.add_argument(
+      '--repeats', help='Runs of each command', default=3, type=int)
+  parser.add_argument(
+      '--top', help='Number of slowest packages listed', default=5, type=int)
+  parser.add_argument(
+      '--report', help='Path of the JSON report to write.', default=None)
+  args = parser.parse_args()
+
+  results = {}
+  for name in args.entry_points:
+    result = benchmark(name, args.repeats, args.top)
+    results[name] = result
+    print('%-10s --help %.2fs, import %.2fs (%s)' % (
+        name, result['help_secs'], result['import_secs'], ', '.join(
+            '%s %.0fms' % package
+            for package in result['slowest_packages_ms'])))
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
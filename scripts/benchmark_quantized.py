@@ -0,0 +1,117 @@
+"""Compares the float32 serving export with its reduced-precision variants.
+
+Each export written by trainer/task.py or quantize_export.py is loaded in its
+own process, so that the peak RSS of the process reflects that export alone.
+The process reports the median latency of a batch of tf.Examples; its wall
+time, peak RSS and the size of the export on disk complete the report.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+import tensorflow as tf
+
+import benchmark_signatures
+import benchmark_stages
+import quantize_export
+import serve
+from trainer import bookings
+
+
+def measure(args):
+  """Loads one export and writes its median batch latency to a JSON file."""
+  encoder = serve.ExampleEncoder(bookings.read_schema(args.schema_file))
+  with open(args.input) as f:
+    reader = csv.DictReader(f, fieldnames=bookings.CSV_COLUMN_NAMES)
+    next(reader)  # Skip the header line.
+    rows = list(itertools.islice(reader, args.batch_size * args.num_batches))
+  examples = [encoder.encode(row) for row in rows]
+  batches = [
+      examples[i:i + args.batch_size]
+      for i in range(0, len(examples), args.batch_size)
+  ]
+
+  start = time.time()
+  predict = serve.load_predict_fn(
+      serve.latest_export_dir(args.serving_model_dir, args.measure))
+  load_secs = time.time() - start
+  with open(args.result_file, 'w') as f:
+    json.dump({
+        'load_secs': load_secs,
+        'batch_ms': benchmark_signatures.median_batch_ms(
+            predict, batches, args.repeats),
+    }, f)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Path to csv file with rows to predict.', required=True)
+  parser.add_argument(
+      '--serving_model_dir',
+      help='Directory holding the export/ models of the trainer.',
+      required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--precisions',
+      help='Reduced-precision variants to compare with the float32 export',
+      nargs='+',
+      choices=quantize_export.PRECISIONS,
+      default=list(quantize_export.PRECISIONS))
+  parser.add_argument('--batch_size', default=128, type=int)
+  parser.add_argument('--num_batches', default=20, type=int)
+  parser.add_argument('--repeats', default=5, type=int)
+  parser.add_argument(
+      '--report', help='Path of the JSON report to write.', default=None)
+  # Internal: measures a single export in the current process.
+  parser.add_argument('--measure', default=None, help=argparse.SUPPRESS)
+  parser.add_argument('--result_file', default=None, help=argparse.SUPPRESS)
+  args = parser.parse_args()
+
+  if args.measure:
+    measure(args)
+    return
+
+  export_names = [serve.EXPORT_NAME] + [
+      quantize_export.export_name(precision) for precision in args.precisions
+  ]
+  results = {}
+  for export_name in export_names:
+    export_dir = serve.latest_export_dir(args.serving_model_dir, export_name)
+    with tempfile.NamedTemporaryFile(suffix='.json') as result_file:
+      result = benchmark_stages.run_stage([
+          sys.executable, 'benchmark_quantized.py',
+          '--input', os.path.abspath(args.input),
+          '--serving_model_dir', os.path.abspath(args.serving_model_dir),
+          '--schema_file', os.path.abspath(args.schema_file),
+          '--batch_size', str(args.batch_size),
+          '--num_batches', str(args.num_batches),
+          '--repeats', str(args.repeats),
+          '--measure', export_name,
+          '--result_file', result_file.name])
+      result.update(json.load(result_file))
+    result['export_mb'] = quantize_export.export_size(export_dir) / 2**20
+    results[export_name] = result
+    print('%s: %.2f ms/batch, loaded in %.2fs, peak RSS %.0f MB, '
+          '%.1f MB on disk' % (export_name, result['batch_ms'],
+                               result['load_secs'], result['peak_rss_mb'],
+                               result['export_mb']))
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  tf.logging.set_verbosity(tf.logging.WARN)
+  main()
@@ -0,0 +1,76 @@
+"""Measures rows/sec of score.py as the number of DirectRunner workers grows.
+
+Each worker count runs score.py in its own process with the multi-processing
+DirectRunner, so that every worker loads the model once.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+import benchmark_stages
+
+
+def _count_rows(input_path):
+  with open(input_path) as f:
+    return sum(1 for _ in f) - 1
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Path to csv file with input data.', required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--serving_model_dir',
+      help='Serving model directory written by trainer/task.py',
+      required=True)
+  parser.add_argument(
+      '--work_dir',
+      help='Directory in which the predictions are written.',
+      required=True)
+  parser.add_argument(
+      '--num_workers',
+      help='Numbers of DirectRunner workers to benchmark',
+      nargs='+',
+      default=[1, 2, 4, 8],
+      type=int)
+  parser.add_argument(
+      '--batch_size', help='Rows run through the model at once', default=256,
+      type=int)
+  parser.add_argument(
+      '--report', help='Path of the JSON report to write.', default=None)
+  args = parser.parse_args()
+
+  num_rows = _count_rows(args.input)
+  results = {}
+  for num_workers in args.num_workers:
+    result = benchmark_stages.run_stage([
+        sys.executable, 'score.py',
+        '--input', os.path.abspath(args.input),
+        '--schema_file', os.path.abspath(args.schema_file),
+        '--serving_model_dir', os.path.abspath(args.serving_model_dir),
+        '--output_prefix', os.path.join(
+            os.path.abspath(args.work_dir), 'workers_%d' % num_workers,
+            'predictions'),
+        '--batch_size', str(args.batch_size),
+        '--runner', 'DirectRunner',
+        '--direct_num_workers', str(num_workers),
+        '--direct_running_mode', 'multi_processing'])
+    result['rows_per_sec'] = num_rows / result['seconds']
+    results[str(num_workers)] = result
+    print('%d workers: %.1fs, %.0f rows/sec' % (num_workers, result['seconds'],
+                                               result['rows_per_sec']))
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,100 @@
+"""Load generator reporting client-side latency and QPS of serve.py."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import csv
+import itertools
+import json
+import threading
+import time
+
+from urllib import request
+
+import numpy as np
+
+from trainer import bookings
+
+
+def _read_rows(input_path, max_rows):
+  with open(input_path) as f:
+    reader = csv.DictReader(f, fieldnames=bookings.CSV_COLUMN_NAMES)
+    next(reader)  # Skip the header line.
+    return list(itertools.islice(reader, max_rows))
+
+
+def _post(url, rows):
+  body = json.dumps({'instances': rows}).encode('utf-8')
+  req = request.Request(url, body, {'Content-Type': 'application/json'})
+  with request.urlopen(req) as response:
+    return json.loads(response.read())
+
+
+def _get_stats(url):
+  with request.urlopen(url + '/stats') as response:
+    return json.loads(response.read())
+
+
+def run_load(url, rows, concurrency, requests_per_client, rows_per_request):
+  """Sends requests from concurrent clients and returns their latencies."""
+  latencies = []
+  lock = threading.Lock()
+
+  def client(offset):
+    own = []
+    for i in range(requests_per_client):
+      start = (offset + i * rows_per_request) % len(rows)
+      batch = rows[start:start + rows_per_request]
+      begin = time.time()
+      _post(url, batch)
+      own.append(time.time() - begin)
+    with lock:
+      latencies.extend(own)
+
+  threads = [
+      threading.Thread(target=client, args=(i * requests_per_client,))
+      for i in range(concurrency)
+  ]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return np.array(latencies), time.time() - start
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Path to csv file with rows to send.', required=True)
+  parser.add_argument(
+      '--url', help='Server address', default='http://localhost:8500')
+  parser.add_argument(
+      '--concurrency',
+      help='Numbers of concurrent clients to benchmark',
+      nargs='+',
+      default=[1, 8, 32],
+      type=int)
+  parser.add_argument(
+      '--requests_per_client', default=200, type=int)
+  parser.add_argument(
+      '--rows_per_request', default=1, type=int)
+  parser.add_argument(
+      '--max_rows', default=10000, type=int)
+  args = parser.parse_args()
+
+  rows = _read_rows(args.input, args.max_rows)
+  for concurrency in args.concurrency:
+    latencies, elapsed = run_load(args.url + '/predict', rows, concurrency,
+                                  args.requests_per_client,
+                                  args.rows_per_request)
+    latencies *= 1000
+    print('concurrency=%d: %.0f QPS, p50 %.2f ms, p99 %.2f ms' %
+          (concurrency, len(latencies) / elapsed,
+           np.percentile(latencies, 50), np.percentile(latencies, 99)))
+  print('Server stats: %s' % _get_stats(args.url))
+
+
+if __name__ == '__main__':
+  main()
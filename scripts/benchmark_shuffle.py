@@ -0,0 +1,71 @@
+"""Measures wall time and peak memory of preprocess.py per shuffle strategy.
+
+Each strategy of `preprocess.py --shuffle` is run on the same input, applying
+an existing transform function so that only the transform, shuffle and write
+phases are timed.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+import benchmark_stages
+import preprocess
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Path to csv file with input data.', required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--transform_dir',
+      help='Directory in which the transform output is located',
+      required=True)
+  parser.add_argument(
+      '--work_dir',
+      help='Directory in which the output of each strategy is written.',
+      required=True)
+  parser.add_argument(
+      '--strategies',
+      help='Shuffle strategies to benchmark',
+      nargs='+',
+      choices=preprocess.SHUFFLE_STRATEGIES,
+      default=list(preprocess.SHUFFLE_STRATEGIES))
+  parser.add_argument(
+      '--shuffle_buffer_size',
+      help='Number of raw lines buffered per worker by the local strategy.',
+      default=preprocess.DEFAULT_LOCAL_SHUFFLE_BUFFER_SIZE,
+      type=int)
+  parser.add_argument(
+      '--report', help='Path of the JSON report to write.', default=None)
+  args = parser.parse_args()
+
+  results = {}
+  for strategy in args.strategies:
+    results[strategy] = benchmark_stages.run_stage([
+        sys.executable, 'preprocess.py',
+        '--input', os.path.abspath(args.input),
+        '--schema_file', os.path.abspath(args.schema_file),
+        '--transform_dir', os.path.abspath(args.transform_dir),
+        '--output_dir', os.path.join(os.path.abspath(args.work_dir), strategy),
+        '--outfile_prefix', 'train_transformed',
+        '--shuffle', strategy,
+        '--shuffle_buffer_size', str(args.shuffle_buffer_size),
+        '--runner', 'DirectRunner'])
+    print('%s: %.1fs, peak RSS %.0f MB' % (strategy,
+                                            results[strategy]['seconds'],
+                                            results[strategy]['peak_rss_mb']))
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,91 @@
+"""Compares per-batch latency of the tf.Example and dense serving exports."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import csv
+import itertools
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import serve
+from trainer import bookings
+
+DENSE_EXPORT_NAME = 'bookings_dense'
+
+
+def median_batch_ms(predict, batches, repeats):
+  """Returns the median latency of `predict` on a batch, in milliseconds."""
+  predict(batches[0])  # Warm up.
+  timings = []
+  for _ in range(repeats):
+    for batch in batches:
+      start = time.time()
+      predict(batch)
+      timings.append(time.time() - start)
+  return np.median(timings) * 1000
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Path to csv file with rows to predict.', required=True)
+  parser.add_argument(
+      '--serving_model_dir',
+      help='Directory holding the export/ models of the trainer.',
+      required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--batch_sizes', nargs='+', default=[1, 16, 128, 1024], type=int)
+  parser.add_argument('--num_batches', default=20, type=int)
+  parser.add_argument('--repeats', default=5, type=int)
+  args = parser.parse_args()
+
+  schema = bookings.read_schema(args.schema_file)
+  encoder = serve.ExampleEncoder(schema)
+  raw_feature_spec = bookings.get_raw_feature_spec(schema)
+
+  example_predict = serve.load_predict_fn(
+      serve.latest_export_dir(args.serving_model_dir))
+  dense_predictor = tf.contrib.predictor.from_saved_model(
+      serve.latest_export_dir(args.serving_model_dir, DENSE_EXPORT_NAME),
+      signature_def_key=serve.SIGNATURE_KEY)
+  dense_keys = list(dense_predictor.feed_tensors.keys())
+
+  def dense_predict(rows):
+    typed_rows = [encoder.typed_row(row) for row in rows]
+    return dense_predictor({
+        key: np.array([row.get(key, 0) for row in typed_rows],
+                      dtype=raw_feature_spec[key].dtype.as_numpy_dtype)
+        for key in dense_keys
+    })
+
+  def example_predict_rows(rows):
+    return example_predict([encoder.encode(row) for row in rows])
+
+  with open(args.input) as f:
+    reader = csv.DictReader(f, fieldnames=bookings.CSV_COLUMN_NAMES)
+    next(reader)  # Skip the header line.
+    rows = list(itertools.islice(
+        reader, max(args.batch_sizes) * args.num_batches))
+
+  for batch_size in args.batch_sizes:
+    batches = [
+        rows[i:i + batch_size]
+        for i in range(0, batch_size * args.num_batches, batch_size)
+        if rows[i:i + batch_size]
+    ]
+    example_ms = median_batch_ms(example_predict_rows, batches, args.repeats)
+    dense_ms = median_batch_ms(dense_predict, batches, args.repeats)
+    print('batch_size=%d: tf.Example %.2f ms/batch, dense %.2f ms/batch '
+          '(%.1fx)' % (batch_size, example_ms, dense_ms,
+                       example_ms / dense_ms))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,171 @@
+"""Times each pipeline stage on synthetic data of increasing size.
+
+For every requested size, synthetic train and eval CSVs are generated and the
+stages are run as separate processes, each from the scripts/ directory:
+
+  * tfdv:       tfdv_bookings.py computing stats and inferring the schema.
+  * preprocess: preprocess.py analyzing and transforming the train data.
+  * transform:  preprocess.py applying the stored transform_fn to the same
+                data, so that analyze time ~= preprocess - transform.
+  * train:      trainer/task.py.
+
+Wall time, throughput and peak RSS of each stage are written to a JSON report
+that can be diffed across commits.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import generate_data
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_stage(args, cwd=SCRIPTS_DIR):
+  """Runs a command and returns its wall time and peak resident memory.
+
+  Args:
+    args: The command to run, as a list of strings.
+    cwd: Directory to run the command from.
+
+  Returns:
+    A dict with the `seconds` and `peak_rss_mb` of the command. Memory of the
+    command's own sub-processes (e.g. multi-process runner workers) is not
+    included.
+
+  Raises:
+    subprocess.CalledProcessError: If the command fails.
+  """
+  start = time.time()
+  process = subprocess.Popen(args, cwd=cwd)
+  _, status, rusage = os.wait4(process.pid, 0)
+  seconds = time.time() - start
+  if os.WIFSIGNALED(status):
+    process.returncode = -os.WTERMSIG(status)
+  else:
+    process.returncode = os.WEXITSTATUS(status)
+  if process.returncode:
+    raise subprocess.CalledProcessError(process.returncode, args)
+  # ru_maxrss is reported in kilobytes on Linux.
+  return {'seconds': seconds, 'peak_rss_mb': rusage.ru_maxrss / 1024}
+
+
+def _with_throughput(result, num_rows):
+  result['rows_per_sec'] = num_rows / result['seconds']
+  return result
+
+
+def benchmark_size(work_dir, num_rows, train_steps):
+  """Runs all stages on `num_rows` synthetic rows and returns their results."""
+  data_dir = os.path.join(work_dir, str(num_rows))
+  tfdv_dir = os.path.join(data_dir, 'tfdv_output')
+  train_dir = os.path.join(data_dir, 'train')
+  eval_dir = os.path.join(data_dir, 'eval')
+  for path in (tfdv_dir, train_dir, eval_dir):
+    os.makedirs(path)
+  train_csv = os.path.join(train_dir, 'train.csv')
+  eval_csv = os.path.join(eval_dir, 'eval.csv')
+  num_eval_rows = max(1, num_rows // 10)
+  generate_data.generate(train_csv, num_rows, seed=0)
+  generate_data.generate(eval_csv, num_eval_rows, seed=1)
+  schema_path = os.path.join(tfdv_dir, 'schema.pbtxt')
+  output_dir = os.path.join(train_dir, 'bookings_output')
+  python = sys.executable
+
+  results = {}
+  results['tfdv'] = _with_throughput(run_stage([
+      python, 'tfdv_bookings.py',
+      '--input', train_csv,
+      '--stats_path', os.path.join(tfdv_dir, 'train_stats.tfrecord'),
+      '--infer_schema',
+      '--schema_path', schema_path,
+      '--runner', 'DirectRunner']), num_rows)
+  results['preprocess'] = _with_throughput(run_stage([
+      python, 'preprocess.py',
+      '--input', train_csv,
+      '--schema_file', schema_path,
+      '--output_dir', output_dir,
+      '--outfile_prefix', 'train_transformed',
+      '--runner', 'DirectRunner']), num_rows)
+  results['transform'] = _with_throughput(run_stage([
+      python, 'preprocess.py',
+      '--input', train_csv,
+      '--schema_file', schema_path,
+      '--output_dir', os.path.join(train_dir, 'transform_only'),
+      '--outfile_prefix', 'train_transformed',
+      '--transform_dir', output_dir,
+      '--runner', 'DirectRunner']), num_rows)
+  results['analyze'] = {
+      'seconds': max(0.0, results['preprocess']['seconds'] -
+                     results['transform']['seconds'])
+  }
+  _ = run_stage([
+      python, 'preprocess.py',
+      '--input', eval_csv,
+      '--schema_file', schema_path,
+      '--output_dir', os.path.join(eval_dir, 'bookings_output'),
+      '--outfile_prefix', 'eval_transformed',
+      '--transform_dir', output_dir,
+      '--runner', 'DirectRunner'])
+  results['train'] = run_stage([
+      python, 'trainer/task.py',
+      '--train-files'] + glob.glob(
+          os.path.join(output_dir, 'train_transformed-*')) + [
+      '--eval-files'] + glob.glob(
+          os.path.join(eval_dir, 'bookings_output', 'eval_transformed-*')) + [
+      '--job-dir', os.path.join(output_dir, 'trainer_output'),
+      '--train-steps', str(train_steps),
+      '--tf-transform-dir', output_dir,
+      '--output-dir', output_dir,
+      '--schema-file', schema_path])
+  results['train']['steps_per_sec'] = (
+      train_steps / results['train']['seconds'])
+  return results
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--work_dir',
+      help='Empty directory in which data and outputs are generated.',
+      required=True)
+  parser.add_argument(
+      '--sizes',
+      help='Numbers of rows to benchmark',
+      nargs='+',
+      default=[1000000, 10000000, 100000000],
+      type=int)
+  parser.add_argument(
+      '--train_steps', help='Training steps per size', default=1000,
+      type=int)
+  parser.add_argument(
+      '--report', help='Path of the JSON report to write.', required=True)
+  args = parser.parse_args()
+
+  report = {
+      'timestamp': datetime.datetime.utcnow().isoformat(),
+      'host': {'platform': platform.platform(), 'cpus': os.cpu_count()},
+      'train_steps': args.train_steps,
+      'sizes': {},
+  }
+  for num_rows in args.sizes:
+    print('Benchmarking %d rows...' % num_rows)
+    report['sizes'][str(num_rows)] = benchmark_size(
+        os.path.abspath(args.work_dir), num_rows, args.train_steps)
+    with open(args.report, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+  print('Report written to %s' % args.report)
+
+
+if __name__ == '__main__':
+  main()
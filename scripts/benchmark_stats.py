@@ -0,0 +1,126 @@
+"""Times sampled and per-partition statistics against a full scan.
+
+The input CSV is split into `--num_partitions` files. The following modes are
+then timed, each as a separate tfdv_bookings.py process:
+
+  * full:         stats over the whole input.
+  * sample_rate:  stats over a `--sample_rate` fraction of the examples.
+  * sample_count: stats over a reservoir of `--sample_count` examples.
+  * partition:    stats of the last partition merged with the stored stats of
+                  the others, i.e. the cost of a new daily or weekly drop.
+
+For each mode, the largest relative error of the feature means is reported
+against the full scan.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+import tensorflow_data_validation as tfdv
+
+import benchmark_stages
+
+
+def split_csv(input_path, output_dir, num_partitions):
+  """Splits a CSV file into partitions of consecutive rows with its header."""
+  with open(input_path) as f:
+    header = next(f)
+    lines = f.readlines()
+  paths = []
+  size = -(-len(lines) // num_partitions)
+  for i in range(num_partitions):
+    path = os.path.join(output_dir, 'partition-%03d.csv' % i)
+    with open(path, 'w') as f:
+      f.write(header)
+      f.writelines(lines[i * size:(i + 1) * size])
+    paths.append(path)
+  return paths
+
+
+def _means(stats_path):
+  stats = tfdv.load_statistics(stats_path)
+  return {
+      feature.name: feature.num_stats.mean
+      for feature in stats.datasets[0].features
+      if feature.WhichOneof('stats') == 'num_stats'
+  }
+
+
+def max_mean_error(stats_path, reference_path):
+  """Returns the largest relative error of the feature means."""
+  means = _means(stats_path)
+  reference = _means(reference_path)
+  return max(
+      abs(means[name] - value) / max(abs(value), 1e-9)
+      for name, value in reference.items() if name in means)
+
+
+def _tfdv(input_path, stats_path, *args):
+  return benchmark_stages.run_stage([
+      sys.executable, 'tfdv_bookings.py',
+      '--input', input_path,
+      '--stats_path', stats_path,
+      '--runner', 'DirectRunner'] + list(args))
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Path to csv file with input data.', required=True)
+  parser.add_argument(
+      '--work_dir',
+      help='Empty directory in which partitions and stats are written.',
+      required=True)
+  parser.add_argument(
+      '--num_partitions', help='Number of partitions', default=7, type=int)
+  parser.add_argument(
+      '--sample_rate', help='Sampling rate to time', default=0.1, type=float)
+  parser.add_argument(
+      '--sample_count', help='Reservoir size to time', default=100000,
+      type=int)
+  parser.add_argument(
+      '--report', help='Path of the JSON report to write.', default=None)
+  args = parser.parse_args()
+
+  input_path = os.path.abspath(args.input)
+  work_dir = os.path.abspath(args.work_dir)
+  partition_dir = os.path.join(work_dir, 'partitions')
+  partition_stats_dir = os.path.join(work_dir, 'partition_stats')
+  os.makedirs(partition_dir)
+  partitions = split_csv(input_path, partition_dir, args.num_partitions)
+
+  full_path = os.path.join(work_dir, 'full.tfrecord')
+  results = {'full': _tfdv(input_path, full_path)}
+  results['sample_rate'] = _tfdv(
+      input_path, os.path.join(work_dir, 'sample_rate.tfrecord'),
+      '--sample_rate', str(args.sample_rate))
+  results['sample_count'] = _tfdv(
+      input_path, os.path.join(work_dir, 'sample_count.tfrecord'),
+      '--sample_count', str(args.sample_count))
+
+  merged_path = os.path.join(work_dir, 'merged.tfrecord')
+  for i, partition in enumerate(partitions):
+    result = _tfdv(partition, merged_path,
+                   '--partition_stats_dir', partition_stats_dir,
+                   '--partition', 'partition-%03d' % i)
+  results['partition'] = result
+
+  for mode, result in results.items():
+    stats_path = merged_path if mode == 'partition' else os.path.join(
+        work_dir, mode + '.tfrecord')
+    result['max_mean_error'] = max_mean_error(stats_path, full_path)
+    print('%s: %.1fs, peak RSS %.0f MB, max mean error %.2g' % (
+        mode, result['seconds'], result['peak_rss_mb'],
+        result['max_mean_error']))
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
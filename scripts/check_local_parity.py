@@ -0,0 +1,223 @@
+"""Checks that `preprocess.py --local_fast` matches the Beam pipeline.
+
+The same input is preprocessed by both paths, without shuffling, into
+`<work_dir>/beam` and `<work_dir>/local`, and three comparisons are made:
+
+  * numpy_vs_transform_fn: the NumPy transform of local_preprocess.py against
+    the transform_fn it wrote, on the same rows. They must agree exactly, up
+    to float rounding.
+  * local_vs_beam: the two transform_fns on the same rows. Z-scores must agree
+    up to float rounding; bucket indices may differ for the few values close
+    to a quantile boundary, as the local quantiles are approximate.
+  * shards: the row count and mean of every transformed feature of the two
+    sets of shards. Row counts must agree, and means up to
+    `--max_mean_diff` (`--max_bucket_mismatch` for bucket indices).
+
+The report is printed as JSON, and the script exits with status 1 if a
+tolerance is exceeded. check_local_parity_test.py runs the check on a small
+generated CSV file.
+
+  python check_local_parity.py --input ../data/train/train.csv \
+      --schema_file ../data/tfdv_output/schema.pbtxt --work_dir /tmp/parity
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_transform as tft
+
+import analyzer_state as state_lib
+import local_preprocess
+import preprocess_pipeline
+import stream_preprocess
+from trainer import bookings
+
+_BUCKET_KEYS = bookings.transformed_names(bookings.BUCKET_FEATURE_KEYS)
+
+
+def _compare(outputs_a, outputs_b):
+  """Returns the max abs difference or mismatch rate of each feature."""
+  report = {}
+  for key in sorted(outputs_a):
+    a = np.asarray(outputs_a[key])
+    b = np.asarray(outputs_b[key])
+    if key in _BUCKET_KEYS or a.dtype == np.object_:
+      report[key] = {'mismatch_rate': float(np.mean(a != b))}
+    else:
+      report[key] = {'max_abs_diff': float(np.max(np.abs(
+          a.astype(np.float64) - b.astype(np.float64)))) if len(a) else 0.0}
+  return report
+
+
+def _read_shard_means(output_dir, outfile_prefix):
+  """Returns the row count and mean of each feature of transformed shards."""
+  feature_spec = tft.TFTransformOutput(
+      output_dir).transformed_feature_spec()
+  sums = {key: 0.0 for key in feature_spec}
+  num_rows = 0
+  for filename in sorted(
+      tf.gfile.Glob(os.path.join(output_dir, outfile_prefix + '-*'))):
+    if filename.endswith(bookings.OUTPUT_METADATA_SUFFIX):
+      continue
+    options = stream_preprocess.record_options(
+        bookings.compression_type(filename))
+    for record in tf.python_io.tf_record_iterator(filename, options):
+      example = tf.train.Example.FromString(record)
+      num_rows += 1
+      for key in feature_spec:
+        feature = example.features.feature[key]
+        values = feature.float_list.value or feature.int64_list.value
+        sums[key] += sum(values)
+  return num_rows, {
+      key: total / num_rows if num_rows else 0.0
+      for key, total in sums.items()
+  }
+
+
+def _violations(report, float_tolerance, max_bucket_mismatch, max_mean_diff):
+  violations = []
+  for name, tolerance_keys in (('numpy_vs_transform_fn', None),
+                               ('local_vs_beam', _BUCKET_KEYS)):
+    for key, values in report[name].items():
+      if 'max_abs_diff' in values and values['max_abs_diff'] > float_tolerance:
+        violations.append('%s %s max_abs_diff=%g' % (
+            name, key, values['max_abs_diff']))
+      if 'mismatch_rate' in values:
+        allowed = (max_bucket_mismatch if tolerance_keys and
+                   key in tolerance_keys else 0.0)
+        if values['mismatch_rate'] > allowed:
+          violations.append('%s %s mismatch_rate=%g' % (
+              name, key, values['mismatch_rate']))
+  shards = report['shards']
+  if shards['beam_rows'] != shards['local_rows']:
+    violations.append('shards row counts %d != %d' % (shards['beam_rows'],
+                                                      shards['local_rows']))
+  for key, diff in shards['mean_abs_diff'].items():
+    # A row put in the neighbouring bucket moves the mean by 1 / rows.
+    allowed = max_bucket_mismatch if key in _BUCKET_KEYS else max_mean_diff
+    if diff > allowed:
+      violations.append('shards %s mean_abs_diff=%g' % (key, diff))
+  return violations
+
+
+def check_parity(input_handle, schema_file, work_dir, num_rows=10000,
+                 float_tolerance=1e-4, max_bucket_mismatch=0.02,
+                 max_mean_diff=1e-3):
+  """Preprocesses an input with both paths and compares the outputs.
+
+  Args:
+    input_handle: Path to csv file with input data.
+    schema_file: File holding the schema for the input data.
+    work_dir: Directory in which both outputs are written.
+    num_rows: Number of rows compared row by row.
+    float_tolerance: Largest allowed difference of a float feature.
+    max_bucket_mismatch: Largest allowed fraction of rows in another bucket,
+      Beam vs local.
+    max_mean_diff: Largest allowed difference of the mean of a non-bucketized
+      feature over the written shards.
+
+  Returns:
+    A (report, violations) tuple, where violations lists the tolerances
+      exceeded.
+  """
+  outfile_prefix = 'parity_transformed'
+  beam_dir = os.path.join(work_dir, 'beam')
+  local_dir = os.path.join(work_dir, 'local')
+  for output_dir in (beam_dir, local_dir):
+    if tf.gfile.Exists(output_dir):
+      tf.gfile.DeleteRecursively(output_dir)
+  preprocess_pipeline.transform_data(
+      input_handle, outfile_prefix, beam_dir, schema_file, shuffle='none',
+      pipeline_args=['--runner=DirectRunner'])
+  local_preprocess.transform_data(
+      input_handle, outfile_prefix, local_dir, schema_file, shuffle='none')
+
+  schema = bookings.read_schema(schema_file)
+  with open(input_handle) as f:
+    next(f)  # Skip the header line.
+    lines = [line.rstrip('\r\n')
+             for line in itertools.islice(f, num_rows)
+             if line.rstrip('\r\n')]
+  local_transformer = stream_preprocess.StreamTransformer(local_dir, schema)
+  beam_transformer = stream_preprocess.StreamTransformer(beam_dir, schema)
+  local_outputs = local_transformer.run(lines)
+  numpy_outputs = local_preprocess.transform_columns(
+      local_preprocess.decode_columns(
+          lines, bookings.get_raw_feature_spec(schema), len(lines)),
+      state_lib.AnalyzerState.read(local_dir))
+
+  beam_rows, beam_means = _read_shard_means(beam_dir, outfile_prefix)
+  local_rows, local_means = _read_shard_means(local_dir, outfile_prefix)
+  report = {
+      'numpy_vs_transform_fn': _compare(numpy_outputs, local_outputs),
+      'local_vs_beam': _compare(local_outputs,
+                                beam_transformer.run(lines)),
+      'shards': {
+          'beam_rows': beam_rows,
+          'local_rows': local_rows,
+          'mean_abs_diff': {
+              key: abs(beam_means[key] - local_means[key])
+              for key in sorted(beam_means)
+          },
+      },
+  }
+  local_transformer.close()
+  beam_transformer.close()
+  return report, _violations(report, float_tolerance, max_bucket_mismatch,
+                             max_mean_diff)
+
+
+def main():
+  tf.logging.set_verbosity(tf.logging.WARN)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Input path to csv file with input data.',
+      required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--work_dir',
+      help='Directory in which both outputs are written.',
+      required=True)
+  parser.add_argument(
+      '--num_rows', help='Number of rows compared row by row',
+      default=10000, type=int)
+  parser.add_argument(
+      '--float_tolerance',
+      help='Largest allowed difference of a float feature',
+      default=1e-4, type=float)
+  parser.add_argument(
+      '--max_bucket_mismatch',
+      help='Largest allowed fraction of rows in another bucket (Beam vs local)',
+      default=0.02, type=float)
+  parser.add_argument(
+      '--max_mean_diff',
+      help=('Largest allowed difference of the mean of a non-bucketized '
+            'feature over the shards'),
+      default=1e-3, type=float)
+  args = parser.parse_args()
+
+  report, violations = check_parity(
+      args.input, args.schema_file, args.work_dir, args.num_rows,
+      args.float_tolerance, args.max_bucket_mismatch, args.max_mean_diff)
+  print(json.dumps(report, indent=2, sort_keys=True))
+
+  for violation in violations:
+    print('FAILED: ' + violation)
+  if violations:
+    sys.exit(1)
+  print('Local and Beam outputs match.')
+
+
+if __name__ == '__main__':
+  main()
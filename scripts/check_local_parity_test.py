@@ -0,0 +1,43 @@
+"""Checks `preprocess.py --local_fast` against the Beam pipeline on a tiny CSV.
+
+  python check_local_parity_test.py
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import tensorflow as tf
+
+import check_local_parity
+import generate_data
+import tfdv_bookings
+
+NUM_ROWS = 2000
+
+
+class CheckLocalParityTest(tf.test.TestCase):
+
+  def testLocalMatchesBeam(self):
+    work_dir = self.get_temp_dir()
+    input_handle = os.path.join(work_dir, 'bookings.csv')
+    stats_path = os.path.join(work_dir, 'stats.tfrecord')
+    schema_file = os.path.join(work_dir, 'schema.pbtxt')
+    generate_data.generate(input_handle, NUM_ROWS, seed=0)
+    tfdv_bookings.compute_stats(
+        input_handle, stats_path, pipeline_args=['--runner=DirectRunner'])
+    tfdv_bookings.infer_schema(stats_path, schema_file)
+
+    report, violations = check_local_parity.check_parity(
+        input_handle, schema_file, os.path.join(work_dir, 'parity'),
+        num_rows=NUM_ROWS)
+
+    self.assertEqual(NUM_ROWS, report['shards']['beam_rows'])
+    self.assertEqual([], violations,
+                     json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+  tf.test.main()
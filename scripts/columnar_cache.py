@@ -0,0 +1,289 @@
+"""Decode-once columnar cache of the bookings CSV data.
+
+The cache is a directory holding a `manifest.json` and one sub-directory per
+row group, each containing a `.npy` file of values and a `.present.npy` mask
+per CSV column. Columns are typed by the schema when one is given and inferred
+from the data otherwise, so the cache can also be built before TFDV has
+produced a schema. The cache is read and written through `tf.gfile`, so it may
+be stored on GCS; local `.npy` files are memory-mapped when read.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import csv
+import hashlib
+import io
+import itertools
+import json
+import os
+
+import apache_beam as beam
+import numpy as np
+import tensorflow as tf
+
+from google.protobuf import text_format
+
+import batched_csv
+from trainer import bookings
+
+MANIFEST_FILE = 'manifest.json'
+DEFAULT_ROW_GROUP_SIZE = 1000000
+
+# Column dtypes stored in the manifest, from narrowest to widest.
+_DTYPES = ['int64', 'float32', 'string']
+_TF_DTYPES = {'int64': tf.int64, 'float32': tf.float32, 'string': tf.string}
+
+
+def schema_fingerprint(schema):
+  """Returns a stable fingerprint of a schema proto."""
+  return hashlib.sha1(
+      text_format.MessageToString(schema).encode('utf-8')).hexdigest()
+
+
+def _source_signature(input_path):
+  stat = tf.gfile.Stat(input_path)
+  return {'path': input_path, 'length': stat.length,
+          'mtime_nsec': stat.mtime_nsec}
+
+
+def _dtype_name(tf_dtype):
+  if tf_dtype == tf.string:
+    return 'string'
+  return 'int64' if tf_dtype.is_integer else 'float32'
+
+
+def _infer_dtype(raw_values):
+  """Returns the narrowest manifest dtype able to hold all `raw_values`."""
+  raw_values = np.asarray(raw_values, dtype=np.unicode_)
+  raw_values = raw_values[raw_values != '']
+  for dtype in ('int64', 'float32'):
+    try:
+      raw_values.astype(dtype)
+      return dtype
+    except ValueError:
+      pass
+  return 'string'
+
+
+def _block_feature_spec(lines, column_names, feature_spec):
+  """Completes `feature_spec` with inferred types for the remaining columns."""
+  block_spec = dict(feature_spec)
+  missing = [name for name in column_names if name not in feature_spec]
+  if missing:
+    rows = list(csv.reader(lines))
+    for name in missing:
+      raw_values = [row[column_names.index(name)] for row in rows]
+      block_spec[name] = tf.VarLenFeature(
+          _TF_DTYPES[_infer_dtype(raw_values)])
+  return block_spec
+
+
+def _save_array(filename, array):
+  with tf.gfile.GFile(filename, 'wb') as f:
+    np.save(f, array)
+
+
+def _load_array(filename):
+  """Memory-maps a local `.npy` file, or reads a remote one into memory."""
+  if '://' not in filename:
+    return np.load(filename, mmap_mode='r')
+  with tf.gfile.GFile(filename, 'rb') as f:
+    return np.load(io.BytesIO(f.read()))
+
+
+def _write_row_group(path, columns):
+  tf.gfile.MakeDirs(path)
+  for name, (values, present) in columns.items():
+    if values.dtype == np.object_:
+      values = values.astype(np.bytes_)
+    _save_array(os.path.join(path, name + '.npy'), values)
+    _save_array(os.path.join(path, name + '.present.npy'), present)
+
+
+def read_manifest(cache_dir):
+  with tf.gfile.GFile(os.path.join(cache_dir, MANIFEST_FILE)) as f:
+    return json.load(f)
+
+
+def build_cache(input_path,
+                cache_dir,
+                schema=None,
+                row_group_size=DEFAULT_ROW_GROUP_SIZE):
+  """Converts a CSV file into a columnar cache, unless it is up to date.
+
+  Args:
+    input_path: Path to csv file with input data.
+    cache_dir: Directory in which the cache is written.
+    schema: An optional schema proto used to type the columns. Columns not in
+      the schema have their type inferred from the data.
+    row_group_size: Number of rows stored per row group.
+
+  Returns:
+    The manifest of the cache, as a dict.
+  """
+  source = _source_signature(input_path)
+  fingerprint = schema_fingerprint(schema) if schema is not None else None
+  if tf.gfile.Exists(os.path.join(cache_dir, MANIFEST_FILE)):
+    manifest = read_manifest(cache_dir)
+    if (manifest['source'] == source and
+        manifest['schema_fingerprint'] == fingerprint):
+      tf.logging.info('Columnar cache in %s is up to date.', cache_dir)
+      return manifest
+    tf.gfile.DeleteRecursively(cache_dir)
+
+  feature_spec = (
+      bookings.get_raw_feature_spec(schema) if schema is not None else {})
+  column_names = bookings.CSV_COLUMN_NAMES
+  dtypes = {}
+  row_groups = []
+  with tf.gfile.GFile(input_path) as f:
+    next(f)  # Skip the header line.
+    while True:
+      lines = [line.rstrip('\n')
+               for line in itertools.islice(f, row_group_size)]
+      if not lines:
+        break
+      block_spec = _block_feature_spec(lines, column_names, feature_spec)
+      columns = batched_csv.decode_csv_block(lines, column_names, block_spec)
+      for name in column_names:
+        dtype = _dtype_name(block_spec[name].dtype)
+        dtypes[name] = max(dtypes.get(name, dtype), dtype, key=_DTYPES.index)
+      path = 'rg-%05d' % len(row_groups)
+      _write_row_group(os.path.join(cache_dir, path), columns)
+      row_groups.append({'path': path, 'num_rows': len(lines)})
+
+  manifest = {
+      'source': source,
+      'schema_fingerprint': fingerprint,
+      'column_names': column_names,
+      'dtypes': dtypes,
+      'num_rows': sum(row_group['num_rows'] for row_group in row_groups),
+      'row_groups': row_groups,
+  }
+  with tf.gfile.GFile(os.path.join(cache_dir, MANIFEST_FILE), 'w') as f:
+    json.dump(manifest, f, indent=2)
+  return manifest
+
+
+def load_row_group(cache_dir, row_group, dtypes, names=None):
+  """Memory-maps the columns of a row group, or reads them if remote.
+
+  Args:
+    cache_dir: Directory holding the cache.
+    row_group: The manifest entry of the row group.
+    dtypes: A map from column name to manifest dtype to return the column as.
+      Columns stored with a narrower type are cast.
+    names: The columns to load, defaults to all keys of `dtypes`.
+
+  Returns:
+    A map from column name to a `(values, present)` pair as returned by
+    `batched_csv.decode_csv_block`.
+  """
+  path = os.path.join(cache_dir, row_group['path'])
+  columns = {}
+  for name in names or dtypes:
+    values = _load_array(os.path.join(path, name + '.npy'))
+    present = _load_array(os.path.join(path, name + '.present.npy'))
+    if dtypes[name] == 'string':
+      values = values.astype(np.object_)
+    elif values.dtype != np.dtype(dtypes[name]):
+      values = values.astype(dtypes[name])
+    columns[name] = (values, present)
+  return columns
+
+
+def _check_schema(manifest, schema):
+  fingerprint = manifest['schema_fingerprint']
+  if fingerprint is not None and fingerprint != schema_fingerprint(schema):
+    raise ValueError(
+        'Columnar cache was built with a different schema, rebuild it.')
+
+
+class ReadColumnarCache(beam.PTransform):
+  """Reads a columnar cache as tf.Transform instance dicts."""
+
+  def __init__(self, cache_dir, schema):
+    super(ReadColumnarCache, self).__init__()
+    self._cache_dir = cache_dir
+    self._schema = schema
+
+  def expand(self, pipeline):
+    manifest = read_manifest(self._cache_dir)
+    _check_schema(manifest, self._schema)
+    feature_spec = bookings.get_raw_feature_spec(self._schema)
+    dtypes = {name: _dtype_name(spec.dtype)
+              for name, spec in feature_spec.items()}
+
+    def read_row_group(row_group):
+      return batched_csv.columns_to_instances(
+          load_row_group(self._cache_dir, row_group, dtypes), feature_spec)
+
+    return (
+        pipeline
+        | 'CreateRowGroups' >> beam.Create(manifest['row_groups'])
+        | 'DistributeRowGroups' >> beam.Reshuffle()
+        | 'ReadRowGroups' >> beam.FlatMap(read_row_group))
+
+
+def _columns_to_examples(columns):
+  """Yields TFDV examples, mapping each feature to its values or None."""
+  num_rows = len(next(iter(columns.values()))[0])
+  for i in range(num_rows):
+    yield {name: values[i:i + 1] if present[i] else None
+           for name, (values, present) in columns.items()}
+
+
+class ReadColumnarCacheExamples(beam.PTransform):
+  """Reads a columnar cache as examples for `tfdv.GenerateStatistics`."""
+
+  def __init__(self, cache_dir):
+    super(ReadColumnarCacheExamples, self).__init__()
+    self._cache_dir = cache_dir
+
+  def expand(self, pipeline):
+    manifest = read_manifest(self._cache_dir)
+    dtypes = manifest['dtypes']
+
+    def read_row_group(row_group):
+      return _columns_to_examples(
+          load_row_group(self._cache_dir, row_group, dtypes))
+
+    return (
+        pipeline
+        | 'CreateRowGroups' >> beam.Create(manifest['row_groups'])
+        | 'DistributeRowGroups' >> beam.Reshuffle()
+        | 'ReadRowGroups' >> beam.FlatMap(read_row_group))
+
+
+def main():
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Input path to csv file with input data.', required=True)
+  parser.add_argument(
+      '--cache_dir', help='Directory in which the cache is written.',
+      required=True)
+  parser.add_argument(
+      '--schema_file',
+      help=('File holding the schema for the input data. If omitted, column '
+            'types are inferred from the data.'),
+      default=None)
+  parser.add_argument(
+      '--row_group_size',
+      help='Number of rows stored per row group.',
+      default=DEFAULT_ROW_GROUP_SIZE,
+      type=int)
+  args = parser.parse_args()
+
+  schema = bookings.read_schema(args.schema_file) if args.schema_file else None
+  manifest = build_cache(args.input, args.cache_dir, schema,
+                         args.row_group_size)
+  print('Columnar cache of %d rows stored in %s' %
+        (manifest['num_rows'], args.cache_dir))
+
+
+if __name__ == '__main__':
+  main()
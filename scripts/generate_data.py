@@ -0,0 +1,140 @@
+"""Generates synthetic bookings CSV data of arbitrary size.
+
+Rows follow `bookings.CSV_COLUMN_NAMES`. Hotels are drawn from a fixed
+catalogue with a skewed popularity, so per-hotel attributes (city, stars,
+location, amenities) stay consistent across rows, and categorical ids stay
+within `bookings.MAX_CATEGORICAL_FEATURE_VALUES`.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+
+import numpy as np
+import tensorflow as tf
+
+from trainer import bookings
+
+# Number of rows generated and written at a time.
+CHUNK_SIZE = 100000
+
+# Share of missing values in columns that are sometimes empty in the real data.
+MISSING_RATE = 0.02
+_SOMETIMES_MISSING = ['rating', 'stars', 'last_renovation',
+                      'distance_to_city_centre']
+
+_HOTEL_FLAGS = [
+    'spa_hotel', 'country_hotel', 'convention_hotel', 'beach_front_hotel',
+    'luxury_hotel', 'city_hotel_centrally_located', 'health_resortrehab_hotel',
+    'club_club_hotel', 'airport_hotel', 'senior_hotel', 'eco_friendly_hotel',
+    'family_hotel'
+]
+
+
+def _max_value(key):
+  return bookings.MAX_CATEGORICAL_FEATURE_VALUES[
+      bookings.CATEGORICAL_FEATURE_KEYS.index(key)]
+
+
+def _hotel_catalogue(rng):
+  """Returns per-hotel attributes, indexed by hotel_id."""
+  num_hotels = _max_value('hotel_id')
+  num_cities = _max_value('city_id')
+  city_id = rng.randint(0, num_cities, num_hotels)
+  city_latitude = rng.uniform(-60, 70, num_cities)
+  city_longitude = rng.uniform(-180, 180, num_cities)
+  hotels = {
+      'city_id': city_id,
+      'latitude': city_latitude[city_id] + rng.normal(0, 0.05, num_hotels),
+      'longitude': city_longitude[city_id] + rng.normal(0, 0.05, num_hotels),
+      'distance_to_city_centre': rng.exponential(2.5, num_hotels),
+      'stars': rng.choice([0, 1, 2, 3, 4, 5], num_hotels,
+                          p=[.05, .05, .15, .4, .3, .05]),
+      'rating': np.clip(rng.normal(78, 8, num_hotels), 0, 100),
+      'poi_image': rng.binomial(1, 0.3, num_hotels),
+      'last_renovation': rng.randint(1980, 2019, num_hotels),
+      'total_images': rng.poisson(40, num_hotels),
+      'popularity': rng.zipf(1.3, num_hotels).astype(np.float64),
+  }
+  hotels['total_hq_images'] = rng.binomial(hotels['total_images'], 0.4)
+  for flag in _HOTEL_FLAGS:
+    hotels[flag] = rng.binomial(1, rng.uniform(0.02, 0.3), num_hotels)
+  hotels['popularity'] /= hotels['popularity'].sum()
+  return hotels
+
+
+def _generate_chunk(rng, hotels, first_id, num_rows):
+  """Returns a map from CSV column name to a column of `num_rows` values."""
+  hotel_id = rng.choice(len(hotels['popularity']), num_rows,
+                        p=hotels['popularity'])
+  impressions = rng.negative_binomial(2, 0.02, num_rows)
+  clicks = rng.binomial(impressions, 0.04)
+  top_pos = rng.binomial(impressions, 0.3)
+  beat = rng.binomial(impressions, 0.2)
+  meet = rng.binomial(impressions - beat, 0.5)
+  columns = {
+      'id': np.arange(first_id, first_id + num_rows),
+      'yyear': rng.randint(0, _max_value('yyear'), num_rows),
+      'week_of_year': rng.randint(0, _max_value('week_of_year'), num_rows),
+      'advertiser_id': rng.randint(0, _max_value('advertiser_id'), num_rows),
+      'market': rng.randint(0, 30, num_rows),
+      'hotel_id': hotel_id,
+      'clicks': clicks,
+      'cost': np.round(clicks * rng.gamma(2, 0.3, num_rows), 2),
+      'bookings': rng.binomial(clicks, 0.05),
+      'top_pos': top_pos,
+      'beat': beat,
+      'meet': meet,
+      'lose': impressions - beat - meet,
+      'impressions': impressions,
+      'advertiser_connections': rng.poisson(6, num_rows),
+  }
+  for key in ['city_id', 'stars', 'rating', 'distance_to_city_centre',
+              'poi_image', 'longitude', 'latitude', 'last_renovation',
+              'total_images', 'total_hq_images'] + _HOTEL_FLAGS:
+    columns[key] = hotels[key][hotel_id]
+  return columns
+
+
+def _format_column(values):
+  if np.issubdtype(values.dtype, np.integer):
+    return np.char.mod('%d', values)
+  return np.char.mod('%.6g', values)
+
+
+def generate(output_path, num_rows, seed=0):
+  """Writes `num_rows` synthetic rows, plus a header, to a CSV file."""
+  rng = np.random.RandomState(seed)
+  hotels = _hotel_catalogue(rng)
+  with tf.gfile.GFile(output_path, 'w') as f:
+    f.write(','.join(bookings.CSV_COLUMN_NAMES) + '\n')
+    for first_id in range(0, num_rows, CHUNK_SIZE):
+      chunk_rows = min(CHUNK_SIZE, num_rows - first_id)
+      columns = _generate_chunk(rng, hotels, first_id, chunk_rows)
+      formatted = []
+      for name in bookings.CSV_COLUMN_NAMES:
+        column = _format_column(columns[name])
+        if name in _SOMETIMES_MISSING:
+          column[rng.uniform(size=chunk_rows) < MISSING_RATE] = ''
+        formatted.append(column)
+      f.write('\n'.join(','.join(row) for row in zip(*formatted)) + '\n')
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--output', help='Path of the csv file to write.', required=True)
+  parser.add_argument(
+      '--num_rows', help='Number of rows to generate.', required=True,
+      type=int)
+  parser.add_argument(
+      '--seed', help='Seed of the random generator.', default=0, type=int)
+  args = parser.parse_args()
+
+  generate(args.output, args.num_rows, args.seed)
+  print('Wrote %d rows to %s' % (args.num_rows, args.output))
+
+
+if __name__ == '__main__':
+  main()
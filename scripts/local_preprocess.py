@@ -0,0 +1,270 @@
+"""In-process equivalent of the tf.transform pipeline for small inputs.
+
+`preprocess.py --local_fast` runs this module instead of the Beam pipeline of
+preprocess_pipeline.py. The input is split into chunks handled by a process
+pool:
+
+  * analyze:   each chunk is decoded into NumPy columns with batched_csv and
+               summarized as an AnalyzerState (moments and quantile sketches),
+               and the states of all chunks are merged.
+  * transform: each chunk is transformed with vectorized NumPy and written as
+               one shard `<outfile_prefix>-<i>-of-<n><suffix>`.
+
+The transform_fn is `preprocess_pipeline.make_preprocessing_fn` with the merged
+AnalyzerState constant-folded, as in the --incremental mode, written with the
+transformed metadata in the layout of tft_beam.WriteTransformFn. The analyzer
+state is stored next to them, stamped with a fingerprint of the transform_fn,
+so that eval data can later be transformed with `--transform_dir` in NumPy as
+well. Without it, or if the transform_fn has since been overwritten, the
+chunks are run through the stored transform_fn instead.
+
+Quantile boundaries come from the AnalyzerState sketches, so bucket indices of
+values very close to a boundary may differ from the Beam analyzers. See
+check_local_parity.py.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import os
+import random
+import time
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_transform as tft
+
+from tensorflow_transform import impl_helper
+from tensorflow_transform import schema_inference
+from tensorflow_transform.coders import example_proto_coder
+from tensorflow_transform.saved import saved_transform_io
+from tensorflow_transform.tf_metadata import dataset_metadata
+from tensorflow_transform.tf_metadata import metadata_io
+
+import analyzer_state as state_lib
+import batched_csv
+import pipeline_metrics
+import preprocess_pipeline
+import stream_preprocess
+from trainer import bookings
+
+
+def _read_lines(input_handle):
+  """Returns the lines of a CSV file, without its header line."""
+  with tf.gfile.GFile(input_handle) as f:
+    next(f, None)  # Skip the header line.
+    return [line.rstrip('\r\n') for line in f if line.rstrip('\r\n')]
+
+
+def decode_columns(lines, raw_feature_spec, block_size):
+  """Decodes CSV lines into NumPy columns, with missing values as 0 or ''."""
+  blocks = [
+      batched_csv.decode_csv_block(lines[i:i + block_size],
+                                   bookings.CSV_COLUMN_NAMES, raw_feature_spec)
+      for i in range(0, len(lines), block_size)
+  ]
+  if not blocks:
+    return {}
+  # decode_csv_block fills in missing values like preprocessing_fn's
+  # _fill_in_missing, so the presence masks are not needed.
+  return {
+      key: np.concatenate([block[key][0] for block in blocks])
+      for key in raw_feature_spec
+  }
+
+
+def _analyze_chunk(args):
+  """Returns the AnalyzerState of a chunk of lines."""
+  lines, raw_feature_spec, block_size = args
+  columns = decode_columns(lines, raw_feature_spec, block_size)
+  if not columns:
+    return state_lib.AnalyzerState()
+  return state_lib.AnalyzerState.from_values(
+      {key: columns[key] for key in bookings.DENSE_FLOAT_FEATURE_KEYS},
+      {key: columns[key] for key in bookings.BUCKET_FEATURE_KEYS})
+
+
+def transform_columns(columns, analyzer_state):
+  """NumPy equivalent of `make_preprocessing_fn(analyzer_state)`.
+
+  Args:
+    columns: A map from raw feature key to a NumPy column with missing values
+      filled in.
+    analyzer_state: The AnalyzerState the transform_fn was built from.
+
+  Returns:
+    A map from transformed feature key to a NumPy column.
+  """
+  outputs = {}
+  for key in bookings.DENSE_FLOAT_FEATURE_KEYS:
+    mean, var = analyzer_state.mean_and_var(key)
+    x = columns[key].astype(np.float32) - np.float32(mean)
+    if var > 0:
+      x /= np.float32(np.sqrt(var))
+    outputs[bookings.transformed_name(key)] = x
+  for key in bookings.BUCKET_FEATURE_KEYS:
+    boundaries = np.asarray(
+        analyzer_state.bucket_boundaries(key, bookings.FEATURE_BUCKET_COUNT),
+        dtype=np.float32)
+    outputs[bookings.transformed_name(key)] = np.digitize(
+        columns[key].astype(np.float32), boundaries).astype(np.int64)
+  for key in bookings.CATEGORICAL_FEATURE_KEYS + [bookings.LABEL_KEY]:
+    outputs[bookings.transformed_name(key)] = columns[key]
+  return outputs
+
+
+def _write_shard(args):
+  """Transforms a chunk of lines into a shard and returns its row count."""
+  (lines, output_path, compression, schema, transform_dir, analyzer_state,
+   block_size) = args
+  tf_transform_output = tft.TFTransformOutput(transform_dir)
+  coder = example_proto_coder.ExampleProtoCoder(
+      tf_transform_output.transformed_metadata.schema)
+  transformer = None
+  if analyzer_state is None:
+    transformer = stream_preprocess.StreamTransformer(transform_dir, schema)
+  raw_feature_spec = bookings.get_raw_feature_spec(schema)
+  with tf.python_io.TFRecordWriter(
+      output_path, stream_preprocess.record_options(compression)) as writer:
+    for i in range(0, len(lines), block_size):
+      block = lines[i:i + block_size]
+      if transformer is None:
+        outputs = transform_columns(
+            decode_columns(block, raw_feature_spec, block_size), analyzer_state)
+      else:
+        outputs = transformer.run(block)
+      for j in range(len(block)):
+        writer.write(
+            coder.encode({key: value[j] for key, value in outputs.items()}))
+  if transformer is not None:
+    transformer.close()
+  return len(lines)
+
+
+def write_transform_fn(analyzer_state, schema, working_dir):
+  """Writes the transform_fn of an AnalyzerState and its output metadata.
+
+  The layout is that of tft_beam.WriteTransformFn, so that TFTransformOutput,
+  the trainer and `preprocess.py --transform_dir` read it alike.
+  """
+  raw_feature_spec = bookings.get_raw_feature_spec(schema)
+  preprocessing_fn = preprocess_pipeline.make_preprocessing_fn(analyzer_state)
+  with tf.Graph().as_default() as graph:
+    with tf.Session() as session:
+      inputs = impl_helper.feature_spec_as_batched_placeholders(
+          raw_feature_spec)
+      outputs = preprocessing_fn(inputs.copy())
+      saved_transform_io.write_saved_transform_from_session(
+          session, inputs, outputs,
+          os.path.join(working_dir, tft.TFTransformOutput.TRANSFORM_FN_DIR))
+      transformed_schema = schema_inference.infer_feature_schema(
+          outputs, graph, session)
+  metadata_io.write_metadata(
+      dataset_metadata.DatasetMetadata(transformed_schema),
+      os.path.join(working_dir,
+                   tft.TFTransformOutput.TRANSFORMED_METADATA_DIR))
+
+
+def _chunks(lines, num_chunks):
+  size = -(-len(lines) // num_chunks)
+  return [lines[i * size:(i + 1) * size] for i in range(num_chunks)]
+
+
+def transform_data(input_handle,
+                   outfile_prefix,
+                   working_dir,
+                   schema_file,
+                   transform_dir=None,
+                   decode_batch_size=batched_csv.DEFAULT_BATCH_SIZE,
+                   incremental=False,
+                   analyzer_state_dir=None,
+                   metrics_file=None,
+                   num_shards=0,
+                   compression='GZIP',
+                   shuffle='global',
+                   num_workers=None):
+  """Analyzes and transforms data like `preprocess_pipeline.transform_data`.
+
+  Args:
+    input_handle: Path to csv file with input data.
+    outfile_prefix: Filename prefix for emitted transformed examples
+    working_dir: Directory in which transformed examples and transform function
+      will be emitted.
+    schema_file: An file path that contains a text-serialized TensorFlow
+      metadata schema of the input data.
+    transform_dir: Directory in which the transform output is located. If
+      provided, the data is transformed with it instead of being analyzed.
+    decode_batch_size: Number of CSV lines decoded and transformed at once.
+    incremental: If True, the AnalyzerState of the input data is merged with
+      the one found in `analyzer_state_dir` (if any).
+    analyzer_state_dir: Directory holding the AnalyzerState of the previously
+      analyzed data.
+    metrics_file: If set, the wall time of each phase is written to this JSON
+      file.
+    num_shards: Number of transformed example shards. If 0, one per worker.
+    compression: Codec of the transformed example shards.
+    shuffle: 'none' keeps the input order; any other strategy shuffles all the
+      lines in memory.
+    num_workers: Number of worker processes. Defaults to the number of cores.
+  """
+  num_workers = num_workers or os.cpu_count()
+  num_shards = num_shards or num_workers
+  decode_batch_size = decode_batch_size or batched_csv.DEFAULT_BATCH_SIZE
+  schema = bookings.read_schema(schema_file)
+  raw_feature_spec = bookings.get_raw_feature_spec(schema)
+  wall_secs = {}
+
+  start = time.time()
+  lines = _read_lines(input_handle)
+  if shuffle != 'none':
+    random.shuffle(lines)
+  wall_secs['read'] = time.time() - start
+
+  # Workers are spawned rather than forked, as TensorFlow is not fork-safe.
+  pool = multiprocessing.get_context('spawn').Pool(num_workers)
+  try:
+    start = time.time()
+    analyzer_state = None
+    if transform_dir is None:
+      analyzer_state = state_lib.AnalyzerState()
+      for chunk_state in pool.imap_unordered(
+          _analyze_chunk, [(chunk, raw_feature_spec, decode_batch_size)
+                           for chunk in _chunks(lines, num_workers)]):
+        analyzer_state = analyzer_state.merge(chunk_state)
+      if (incremental and analyzer_state_dir and tf.gfile.Exists(
+          os.path.join(analyzer_state_dir, state_lib.ANALYZER_STATE_FILE))):
+        analyzer_state = state_lib.AnalyzerState.read(
+            analyzer_state_dir).merge(analyzer_state)
+      analyzer_state.write(working_dir)
+      write_transform_fn(analyzer_state, schema, working_dir)
+      state_lib.stamp_transform_fn(working_dir)
+      transform_dir = working_dir
+    elif state_lib.matches_transform_fn(transform_dir):
+      analyzer_state = state_lib.AnalyzerState.read(transform_dir)
+    wall_secs['analyze'] = time.time() - start
+
+    start = time.time()
+    output_prefix = os.path.join(working_dir, outfile_prefix)
+    suffix = bookings.COMPRESSION_SUFFIXES[compression]
+    shards = [
+        (chunk, '%s-%05d-of-%05d%s' % (output_prefix, i, num_shards, suffix),
+         compression, schema, transform_dir, analyzer_state, decode_batch_size)
+        for i, chunk in enumerate(_chunks(lines, num_shards))
+    ]
+    num_rows = sum(pool.imap_unordered(_write_shard, shards))
+    wall_secs['transform'] = time.time() - start
+  finally:
+    pool.close()
+    pool.join()
+
+  bookings.write_output_metadata(output_prefix, {
+      'format': 'tfrecord',
+      'compression': compression,
+      'num_shards': num_shards,
+      'file_pattern': os.path.basename(output_prefix) + '-*',
+  })
+  tf.logging.info('Transformed %d rows in %.1fs', num_rows,
+                  sum(wall_secs.values()))
+  if metrics_file:
+    pipeline_metrics.write_metrics(metrics_file, {'wall_secs': wall_secs})
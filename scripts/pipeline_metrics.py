@@ -0,0 +1,80 @@
+"""Beam metrics for the preprocessing pipelines and their JSON export."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import time
+
+import apache_beam as beam
+import tensorflow as tf
+
+from apache_beam.metrics import Metrics
+from apache_beam.metrics.metric import MetricsFilter
+
+NAMESPACE = 'bookings'
+
+
+class _InstrumentDoFn(beam.DoFn):
+  """Counts elements and optionally bytes and latency of a stage."""
+
+  def __init__(self, stage, fn=None, size_fn=None):
+    super(_InstrumentDoFn, self).__init__()
+    self._fn = fn
+    self._size_fn = size_fn
+    self._elements = Metrics.counter(NAMESPACE, stage + '_elements')
+    self._bytes = Metrics.counter(NAMESPACE, stage + '_bytes')
+    self._latency = Metrics.distribution(NAMESPACE, stage + '_latency_usec')
+
+  def process(self, element):
+    if self._fn is not None:
+      start = time.time()
+      element = self._fn(element)
+      self._latency.update(int((time.time() - start) * 1e6))
+    self._elements.inc()
+    if self._size_fn is not None:
+      self._bytes.inc(self._size_fn(element))
+    yield element
+
+
+def Instrument(stage, fn=None, size_fn=None):  # pylint: disable=invalid-name
+  """Returns a ParDo counting the elements flowing through `stage`.
+
+  Args:
+    stage: Name of the stage, used as prefix of the metric names.
+    fn: If set, each element is mapped through `fn` and its latency is
+      recorded in the `<stage>_latency_usec` distribution.
+    size_fn: If set, the sizes it returns for the (mapped) elements are summed
+      in the `<stage>_bytes` counter.
+  """
+  return beam.ParDo(_InstrumentDoFn(stage, fn, size_fn))
+
+
+def query_metrics(result):
+  """Returns the counters and distributions of a finished pipeline."""
+  metrics = result.metrics().query(MetricsFilter().with_namespace(NAMESPACE))
+
+  def value(metric_result):
+    if metric_result.committed is not None:
+      return metric_result.committed
+    return metric_result.attempted
+
+  report = {'counters': {}, 'distributions': {}}
+  for counter in metrics['counters']:
+    report['counters'][counter.key.metric.name] = value(counter)
+  for distribution in metrics['distributions']:
+    data = value(distribution)
+    report['distributions'][distribution.key.metric.name] = {
+        'count': data.count,
+        'sum': data.sum,
+        'min': data.min,
+        'max': data.max,
+        'mean': data.mean,
+    }
+  return report
+
+
+def write_metrics(path, metrics):
+  """Writes a metrics dict as JSON."""
+  with tf.gfile.GFile(path, 'w') as f:
+    json.dump(metrics, f, indent=2, sort_keys=True)
@@ -1,152 +1,18 @@
-"""Preprocessor applying tf.transform to the bookings data."""
+"""Preprocessor applying tf.transform to the bookings data.
+
+This module only parses the flags; the pipeline lives in preprocess_pipeline.py
+and is imported once the flags are parsed.
+"""
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
 import argparse
-import os
-
-import apache_beam as beam
-import tensorflow as tf
-
-import tensorflow_transform as transform
-import tensorflow_transform.beam as tft_beam
-
-from tensorflow_transform.coders import example_proto_coder
-from tensorflow_transform.tf_metadata import dataset_metadata
-from tensorflow_transform.tf_metadata import dataset_schema
-
-from trainer import bookings
-
-def _fill_in_missing(x):
-  """Replace missing values in a SparseTensor.
-
-  Fills in missing values of `x` with '' or 0, and converts to a dense tensor.
-
-  Args:
-    x: A `SparseTensor` of rank 2.  Its dense shape should have size at most 1
-      in the second dimension.
-
-  Returns:
-    A rank 1 tensor where missing values of `x` have been filled in.
-  """
-  default_value = '' if x.dtype == tf.string else 0
-  return tf.squeeze(
-      tf.sparse.to_dense(
-          tf.SparseTensor(x.indices, x.values, [x.dense_shape[0], 1]),
-          default_value),
-      axis=1)
-
-
-
-def transform_data(input_handle,
-                   outfile_prefix,
-                   working_dir,
-                   schema_file,
-                   transform_dir=None,
-                   pipeline_args=None):
-  """The main tf.transform method which analyzes and transforms data.
-
-  Args:
-    input_handle: BigQuery table name to process specified as DATASET.TABLE or
-      path to csv file with input data.
-    outfile_prefix: Filename prefix for emitted transformed examples
-    working_dir: Directory in which transformed examples and transform function
-      will be emitted.
-    schema_file: An file path that contains a text-serialized TensorFlow
-      metadata schema of the input data.
-    transform_dir: Directory in which the transform output is located. If
-      provided, this will load the transform_fn from disk instead of computing
-      it over the data. Hint: this is useful for transforming eval data.
-    pipeline_args: additional DataflowRunner or DirectRunner args passed to the
-      beam pipeline.
-  """
-
-  def preprocessing_fn(inputs):
-    """tf.transform's callback function for preprocessing inputs.
-
-    Args:
-      inputs: map from feature keys to raw not-yet-transformed features.
-
-    Returns:
-      Map from string feature key to transformed feature operations.
-    """
-    outputs = {}
-    for key in bookings.DENSE_FLOAT_FEATURE_KEYS:
-      # Preserve this feature as a dense float, setting nan's to the mean.
-      outputs[bookings.transformed_name(key)] = transform.scale_to_z_score(
-          _fill_in_missing(inputs[key]))
-
-    for key in bookings.VOCAB_FEATURE_KEYS:
-      # Build a vocabulary for this feature.
-      outputs[
-          bookings.transformed_name(key)] = transform.compute_and_apply_vocabulary(
-              _fill_in_missing(inputs[key]),
-              top_k=bookings.VOCAB_SIZE,
-              num_oov_buckets=bookings.OOV_SIZE)
-
-    for key in bookings.BUCKET_FEATURE_KEYS:
-      outputs[bookings.transformed_name(key)] = transform.bucketize(
-          _fill_in_missing(inputs[key]), bookings.FEATURE_BUCKET_COUNT)
-
-    for key in bookings.CATEGORICAL_FEATURE_KEYS:
-      outputs[bookings.transformed_name(key)] = _fill_in_missing(inputs[key])
-
-    
-    outputs[bookings.transformed_name(bookings.LABEL_KEY)] = _fill_in_missing(inputs[bookings.LABEL_KEY])
-
-    return outputs
-
-  schema = bookings.read_schema(schema_file)
-  raw_feature_spec = bookings.get_raw_feature_spec(schema)
-  raw_schema = dataset_schema.from_feature_spec(raw_feature_spec)
-  raw_data_metadata = dataset_metadata.DatasetMetadata(raw_schema)
-
-  with beam.Pipeline(argv=pipeline_args) as pipeline:
-    with tft_beam.Context(temp_dir=working_dir):
-      
-      csv_coder = bookings.make_csv_coder(schema)
-      raw_data = (
-          pipeline
-          | 'ReadFromText' >> beam.io.ReadFromText(
-              input_handle, skip_header_lines=1))
-      decode_transform = beam.Map(csv_coder.decode)
-
-      if transform_dir is None:
-        decoded_data = raw_data | 'DecodeForAnalyze' >> decode_transform
-        transform_fn = (
-            (decoded_data, raw_data_metadata) |
-            ('Analyze' >> tft_beam.AnalyzeDataset(preprocessing_fn)))
-
-        _ = (
-            transform_fn
-            | ('WriteTransformFn' >>
-               tft_beam.WriteTransformFn(working_dir)))
-      else:
-        transform_fn = pipeline | tft_beam.ReadTransformFn(transform_dir)
-
-      # Shuffling the data before materialization will improve Training
-      # effectiveness downstream. Here we shuffle the raw_data (as opposed to
-      # decoded data) since it has a compact representation.
-      shuffled_data = raw_data | 'RandomizeData' >> beam.transforms.Reshuffle()
-
-      decoded_data = shuffled_data | 'DecodeForTransform' >> decode_transform
-      (transformed_data, transformed_metadata) = (
-          ((decoded_data, raw_data_metadata), transform_fn)
-          | 'Transform' >> tft_beam.TransformDataset())
-
-      coder = example_proto_coder.ExampleProtoCoder(transformed_metadata.schema)
-      _ = (
-          transformed_data
-          | 'SerializeExamples' >> beam.Map(coder.encode)
-          | 'WriteExamples' >> beam.io.WriteToTFRecord(
-              os.path.join(working_dir, outfile_prefix), file_name_suffix='.gz')
-      )
 
+from trainer import preprocess_options
 
-def main():
-  tf.logging.set_verbosity(tf.logging.INFO)
 
+def main():
   parser = argparse.ArgumentParser()
   parser.add_argument(
       '--input',
@@ -170,13 +36,172 @@ def main():
       default=None,
       help='Directory in which the transform output is located')
 
+  parser.add_argument(
+      '--decode_batch_size',
+      help=('Number of CSV lines decoded together into NumPy columns. Use 0 '
+            'to decode one line at a time with the tf.Transform CsvCoder.'),
+      default=preprocess_options.DEFAULT_DECODE_BATCH_SIZE,
+      type=int)
+
+  parser.add_argument(
+      '--input_cache',
+      help=('Directory of a columnar cache built by columnar_cache.py, read '
+            'instead of --input.'),
+      default=None)
+
+  parser.add_argument(
+      '--incremental',
+      help=('Merge the analyzer state of the input with the one stored in '
+            '--analyzer_state_dir instead of re-analyzing the full history.'),
+      action='store_true')
+
+  parser.add_argument(
+      '--analyzer_state_dir',
+      help='Directory holding the analyzer state of the previous run',
+      default=None)
+
+  parser.add_argument(
+      '--metrics_file',
+      help='If set, pipeline metrics are written to this JSON file.',
+      default=None)
+
+  parser.add_argument(
+      '--num_shards',
+      help=('Number of transformed example shards. Use 0 to let the runner '
+            'decide.'),
+      default=0,
+      type=int)
+
+  parser.add_argument(
+      '--compression',
+      help='Codec of the transformed example shards.',
+      choices=preprocess_options.COMPRESSIONS,
+      default='GZIP',
+      type=str.upper)
+
+  parser.add_argument(
+      '--output_format',
+      help=('Format of the transformed example shards: serialized tf.Examples, '
+            'or fixed-width records of scalar int64 and float32 features that '
+            'the trainer decodes a batch at a time.'),
+      choices=preprocess_options.OUTPUT_FORMATS,
+      default='tfrecord')
+
+  parser.add_argument(
+      '--shuffle',
+      help=('How the data is shuffled before it is written: a global '
+            'Reshuffle, a bounded buffer per worker, or not at all.'),
+      choices=preprocess_options.SHUFFLE_STRATEGIES,
+      default='global')
+
+  parser.add_argument(
+      '--shuffle_buffer_size',
+      help='Number of raw lines buffered per worker by --shuffle local.',
+      default=preprocess_options.DEFAULT_LOCAL_SHUFFLE_BUFFER_SIZE,
+      type=int)
+
+  parser.add_argument(
+      '--reindex_ids',
+      help=('Map the hotel, city and advertiser ids to dense indices of a '
+            'frequency-thresholded vocabulary.'),
+      action='store_true')
+
+  parser.add_argument(
+      '--local_fast',
+      help=('Analyze and transform in NumPy in a process pool instead of a '
+            'Beam pipeline, for inputs that fit in memory.'),
+      action='store_true')
+
+  parser.add_argument(
+      '--num_workers',
+      help='Number of processes of --local_fast. Defaults to the core count.',
+      default=None,
+      type=int)
+
+  parser.add_argument(
+      '--analyze_sample_rate',
+      help=('If set, the analyzers run on this fraction of the rows, while all '
+            'of them are transformed.'),
+      default=None,
+      type=float)
+
+  parser.add_argument(
+      '--analyze_stratify_by',
+      help=('Raw columns by which the analysis sample is stratified, e.g. '
+            'week_of_year city_id. Each value combination keeps '
+            'ceil(rate * rows) of its rows.'),
+      nargs='+',
+      default=None)
+
+  parser.add_argument(
+      '--min_rows_per_stratum',
+      help=('Rows of each stratum kept, at least, by a stratified sample. '
+            'The sample is not reweighted, so a positive value biases the '
+            'analysis towards small strata, kept at a higher rate than '
+            '--analyze_sample_rate. Defaults to a proportional sample.'),
+      default=preprocess_options.DEFAULT_MIN_ROWS_PER_STRATUM,
+      type=int)
+
+  parser.add_argument(
+      '--analyze_seed',
+      help='Seed of the analysis sample, for a reproducible transform_fn.',
+      default=preprocess_options.DEFAULT_ANALYZE_SEED,
+      type=int)
+
   known_args, pipeline_args = parser.parse_known_args()
-  transform_data(
+  if known_args.local_fast and (known_args.input_cache or
+                                known_args.reindex_ids or
+                                known_args.analyze_sample_rate or
+                                known_args.output_format != 'tfrecord'):
+    parser.error('--local_fast does not support --input_cache, --reindex_ids, '
+                 '--analyze_sample_rate or --output_format packed')
+  if known_args.analyze_stratify_by and not known_args.analyze_sample_rate:
+    parser.error('--analyze_stratify_by requires --analyze_sample_rate')
+
+  # Beam, TensorFlow and tf.Transform take seconds to import, so they are only
+  # imported once the flags are known to be valid.
+  import tensorflow as tf  # pylint: disable=g-import-not-at-top
+  tf.logging.set_verbosity(tf.logging.INFO)
+  if known_args.local_fast:
+    import local_preprocess  # pylint: disable=g-import-not-at-top
+    local_preprocess.transform_data(
+        input_handle=known_args.input,
+        outfile_prefix=known_args.outfile_prefix,
+        working_dir=known_args.output_dir,
+        schema_file=known_args.schema_file,
+        transform_dir=known_args.transform_dir,
+        decode_batch_size=known_args.decode_batch_size,
+        incremental=known_args.incremental,
+        analyzer_state_dir=known_args.analyzer_state_dir,
+        metrics_file=known_args.metrics_file,
+        num_shards=known_args.num_shards,
+        compression=known_args.compression,
+        shuffle=known_args.shuffle,
+        num_workers=known_args.num_workers)
+    return
+
+  import preprocess_pipeline  # pylint: disable=g-import-not-at-top
+  preprocess_pipeline.transform_data(
       input_handle=known_args.input,
       outfile_prefix=known_args.outfile_prefix,
       working_dir=known_args.output_dir,
       schema_file=known_args.schema_file,
       transform_dir=known_args.transform_dir,
+      decode_batch_size=known_args.decode_batch_size,
+      input_cache=known_args.input_cache,
+      incremental=known_args.incremental,
+      analyzer_state_dir=known_args.analyzer_state_dir,
+      metrics_file=known_args.metrics_file,
+      num_shards=known_args.num_shards,
+      compression=known_args.compression,
+      output_format=known_args.output_format,
+      shuffle=known_args.shuffle,
+      shuffle_buffer_size=known_args.shuffle_buffer_size,
+      reindex_ids=known_args.reindex_ids,
+      analyze_sample_rate=known_args.analyze_sample_rate,
+      analyze_stratify_by=known_args.analyze_stratify_by,
+      min_rows_per_stratum=known_args.min_rows_per_stratum,
+      analyze_seed=known_args.analyze_seed,
       pipeline_args=pipeline_args)
 
 
@@ -3,23 +3,55 @@ set -u
 
 echo Starting local TFT preprocessing...
 
+SCHEMA_FILE=../data/tfdv_output/schema.pbtxt
+CODE="preprocess.py preprocess_pipeline.py trainer/preprocess_options.py analyzer_state.py batched_csv.py columnar_cache.py pipeline_metrics.py"
+TRAIN_OUTPUT=../data/train/bookings_output
+EVAL_OUTPUT=../data/eval/bookings_output
+TRAIN_CACHE=../data/train/columnar
+EVAL_CACHE=../data/eval/columnar
+
+# Reuse the columnar caches tfdv_bookings.sh built, or build them.
+python columnar_cache.py --input ../data/train/train.csv \
+  --cache_dir $TRAIN_CACHE || exit 1
+python columnar_cache.py --input ../data/eval/eval.csv \
+  --cache_dir $EVAL_CACHE || exit 1
+
 # Preprocess the train files, keeping the transform functions
-echo Preprocessing train data...
-rm -R -f ../data/train/bookings_output
-python preprocess.py \
-  --input ../data/train/train.csv \
-  --schema_file ../data/tfdv_output/schema.pbtxt \
-  --output_dir ../data/train/bookings_output \
-  --outfile_prefix train_transformed \
-  --runner DirectRunner
+TRAIN_INPUTS="../data/train/train.csv $SCHEMA_FILE $CODE"
+if python stage_cache.py check --output_dir $TRAIN_OUTPUT --stage transform \
+    --inputs $TRAIN_INPUTS; then
+  echo Reusing preprocessed train data and transform function.
+else
+  echo Preprocessing train data...
+  rm -R -f $TRAIN_OUTPUT
+  python preprocess.py \
+    --input ../data/train/train.csv \
+    --input_cache $TRAIN_CACHE \
+    --schema_file $SCHEMA_FILE \
+    --output_dir $TRAIN_OUTPUT \
+    --outfile_prefix train_transformed \
+    --runner DirectRunner && \
+  python stage_cache.py stamp --output_dir $TRAIN_OUTPUT --stage transform \
+    --inputs $TRAIN_INPUTS
+fi
 
 # Preprocess the eval files
-echo Preprocessing eval data...
-rm -R -f ../data/eval/bookings_output
-python preprocess.py \
-  --input ../data/eval/eval.csv \
-  --schema_file ../data/tfdv_output/schema.pbtxt \
-  --output_dir ../data/eval/bookings_output \
-  --outfile_prefix eval_transformed \
-  --transform_dir ../data/train/bookings_output \
-  --runner DirectRunner
+EVAL_INPUTS="../data/eval/eval.csv $SCHEMA_FILE $TRAIN_OUTPUT/transform_fn $TRAIN_OUTPUT/transformed_metadata $CODE"
+if python stage_cache.py check --output_dir $EVAL_OUTPUT --stage transform \
+    --inputs $EVAL_INPUTS; then
+  echo Reusing preprocessed eval data.
+else
+  echo Preprocessing eval data...
+  rm -R -f $EVAL_OUTPUT
+  python preprocess.py \
+    --input ../data/eval/eval.csv \
+    --input_cache $EVAL_CACHE \
+    --schema_file $SCHEMA_FILE \
+    --output_dir $EVAL_OUTPUT \
+    --outfile_prefix eval_transformed \
+    --transform_dir $TRAIN_OUTPUT \
+    --shuffle none \
+    --runner DirectRunner && \
+  python stage_cache.py stamp --output_dir $EVAL_OUTPUT --stage transform \
+    --inputs $EVAL_INPUTS
+fi
@@ -0,0 +1,546 @@
+"""The tf.transform pipeline of the bookings data, run by preprocess.py."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import csv
+import hashlib
+import heapq
+import math
+import os
+import random
+import struct
+import time
+
+import apache_beam as beam
+import tensorflow as tf
+
+from apache_beam.io import filebasedsink
+from apache_beam.io.filesystem import CompressionTypes
+from apache_beam.transforms import window
+
+import tensorflow_transform as transform
+import tensorflow_transform.beam as tft_beam
+
+from tensorflow_transform.coders import example_proto_coder
+from tensorflow_transform.tf_metadata import dataset_metadata
+from tensorflow_transform.tf_metadata import dataset_schema
+from tensorflow_transform.tf_metadata import schema_utils
+
+import analyzer_state as state_lib
+import batched_csv
+import columnar_cache
+import pipeline_metrics
+from trainer import bookings
+from trainer import preprocess_options
+
+# Beam compression types of the transformed example shards, by codec name. The
+# ZLIB codec is written as DEFLATE, i.e. zlib framed, as TensorFlow reads it.
+COMPRESSION_TYPES = {
+    'GZIP': CompressionTypes.GZIP,
+    'ZLIB': CompressionTypes.DEFLATE,
+    'NONE': CompressionTypes.UNCOMPRESSED,
+}
+
+SHUFFLE_STRATEGIES = preprocess_options.SHUFFLE_STRATEGIES
+
+DEFAULT_LOCAL_SHUFFLE_BUFFER_SIZE = (
+    preprocess_options.DEFAULT_LOCAL_SHUFFLE_BUFFER_SIZE)
+
+DEFAULT_MIN_ROWS_PER_STRATUM = preprocess_options.DEFAULT_MIN_ROWS_PER_STRATUM
+
+DEFAULT_ANALYZE_SEED = preprocess_options.DEFAULT_ANALYZE_SEED
+
+def _fill_in_missing(x):
+  """Replace missing values in a SparseTensor.
+
+  Fills in missing values of `x` with '' or 0, and converts to a dense tensor.
+
+  Args:
+    x: A `SparseTensor` of rank 2.  Its dense shape should have size at most 1
+      in the second dimension.
+
+  Returns:
+    A rank 1 tensor where missing values of `x` have been filled in.
+  """
+  default_value = '' if x.dtype == tf.string else 0
+  return tf.squeeze(
+      tf.sparse.to_dense(
+          tf.SparseTensor(x.indices, x.values, [x.dense_shape[0], 1]),
+          default_value),
+      axis=1)
+
+
+class _LocalShuffleDoFn(beam.DoFn):
+  """Shuffles the elements of each bundle through a bounded buffer.
+
+  Once the buffer is full, every new element replaces a randomly chosen
+  buffered one, which is emitted. Memory is bounded by `buffer_size` elements
+  and nothing is materialized across workers, but elements only move within
+  their bundle.
+  """
+
+  def __init__(self, buffer_size):
+    super(_LocalShuffleDoFn, self).__init__()
+    self._buffer_size = buffer_size
+    self._buffer = None
+
+  def start_bundle(self):
+    self._buffer = []
+
+  def process(self, element):
+    if len(self._buffer) < self._buffer_size:
+      self._buffer.append(element)
+      return
+    i = random.randrange(self._buffer_size)
+    self._buffer[i], element = element, self._buffer[i]
+    yield element
+
+  def finish_bundle(self):
+    random.shuffle(self._buffer)
+    for element in self._buffer:
+      yield window.GlobalWindows.windowed_value(element)
+    self._buffer = None
+
+
+def _shuffle(data, strategy, buffer_size):
+  """Shuffles raw data before it is transformed and written.
+
+  Args:
+    data: A PCollection of raw lines or instances.
+    strategy: One of `SHUFFLE_STRATEGIES`. 'global' reshuffles the whole
+      dataset, 'local' shuffles each bundle through a buffer of `buffer_size`
+      elements and 'none' keeps the input order, e.g. for eval data.
+    buffer_size: Number of elements buffered by the 'local' strategy.
+
+  Returns:
+    The shuffled PCollection.
+  """
+  if strategy == 'global':
+    return data | 'RandomizeData' >> beam.transforms.Reshuffle()
+  if strategy == 'local':
+    return data | 'ShuffleLocally' >> beam.ParDo(
+        _LocalShuffleDoFn(buffer_size))
+  return data
+
+
+class _PackedRecordSink(filebasedsink.FileBasedSink):
+  """Writes `bookings.pack_instance` records back to back, without framing."""
+
+  def __init__(self, file_path_prefix, file_name_suffix, num_shards,
+               compression_type):
+    super(_PackedRecordSink, self).__init__(
+        file_path_prefix,
+        coder=beam.coders.BytesCoder(),
+        file_name_suffix=file_name_suffix,
+        num_shards=num_shards,
+        mime_type='application/octet-stream',
+        compression_type=compression_type)
+
+  def write_encoded_record(self, file_handle, encoded_value):
+    file_handle.write(encoded_value)
+
+
+def _stratum(element, stratify_by):
+  """Returns the values of the `stratify_by` columns of a line or instance."""
+  if isinstance(element, dict):
+    return tuple(str(element[key]) for key in stratify_by)
+  row = next(csv.reader([element]))
+  return tuple(row[bookings.CSV_COLUMN_NAMES.index(key)] for key in stratify_by)
+
+
+def _sample_draw(element, seed):
+  """Returns a uniform draw in [0, 1) fixed by a line or instance and a seed.
+
+  Unlike `random.random()`, the draw does not depend on the worker or the
+  order the elements are seen in, so the sample is the same on every run.
+  """
+  if isinstance(element, dict):
+    element = repr(sorted(element.items()))
+  digest = hashlib.md5(('%d:%s' % (seed, element)).encode('utf-8')).digest()
+  return struct.unpack('<Q', digest[:8])[0] / 2.0**64
+
+
+def _sample_stratum(keyed_elements, sample_rate, min_rows_per_stratum, seed):
+  """Yields the elements of a stratum with the lowest draws.
+
+  The stratum keeps `ceil(sample_rate * count)` of its `count` rows, or
+  `min_rows_per_stratum` if more, so its share of the sample does not vary
+  from run to run and even a stratum of one row is represented.
+  """
+  _, elements = keyed_elements
+  count = sum(1 for _ in elements)
+  size = min(count, max(int(math.ceil(sample_rate * count)),
+                        min_rows_per_stratum))
+  for element in heapq.nsmallest(
+      size, elements, key=lambda element: _sample_draw(element, seed)):
+    yield element
+
+
+def _sample_for_analysis(data, sample_rate, stratify_by=None,
+                         min_rows_per_stratum=DEFAULT_MIN_ROWS_PER_STRATUM,
+                         seed=DEFAULT_ANALYZE_SEED):
+  """Samples the raw data the analyzers run on.
+
+  Args:
+    data: A PCollection of raw lines or instances.
+    sample_rate: Fraction of the rows kept.
+    stratify_by: If set, raw columns whose value combinations are sampled
+      separately: each stratum keeps exactly `ceil(sample_rate * count)` of
+      its rows, the ones with the lowest draws, so that the sample is
+      proportional to the strata sizes and every stratum (e.g. a rare week or
+      city) is represented. Each stratum is grouped on one worker.
+    min_rows_per_stratum: If positive, strata smaller than
+      `min_rows_per_stratum / sample_rate` rows keep more rows (all of them
+      below `min_rows_per_stratum` rows). The sample is not reweighted, so
+      they are over-represented in the means, variances and quantiles as a
+      result, and the sample is larger.
+    seed: Seed of the sample.
+
+  Returns:
+    The sampled PCollection.
+  """
+  if not stratify_by:
+    return data | 'SampleForAnalyze' >> beam.Filter(
+        lambda element: _sample_draw(element, seed) < sample_rate)
+  return (
+      data
+      | 'KeyByStratum' >> beam.Map(
+          lambda element: (_stratum(element, stratify_by), element))
+      | 'GroupByStratum' >> beam.GroupByKey()
+      | 'SampleStrata' >> beam.FlatMap(
+          _sample_stratum, sample_rate, min_rows_per_stratum, seed))
+
+
+def _read_input(pipeline, input_handle, input_cache, schema):
+  """Reads the raw input, as CSV lines or as decoded cache instances."""
+  if input_cache:
+    return (
+        pipeline
+        | 'ReadFromCache' >> columnar_cache.ReadColumnarCache(
+            input_cache, schema))
+  return (
+      pipeline
+      | 'ReadFromText' >> beam.io.ReadFromText(
+          input_handle, skip_header_lines=1)
+      | 'CountRead' >> pipeline_metrics.Instrument('read', size_fn=len))
+
+
+def _make_decode_transform(schema, decode_batch_size, input_cache):
+  """Returns the transform decoding `_read_input` output, or None."""
+  if input_cache:
+    # The cache is already decoded.
+    return None
+  if decode_batch_size:
+    return batched_csv.BatchDecodeCSV(
+        bookings.CSV_COLUMN_NAMES, bookings.get_raw_feature_spec(schema),
+        decode_batch_size)
+  csv_coder = bookings.make_csv_coder(schema)
+  return pipeline_metrics.Instrument('decode', fn=csv_coder.decode)
+
+
+def make_preprocessing_fn(analyzer_state=None, reindex_ids=False):
+  """Returns tf.transform's callback function for preprocessing inputs.
+
+  Args:
+    analyzer_state: If set, an AnalyzerState whose moments and quantiles are
+      constant-folded into the graph instead of running the z-score and
+      bucketize analyzers.
+    reindex_ids: If True, the ids of `bookings.REINDEX_FEATURE_KEYS` are
+      mapped to dense indices of a frequency-thresholded vocabulary.
+  """
+
+  def preprocessing_fn(inputs):
+    """tf.transform's callback function for preprocessing inputs.
+
+    Args:
+      inputs: map from feature keys to raw not-yet-transformed features.
+
+    Returns:
+      Map from string feature key to transformed feature operations.
+    """
+    outputs = {}
+    for key in bookings.DENSE_FLOAT_FEATURE_KEYS:
+      # Preserve this feature as a dense float, setting nan's to the mean.
+      if analyzer_state is None:
+        outputs[bookings.transformed_name(key)] = transform.scale_to_z_score(
+            _fill_in_missing(inputs[key]))
+      else:
+        outputs[bookings.transformed_name(key)] = (
+            analyzer_state.scale_to_z_score(
+                _fill_in_missing(inputs[key]), key))
+
+    for key in bookings.VOCAB_FEATURE_KEYS:
+      # Build a vocabulary for this feature.
+      outputs[
+          bookings.transformed_name(key)] = transform.compute_and_apply_vocabulary(
+              _fill_in_missing(inputs[key]),
+              top_k=bookings.VOCAB_SIZE,
+              num_oov_buckets=bookings.OOV_SIZE)
+
+    for key in bookings.BUCKET_FEATURE_KEYS:
+      if analyzer_state is None:
+        outputs[bookings.transformed_name(key)] = transform.bucketize(
+            _fill_in_missing(inputs[key]), bookings.FEATURE_BUCKET_COUNT)
+      else:
+        outputs[bookings.transformed_name(key)] = analyzer_state.bucketize(
+            _fill_in_missing(inputs[key]), key, bookings.FEATURE_BUCKET_COUNT)
+
+    for key in bookings.CATEGORICAL_FEATURE_KEYS:
+      if reindex_ids and key in bookings.REINDEX_FEATURE_KEYS:
+        outputs[bookings.transformed_name(
+            key)] = transform.compute_and_apply_vocabulary(
+                tf.as_string(_fill_in_missing(inputs[key])),
+                frequency_threshold=bookings.REINDEX_FREQUENCY_THRESHOLD,
+                num_oov_buckets=bookings.REINDEX_OOV_SIZE,
+                vocab_filename=bookings.reindex_vocab_name(key))
+      else:
+        outputs[bookings.transformed_name(key)] = _fill_in_missing(inputs[key])
+
+    outputs[bookings.transformed_name(bookings.LABEL_KEY)] = _fill_in_missing(
+        inputs[bookings.LABEL_KEY])
+
+    return outputs
+
+  return preprocessing_fn
+
+
+def compute_analyzer_state(input_handle,
+                           schema,
+                           temp_dir,
+                           decode_batch_size=batched_csv.DEFAULT_BATCH_SIZE,
+                           input_cache=None,
+                           pipeline_args=None):
+  """Computes the AnalyzerState of the input data alone.
+
+  Args:
+    input_handle: Path to csv file with input data.
+    schema: The schema of the input data.
+    temp_dir: Directory through which the state is handed back to the caller.
+    decode_batch_size: Number of CSV lines parsed together into NumPy columns.
+    input_cache: Directory of a columnar cache read instead of `input_handle`.
+    pipeline_args: additional DataflowRunner or DirectRunner args passed to the
+      beam pipeline.
+
+  Returns:
+    An AnalyzerState.
+  """
+  with beam.Pipeline(argv=pipeline_args) as pipeline:
+    data = _read_input(pipeline, input_handle, input_cache, schema)
+    decode_transform = _make_decode_transform(schema, decode_batch_size,
+                                              input_cache)
+    if decode_transform is not None:
+      data = data | 'Decode' >> decode_transform
+    _ = (
+        data
+        | 'CombineAnalyzerState' >> beam.CombineGlobally(
+            state_lib.AnalyzerStateCombineFn(
+                bookings.DENSE_FLOAT_FEATURE_KEYS,
+                bookings.BUCKET_FEATURE_KEYS))
+        | 'WriteAnalyzerState' >> beam.Map(
+            lambda analyzer_state: analyzer_state.write(temp_dir)))
+  analyzer_state = state_lib.AnalyzerState.read(temp_dir)
+  tf.gfile.DeleteRecursively(temp_dir)
+  return analyzer_state
+
+
+def transform_data(input_handle,
+                   outfile_prefix,
+                   working_dir,
+                   schema_file,
+                   transform_dir=None,
+                   decode_batch_size=batched_csv.DEFAULT_BATCH_SIZE,
+                   input_cache=None,
+                   incremental=False,
+                   analyzer_state_dir=None,
+                   metrics_file=None,
+                   num_shards=0,
+                   compression='GZIP',
+                   output_format='tfrecord',
+                   shuffle='global',
+                   shuffle_buffer_size=DEFAULT_LOCAL_SHUFFLE_BUFFER_SIZE,
+                   reindex_ids=False,
+                   analyze_sample_rate=None,
+                   analyze_stratify_by=None,
+                   min_rows_per_stratum=DEFAULT_MIN_ROWS_PER_STRATUM,
+                   analyze_seed=DEFAULT_ANALYZE_SEED,
+                   pipeline_args=None):
+  """The main tf.transform method which analyzes and transforms data.
+
+  Args:
+    input_handle: BigQuery table name to process specified as DATASET.TABLE or
+      path to csv file with input data.
+    outfile_prefix: Filename prefix for emitted transformed examples
+    working_dir: Directory in which transformed examples and transform function
+      will be emitted.
+    schema_file: An file path that contains a text-serialized TensorFlow
+      metadata schema of the input data.
+    transform_dir: Directory in which the transform output is located. If
+      provided, this will load the transform_fn from disk instead of computing
+      it over the data. Hint: this is useful for transforming eval data.
+    decode_batch_size: Number of CSV lines parsed together into NumPy columns.
+      If 0, lines are decoded one at a time with the tf.Transform CsvCoder.
+    input_cache: Directory of a columnar cache built by `columnar_cache.py`.
+      If provided, it is read instead of parsing `input_handle`.
+    incremental: If True, the analyzer accumulators of the input data are
+      merged with the AnalyzerState found in `analyzer_state_dir` (if any) and
+      stored in `working_dir`, and the transform_fn is built from the merged
+      state rather than by re-analyzing the full history.
+    analyzer_state_dir: Directory holding the AnalyzerState of the previously
+      analyzed data, typically the `working_dir` of the previous run.
+    metrics_file: If set, the pipeline's element, byte and latency metrics
+      and the wall time of each phase are written to this JSON file.
+    num_shards: Number of transformed example shards. If 0, the runner picks
+      the number of shards.
+    compression: Codec of the transformed example shards, one of
+      `COMPRESSION_TYPES`. It is recorded with the shards in
+      `<outfile_prefix>.metadata.json` so the trainer can read them back.
+    output_format: Format of the transformed example shards, one of
+      `bookings.OUTPUT_FORMATS`. 'packed' shards hold fixed-width records of
+      `bookings.packed_layout`, whose layout is recorded in the metadata file.
+    shuffle: How the data is shuffled before it is written, one of
+      `SHUFFLE_STRATEGIES`. Training reads shards in random order through a
+      shuffle buffer, so a 'local' shuffle is usually enough for train data and
+      eval data needs none.
+    shuffle_buffer_size: Number of raw lines buffered per worker by the
+      'local' shuffle.
+    reindex_ids: If True, the ids of `bookings.REINDEX_FEATURE_KEYS` are
+      mapped to dense indices of a vocabulary of the ids seen at least
+      `bookings.REINDEX_FREQUENCY_THRESHOLD` times, with
+      `bookings.REINDEX_OOV_SIZE` hash buckets for the other ids.
+    analyze_sample_rate: If set, the analyzers run on this fraction of the
+      rows, while all of them are transformed.
+    analyze_stratify_by: If set, raw columns by which the analysis sample is
+      stratified, see `_sample_for_analysis`.
+    min_rows_per_stratum: Rows of each stratum kept, at least, by a
+      stratified sample, see `_sample_for_analysis`.
+    analyze_seed: Seed of the analysis sample.
+    pipeline_args: additional DataflowRunner or DirectRunner args passed to the
+      beam pipeline.
+  """
+  schema = bookings.read_schema(schema_file)
+  raw_feature_spec = bookings.get_raw_feature_spec(schema)
+  raw_schema = dataset_schema.from_feature_spec(raw_feature_spec)
+  raw_data_metadata = dataset_metadata.DatasetMetadata(raw_schema)
+
+  if reindex_ids and incremental:
+    raise ValueError('--reindex_ids needs a full analysis, it cannot be '
+                     'combined with --incremental')
+  if analyze_sample_rate and (incremental or reindex_ids):
+    raise ValueError('--analyze_sample_rate cannot be combined with '
+                     '--incremental or --reindex_ids, whose vocabulary '
+                     'frequencies need all the rows')
+
+  start = time.time()
+  analyzer_state = None
+  if incremental and transform_dir is None:
+    analyzer_state = compute_analyzer_state(
+        input_handle, schema, os.path.join(working_dir, 'analyzer_state_tmp'),
+        decode_batch_size, input_cache, pipeline_args)
+    if (analyzer_state_dir and tf.gfile.Exists(
+        os.path.join(analyzer_state_dir, state_lib.ANALYZER_STATE_FILE))):
+      analyzer_state = state_lib.AnalyzerState.read(analyzer_state_dir).merge(
+          analyzer_state)
+    analyzer_state.write(working_dir)
+  analyzer_state_secs = time.time() - start
+
+  pipeline = beam.Pipeline(argv=pipeline_args)
+  with tft_beam.Context(temp_dir=working_dir):
+    raw_data = _read_input(pipeline, input_handle, input_cache, schema)
+    decode_transform = _make_decode_transform(schema, decode_batch_size,
+                                              input_cache)
+
+    def decode(data, label):
+      if decode_transform is None:
+        return data
+      return data | label >> decode_transform
+
+    if transform_dir is None:
+      if analyzer_state is None:
+        analyze_data = raw_data
+        if analyze_sample_rate:
+          analyze_data = _sample_for_analysis(
+              raw_data, analyze_sample_rate, analyze_stratify_by,
+              min_rows_per_stratum, analyze_seed)
+        decoded_data = decode(analyze_data, 'DecodeForAnalyze')
+      else:
+        # preprocessing_fn has no analyzers left, so there is nothing to
+        # analyze beyond tracing the graph.
+        decoded_data = pipeline | 'CreateAnalyzeInput' >> beam.Create([])
+      transform_fn = (
+          (decoded_data, raw_data_metadata) |
+          ('Analyze' >> tft_beam.AnalyzeDataset(
+              make_preprocessing_fn(analyzer_state, reindex_ids))))
+
+      _ = (
+          transform_fn
+          | ('WriteTransformFn' >>
+             tft_beam.WriteTransformFn(working_dir)))
+    else:
+      transform_fn = pipeline | tft_beam.ReadTransformFn(transform_dir)
+
+    # Shuffling the data before materialization will improve Training
+    # effectiveness downstream. Here we shuffle the raw_data before the CSV
+    # decode, as raw lines are more compact than decoded instances. With
+    # --input_cache, raw_data already holds the decoded cache instances, so
+    # those are shuffled instead.
+    shuffled_data = _shuffle(raw_data, shuffle, shuffle_buffer_size)
+
+    decoded_data = decode(shuffled_data, 'DecodeForTransform')
+    (transformed_data, transformed_metadata) = (
+        ((decoded_data, raw_data_metadata), transform_fn)
+        | 'Transform' >> tft_beam.TransformDataset())
+
+    output_prefix = os.path.join(working_dir, outfile_prefix)
+    layout = None
+    if output_format == 'packed':
+      layout = bookings.packed_layout(
+          schema_utils.schema_as_feature_spec(
+              transformed_metadata.schema).feature_spec)
+      encode = lambda instance: bookings.pack_instance(instance, layout)
+      write_examples = beam.io.Write(_PackedRecordSink(
+          output_prefix,
+          bookings.PACKED_SUFFIX + bookings.COMPRESSION_SUFFIXES[compression],
+          num_shards, COMPRESSION_TYPES[compression]))
+    else:
+      encode = example_proto_coder.ExampleProtoCoder(
+          transformed_metadata.schema).encode
+      write_examples = beam.io.WriteToTFRecord(
+          output_prefix,
+          file_name_suffix=bookings.COMPRESSION_SUFFIXES[compression],
+          num_shards=num_shards,
+          compression_type=COMPRESSION_TYPES[compression])
+    _ = (
+        transformed_data
+        | 'CountTransformed' >> pipeline_metrics.Instrument('transform')
+        | 'SerializeExamples' >> pipeline_metrics.Instrument(
+            'serialize', fn=encode, size_fn=len)
+        | 'WriteExamples' >> write_examples
+        | 'CountWritten' >> pipeline_metrics.Instrument('write_shards')
+    )
+
+  result = pipeline.run()
+  result.wait_until_finish()
+  if analyzer_state is not None:
+    # The transform_fn was just built from the stored state, so
+    # `preprocess.py --local_fast --transform_dir` may apply the state instead.
+    state_lib.stamp_transform_fn(working_dir)
+
+  shards = tf.gfile.Glob(output_prefix + '-*-of-*')
+  output_metadata = {
+      'format': output_format,
+      'compression': compression,
+      'num_shards': len(shards),
+      'file_pattern': os.path.basename(output_prefix) + '-*',
+  }
+  if layout is not None:
+    output_metadata['layout'] = layout
+  bookings.write_output_metadata(output_prefix, output_metadata)
+
+  if metrics_file:
+    metrics = pipeline_metrics.query_metrics(result)
+    metrics['wall_secs'] = {
+        'analyzer_state': analyzer_state_secs,
+        'pipeline': time.time() - start - analyzer_state_secs,
+    }
+    pipeline_metrics.write_metrics(metrics_file, metrics)
@@ -0,0 +1,45 @@
+"""Tests of the analysis sample of preprocess_pipeline.py.
+
+  python preprocess_pipeline_test.py
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import apache_beam as beam
+import tensorflow as tf
+
+from apache_beam.testing import test_pipeline
+from apache_beam.testing import util
+
+import preprocess_pipeline
+
+
+def _rows(city_id, count):
+  return [{'city_id': city_id, 'id': i} for i in range(count)]
+
+
+class SampleForAnalysisTest(tf.test.TestCase):
+
+  def _sample_sizes(self, rows, sample_rate, stratify_by, expected):
+    with test_pipeline.TestPipeline() as pipeline:
+      sample = preprocess_pipeline._sample_for_analysis(  # pylint: disable=protected-access
+          pipeline | beam.Create(rows), sample_rate, stratify_by)
+      util.assert_that(
+          sample
+          | beam.Map(lambda row: row['city_id'])
+          | beam.combiners.Count.PerElement(),
+          util.equal_to(expected))
+
+  def testSmallStratumSurvivesLowRate(self):
+    # 1% of 2000 rows, and ceil(1% of 3 rows) of the small city.
+    self._sample_sizes(_rows(1, 2000) + _rows(2, 3), 0.01, ['city_id'],
+                       [(1, 20), (2, 1)])
+
+  def testStrataAreProportional(self):
+    self._sample_sizes(_rows(1, 1000) + _rows(2, 500), 0.1, ['city_id'],
+                       [(1, 100), (2, 50)])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,219 @@
+"""Writes a reduced-precision variant of the trainer's serving export.
+
+The latest `bookings` export is frozen, its large float32 weights are stored in
+lower precision and the result is saved as a new SavedModel with the same
+`predict` signature, under `export/bookings_<precision>/<timestamp>`:
+
+  * fp16: weights are stored as float16 constants cast back to float32 when
+          the graph runs.
+  * int8: weights are stored as 8 bit integers with their range, and
+          dequantized when the graph runs (graph_transforms quantize_weights).
+
+Computation stays in float32, so the variants mostly save disk space and load
+time. The accuracy delta of the variant is then reported on the eval CSV.
+
+  python quantize_export.py \
+      --serving_model_dir ../data/train/bookings_output/serving_model_dir \
+      --schema_file ../data/tfdv_output/schema.pbtxt \
+      --eval_csv ../data/eval/eval.csv --precision int8
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.tools.graph_transforms import TransformGraph
+
+import serve
+from trainer import bookings
+
+PRECISIONS = ('fp16', 'int8')
+
+# Float constants with fewer elements than this are kept in float32.
+DEFAULT_MINIMUM_SIZE = 1024
+
+
+def export_name(precision):
+  return '%s_%s' % (serve.EXPORT_NAME, precision)
+
+
+def _fp16_weights(graph_def, minimum_size):
+  """Stores large float32 constants as float16, cast back to float32."""
+  output = tf.GraphDef()
+  output.versions.CopyFrom(graph_def.versions)
+  output.library.CopyFrom(graph_def.library)
+  for node in graph_def.node:
+    is_float_const = (node.op == 'Const' and
+                      node.attr['dtype'].type == tf.float32.as_datatype_enum)
+    value = node.attr['value'].tensor
+    if (not is_float_const or
+        np.prod([d.size for d in value.tensor_shape.dim]) < minimum_size):
+      output.node.extend([node])
+      continue
+    weights = tf.make_ndarray(value).astype(np.float16)
+    half = output.node.add()
+    half.op = 'Const'
+    half.name = node.name + '/fp16'
+    half.device = node.device
+    half.attr['dtype'].type = tf.float16.as_datatype_enum
+    half.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(weights))
+    cast = output.node.add()
+    cast.op = 'Cast'
+    cast.name = node.name
+    cast.device = node.device
+    cast.input.append(half.name)
+    cast.attr['SrcT'].type = tf.float16.as_datatype_enum
+    cast.attr['DstT'].type = tf.float32.as_datatype_enum
+  return output
+
+
+def _node_name(tensor_name):
+  return tensor_name.split(':')[0]
+
+
+def quantize(export_dir, output_dir, precision,
+             minimum_size=DEFAULT_MINIMUM_SIZE):
+  """Writes a reduced-precision copy of a serving SavedModel.
+
+  Args:
+    export_dir: The float32 SavedModel exported by trainer/task.py.
+    output_dir: Directory of the new SavedModel.
+    precision: One of `PRECISIONS`.
+    minimum_size: Float constants with fewer elements are kept in float32.
+  """
+  with tf.Graph().as_default() as graph, tf.Session() as session:
+    meta_graph = tf.saved_model.loader.load(
+        session, [tf.saved_model.tag_constants.SERVING], export_dir)
+    signature = meta_graph.signature_def[serve.SIGNATURE_KEY]
+    table_initializers = [
+        op.name for op in graph.get_collection(tf.GraphKeys.TABLE_INITIALIZERS)
+    ]
+    asset_tensors = [
+        asset.tensor_info.name for asset in meta_graph.asset_file_def
+    ]
+    outputs = [_node_name(t.name) for t in signature.outputs.values()]
+    frozen = tf.graph_util.convert_variables_to_constants(
+        session, graph.as_graph_def(), outputs + table_initializers)
+
+  if precision == 'int8':
+    inputs = [_node_name(t.name) for t in signature.inputs.values()]
+    transformed = TransformGraph(
+        frozen, inputs, outputs + table_initializers,
+        ['quantize_weights(minimum_size=%d)' % minimum_size])
+  else:
+    transformed = _fp16_weights(frozen, minimum_size)
+
+  with tf.Graph().as_default() as graph, tf.Session() as session:
+    tf.import_graph_def(transformed, name='')
+    for name in asset_tensors:
+      tf.add_to_collection(tf.GraphKeys.ASSET_FILEPATHS,
+                           graph.get_tensor_by_name(name))
+    builder = tf.saved_model.builder.SavedModelBuilder(output_dir)
+    builder.add_meta_graph_and_variables(
+        session, [tf.saved_model.tag_constants.SERVING],
+        signature_def_map={serve.SIGNATURE_KEY: signature},
+        assets_collection=tf.get_collection(tf.GraphKeys.ASSET_FILEPATHS),
+        main_op=tf.group(*[
+            graph.get_operation_by_name(name) for name in table_initializers
+        ]))
+    builder.save()
+
+
+def export_size(export_dir):
+  """Returns the size on disk of a SavedModel, in bytes."""
+  size = 0
+  for root, _, names in tf.gfile.Walk(export_dir):
+    size += sum(tf.gfile.Stat(os.path.join(root, name)).length
+                for name in names)
+  return size
+
+
+def accuracy_delta(eval_csv, schema, export_dir, variant_dir, max_rows,
+                   batch_size=1024):
+  """Compares the predictions of two exports on labelled rows.
+
+  Returns:
+    A dict with the mean absolute error against the label of both exports,
+    and the mean and max absolute difference between their predictions.
+  """
+  encoder = serve.ExampleEncoder(schema)
+  with open(eval_csv) as f:
+    reader = csv.DictReader(f, fieldnames=bookings.CSV_COLUMN_NAMES)
+    next(reader)  # Skip the header line.
+    rows = [row for row in itertools.islice(reader, max_rows)
+            if row[bookings.LABEL_KEY] != '']
+  examples = [encoder.encode(row) for row in rows]
+  labels = np.array([float(row[bookings.LABEL_KEY]) for row in rows])
+
+  def predict_all(predict_fn):
+    return np.array([
+        prediction for i in range(0, len(examples), batch_size)
+        for prediction in predict_fn(examples[i:i + batch_size])
+    ])
+
+  baseline = predict_all(serve.load_predict_fn(export_dir))
+  variant = predict_all(serve.load_predict_fn(variant_dir))
+  return {
+      'rows': len(rows),
+      'float32_mae': float(np.mean(np.abs(baseline - labels))),
+      'variant_mae': float(np.mean(np.abs(variant - labels))),
+      'mean_abs_delta': float(np.mean(np.abs(variant - baseline))),
+      'max_abs_delta': float(np.max(np.abs(variant - baseline))),
+  }
+
+
+def main():
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--serving_model_dir',
+      help='Directory holding the export/bookings models of the trainer.',
+      required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--precision', help='Precision of the stored weights',
+      choices=PRECISIONS, default='int8')
+  parser.add_argument(
+      '--minimum_size',
+      help='Float constants with fewer elements are kept in float32',
+      default=DEFAULT_MINIMUM_SIZE,
+      type=int)
+  parser.add_argument(
+      '--eval_csv',
+      help='If set, the accuracy delta is reported on rows of this CSV file.',
+      default=None)
+  parser.add_argument(
+      '--max_rows', help='Number of eval rows to compare', default=100000,
+      type=int)
+  args = parser.parse_args()
+
+  export_dir = serve.latest_export_dir(args.serving_model_dir)
+  output_dir = os.path.join(args.serving_model_dir, 'export',
+                            export_name(args.precision),
+                            str(int(time.time())))
+  quantize(export_dir, output_dir, args.precision, args.minimum_size)
+  report = {
+      'float32_bytes': export_size(export_dir),
+      'variant_bytes': export_size(output_dir),
+  }
+  if args.eval_csv:
+    report.update(accuracy_delta(args.eval_csv,
+                                 bookings.read_schema(args.schema_file),
+                                 export_dir, output_dir, args.max_rows))
+  print('Wrote %s: %s' % (output_dir, json.dumps(report, sort_keys=True)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,165 @@
+"""Scores a CSV file with the model exported by trainer/task.py.
+
+Rows are decoded with the CsvCoder of `bookings.make_csv_coder`, grouped into
+batches and run through the latest `bookings` export, which is loaded once per
+worker process and shared by all the bundles that process runs. Predictions
+are written as `id,prediction` CSV shards.
+
+  python score.py --input ../data/eval/eval.csv \
+      --schema_file ../data/tfdv_output/schema.pbtxt \
+      --serving_model_dir ../data/train/bookings_output/serving_model_dir \
+      --output_prefix ../data/eval/predictions \
+      --runner DirectRunner --direct_num_workers 4 \
+      --direct_running_mode multi_processing
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import threading
+import time
+
+import apache_beam as beam
+import numpy as np
+import tensorflow as tf
+
+import pipeline_metrics
+import serve
+from trainer import bookings
+
+DEFAULT_BATCH_SIZE = 256
+
+ID_KEY = 'id'
+
+# Prediction functions loaded in this process, by export directory.
+_predict_fns = {}
+_predict_fns_lock = threading.Lock()
+
+
+def _shared_predict_fn(export_dir):
+  """Returns the prediction function of an export, loading it once."""
+  with _predict_fns_lock:
+    if export_dir not in _predict_fns:
+      _predict_fns[export_dir] = serve.load_predict_fn(export_dir)
+    return _predict_fns[export_dir]
+
+
+def _scalar(value):
+  """Returns the single value of a decoded CSV field, or None if empty."""
+  if isinstance(value, (list, np.ndarray)):
+    return value[0] if len(value) else None
+  return value
+
+
+class _PredictDoFn(beam.DoFn):
+  """Runs batches of (id, serialized example) pairs through the model."""
+
+  def __init__(self, export_dir):
+    super(_PredictDoFn, self).__init__()
+    self._export_dir = export_dir
+    self._predict_fn = None
+
+  def start_bundle(self):
+    if self._predict_fn is None:
+      self._predict_fn = _shared_predict_fn(self._export_dir)
+
+  def process(self, batch):
+    ids, examples = zip(*batch)
+    for row_id, prediction in zip(ids, self._predict_fn(list(examples))):
+      yield '%s,%s' % (row_id, prediction)
+
+
+def score(input_handle,
+          schema_file,
+          serving_model_dir,
+          output_prefix,
+          batch_size=DEFAULT_BATCH_SIZE,
+          metrics_file=None,
+          pipeline_args=None):
+  """Writes the predictions of the latest export for every input row.
+
+  Args:
+    input_handle: Path to csv file with input data.
+    schema_file: An file path that contains a text-serialized TensorFlow
+      metadata schema of the input data.
+    serving_model_dir: The serving model directory of trainer/task.py, whose
+      latest `bookings` export is used.
+    output_prefix: Path prefix of the `id,prediction` CSV shards.
+    batch_size: Number of rows run through the model at once.
+    metrics_file: If set, the pipeline's element counts and the wall time are
+      written to this JSON file.
+    pipeline_args: additional DataflowRunner or DirectRunner args passed to the
+      beam pipeline.
+  """
+  schema = bookings.read_schema(schema_file)
+  csv_coder = bookings.make_csv_coder(schema)
+  example_coder = bookings.make_proto_coder(schema)
+  export_dir = serve.latest_export_dir(serving_model_dir)
+
+  start = time.time()
+  pipeline = beam.Pipeline(argv=pipeline_args)
+  _ = (
+      pipeline
+      | 'ReadInputText' >> beam.io.ReadFromText(
+          input_handle, skip_header_lines=1)
+      | 'DecodeCSV' >> pipeline_metrics.Instrument(
+          'score_decode', fn=csv_coder.decode)
+      | 'KeyById' >> beam.Map(
+          lambda instance: (_scalar(instance[ID_KEY]),
+                            example_coder.encode(instance)))
+      | 'Batch' >> beam.BatchElements(
+          min_batch_size=batch_size, max_batch_size=batch_size)
+      | 'Predict' >> beam.ParDo(_PredictDoFn(export_dir))
+      | 'CountPredictions' >> pipeline_metrics.Instrument('score_predict')
+      | 'WritePredictions' >> beam.io.WriteToText(
+          output_prefix, file_name_suffix='.csv', header='id,prediction'))
+  result = pipeline.run()
+  result.wait_until_finish()
+
+  if metrics_file:
+    metrics = pipeline_metrics.query_metrics(result)
+    metrics['wall_secs'] = time.time() - start
+    pipeline_metrics.write_metrics(metrics_file, metrics)
+
+
+def main():
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input', help='Input path to csv file with input data.', required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--serving_model_dir',
+      help='Serving model directory written by trainer/task.py',
+      required=True)
+  parser.add_argument(
+      '--output_prefix',
+      help='Path prefix of the id,prediction CSV files',
+      required=True)
+  parser.add_argument(
+      '--batch_size',
+      help='Number of rows run through the model at once',
+      default=DEFAULT_BATCH_SIZE,
+      type=int)
+  parser.add_argument(
+      '--metrics_file',
+      help='If set, pipeline metrics are written to this JSON file.',
+      default=None)
+
+  known_args, pipeline_args = parser.parse_known_args()
+  score(
+      input_handle=known_args.input,
+      schema_file=known_args.schema_file,
+      serving_model_dir=known_args.serving_model_dir,
+      output_prefix=known_args.output_prefix,
+      batch_size=known_args.batch_size,
+      metrics_file=known_args.metrics_file,
+      pipeline_args=pipeline_args)
+
+
+if __name__ == '__main__':
+  main()
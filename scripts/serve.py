@@ -0,0 +1,471 @@
+"""Local HTTP prediction server with dynamic micro-batching.
+
+Loads the latest SavedModel exported by `trainer/task.py` and serves it on
+localhost. Concurrent requests are queued and grouped into batches of at most
+`--max_batch_size` rows, waiting at most `--max_wait_ms` for a batch to fill,
+so that the model runs once per batch instead of once per row.
+
+Predictions are cached by raw feature row, so that rows asked for again
+within `--cache_ttl_secs` skip the model. The export directory is polled
+every `--model_poll_secs`; a newer export is loaded in place of the served one
+and the cache is invalidated.
+
+  POST /predict  {"instances": [{"hotel_id": 12, "clicks": 3, ...}, ...]}
+  GET  /stats    latency percentiles, QPS, batch sizes and cache hit rate.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+import hashlib
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+
+from concurrent import futures
+from http import server
+
+import numpy as np
+import tensorflow as tf
+
+from trainer import bookings
+
+EXPORT_NAME = 'bookings'
+SIGNATURE_KEY = 'predict'
+
+
+def latest_export_dir(serving_model_dir, export_name=EXPORT_NAME):
+  """Returns the most recent export of `export_name` under a model dir."""
+  export_base = os.path.join(serving_model_dir, 'export', export_name)
+  versions = [
+      version for version in tf.gfile.ListDirectory(export_base)
+      if version.strip('/').isdigit()
+  ]
+  if not versions:
+    raise ValueError('No exported model found in %s' % export_base)
+  latest = max(versions, key=lambda version: int(version.strip('/')))
+  return os.path.join(export_base, latest.strip('/'))
+
+
+def _parse_value(value, dtype):
+  if dtype == tf.string:
+    return value if isinstance(value, bytes) else str(value).encode('utf-8')
+  return int(value) if dtype.is_integer else float(value)
+
+
+class ExampleEncoder(object):
+  """Serializes raw booking rows into the tf.Examples the model parses."""
+
+  def __init__(self, schema):
+    # The coder expects every raw feature, including the label which serving
+    # rows never carry.
+    self._coder_feature_spec = bookings.get_raw_feature_spec(schema)
+    self._raw_feature_spec = dict(self._coder_feature_spec)
+    self._raw_feature_spec.pop(bookings.LABEL_KEY)
+    self._coder = bookings.make_proto_coder(schema)
+
+  def typed_row(self, row):
+    """Casts the fields of a JSON or CSV row to the schema dtypes."""
+    typed = {}
+    for key, spec in self._raw_feature_spec.items():
+      value = row.get(key)
+      if value is not None and value != '':
+        typed[key] = _parse_value(value, spec.dtype)
+    return typed
+
+  def encode(self, row):
+    raw = bookings.clean_raw_data_dict(self.typed_row(row),
+                                       self._coder_feature_spec)
+    return self._coder.encode(raw)
+
+  def cache_key(self, row):
+    """Returns a stable hash of the typed row, ignoring non-schema fields."""
+    typed = self.typed_row(row)
+    return hashlib.sha1(
+        repr(sorted(typed.items())).encode('utf-8')).hexdigest()
+
+
+class PredictionCache(object):
+  """Thread-safe LRU cache of predictions, whose entries expire after a TTL.
+
+  Entries are tagged with the cache generation, which `invalidate` bumps when
+  a new model is loaded, so that predictions of the previous model still in
+  flight are not stored.
+  """
+
+  def __init__(self, max_size=10000, ttl_secs=300):
+    self._lock = threading.Lock()
+    self._entries = collections.OrderedDict()
+    self._max_size = max_size
+    self._ttl_secs = ttl_secs
+    self._generation = 0
+    self._hits = 0
+    self._misses = 0
+    self._evictions = 0
+    self._invalidations = 0
+
+  @property
+  def generation(self):
+    with self._lock:
+      return self._generation
+
+  def get(self, key):
+    """Returns the cached prediction of a key, or None."""
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and time.time() - entry[1] > self._ttl_secs:
+        del self._entries[key]
+        entry = None
+      if entry is None:
+        self._misses += 1
+        return None
+      self._entries.move_to_end(key)
+      self._hits += 1
+      return entry[0]
+
+  def put(self, key, prediction, generation):
+    """Caches a prediction made while the cache was at `generation`."""
+    with self._lock:
+      if generation != self._generation:
+        return
+      self._entries[key] = (prediction, time.time())
+      self._entries.move_to_end(key)
+      while len(self._entries) > self._max_size:
+        self._entries.popitem(last=False)
+        self._evictions += 1
+
+  def invalidate(self):
+    """Drops every entry, e.g. once another model is served."""
+    with self._lock:
+      self._entries.clear()
+      self._generation += 1
+      self._invalidations += 1
+
+  def report(self):
+    with self._lock:
+      lookups = self._hits + self._misses
+      return {
+          'size': len(self._entries),
+          'hits': self._hits,
+          'misses': self._misses,
+          'hit_rate': self._hits / lookups if lookups else 0.0,
+          'evictions': self._evictions,
+          'invalidations': self._invalidations,
+      }
+
+
+class LatencyStats(object):
+  """Thread-safe request latency and batch size tracker."""
+
+  def __init__(self, window=100000):
+    self._lock = threading.Lock()
+    self._latencies = collections.deque(maxlen=window)
+    self._batch_sizes = collections.deque(maxlen=window)
+    self._start = time.time()
+    self._requests = 0
+
+  def record_request(self, latency_secs):
+    with self._lock:
+      self._latencies.append(latency_secs)
+      self._requests += 1
+
+  def record_batch(self, batch_size):
+    with self._lock:
+      self._batch_sizes.append(batch_size)
+
+  def report(self):
+    with self._lock:
+      latencies = np.array(self._latencies) * 1000
+      batch_sizes = np.array(self._batch_sizes)
+      elapsed = time.time() - self._start
+      requests = self._requests
+    report = {'requests': requests, 'qps': requests / elapsed}
+    if len(latencies):
+      report.update({
+          'p50_ms': float(np.percentile(latencies, 50)),
+          'p99_ms': float(np.percentile(latencies, 99)),
+      })
+    if len(batch_sizes):
+      report['mean_batch_size'] = float(batch_sizes.mean())
+    return report
+
+
+class MicroBatcher(object):
+  """Groups single-row prediction calls into batched model calls."""
+
+  def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=5,
+               stats=None):
+    """Creates the batcher and starts its worker thread.
+
+    Args:
+      predict_fn: Function mapping a list of serialized tf.Examples to a list
+        of predictions.
+      max_batch_size: Maximum number of rows sent to `predict_fn` at once.
+      max_wait_ms: Maximum time the first row of a batch waits for others.
+      stats: An optional LatencyStats recording batch sizes.
+    """
+    self._predict_fn = predict_fn
+    # Held while a batch is predicted, so that the function is not swapped
+    # out from under it.
+    self._predict_lock = threading.Lock()
+    self._max_batch_size = max_batch_size
+    self._max_wait_secs = max_wait_ms / 1000
+    self._stats = stats
+    self._queue = queue.Queue()
+    thread = threading.Thread(target=self._run)
+    thread.daemon = True
+    thread.start()
+
+  def set_predict_fn(self, predict_fn):
+    """Sends the next batches to another prediction function.
+
+    Returns once the batch being predicted, if any, is done, so that the
+    previous function can be released.
+    """
+    with self._predict_lock:
+      self._predict_fn = predict_fn
+
+  def submit(self, serialized_example):
+    """Returns a future resolving to the prediction of one example."""
+    future = futures.Future()
+    self._queue.put((serialized_example, future))
+    return future
+
+  def _next_batch(self):
+    batch = [self._queue.get()]
+    deadline = time.time() + self._max_wait_secs
+    while len(batch) < self._max_batch_size:
+      timeout = deadline - time.time()
+      if timeout <= 0:
+        break
+      try:
+        batch.append(self._queue.get(timeout=timeout))
+      except queue.Empty:
+        break
+    return batch
+
+  def _run(self):
+    while True:
+      batch = self._next_batch()
+      if self._stats is not None:
+        self._stats.record_batch(len(batch))
+      try:
+        with self._predict_lock:
+          predictions = self._predict_fn([example for example, _ in batch])
+      except Exception as e:  # pylint: disable=broad-except
+        for _, future in batch:
+          future.set_exception(e)
+        continue
+      for (_, future), prediction in zip(batch, predictions):
+        future.set_result(prediction)
+
+
+def load_model(export_dir):
+  """Loads an exported model as a batch prediction function.
+
+  Returns:
+    A (predict_fn, close_fn) tuple, where close_fn releases the session and
+      graph of the model once predict_fn is no longer called.
+  """
+  predictor = tf.contrib.predictor.from_saved_model(
+      export_dir, signature_def_key=SIGNATURE_KEY)
+
+  def predict_fn(serialized_examples):
+    outputs = predictor({'examples': serialized_examples})
+    return [float(prediction) for prediction in
+            np.ravel(outputs['predictions'])]
+
+  return predict_fn, predictor.session.close
+
+
+def load_predict_fn(export_dir):
+  """Loads an exported model, for the life of the process."""
+  return load_model(export_dir)[0]
+
+
+class ModelReloader(object):
+  """Serves the newest export of a model dir as soon as it appears.
+
+  Args:
+    serving_model_dir: Directory holding the export/<export_name> models.
+    export_name: Name of the served export.
+    export_dir: The export currently served.
+    batcher: The MicroBatcher the new model is loaded into.
+    close_fn: Releases the model currently served, see `load_model`.
+    cache: An optional PredictionCache, invalidated on reload.
+    poll_secs: How often the export directory is listed.
+  """
+
+  def __init__(self, serving_model_dir, export_name, export_dir, batcher,
+               close_fn, cache=None, poll_secs=30):
+    self._serving_model_dir = serving_model_dir
+    self._export_name = export_name
+    self.export_dir = export_dir
+    self._batcher = batcher
+    self._close_fn = close_fn
+    self._cache = cache
+    self._poll_secs = poll_secs
+    thread = threading.Thread(target=self._run)
+    thread.daemon = True
+    thread.start()
+
+  def _run(self):
+    while True:
+      time.sleep(self._poll_secs)
+      try:
+        export_dir = latest_export_dir(self._serving_model_dir,
+                                       self._export_name)
+        if export_dir == self.export_dir:
+          continue
+        predict_fn, close_fn = load_model(export_dir)
+      except Exception as e:  # pylint: disable=broad-except
+        tf.logging.warning('Cannot reload the model: %s', e)
+        continue
+      self._batcher.set_predict_fn(predict_fn)
+      # The batch in flight is done, so the previous session can be closed.
+      self._close_fn()
+      self._close_fn = close_fn
+      if self._cache is not None:
+        self._cache.invalidate()
+      self.export_dir = export_dir
+      tf.logging.info('Serving model from %s', export_dir)
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, server.HTTPServer):
+  daemon_threads = True
+
+
+def make_handler(encoder, batcher, stats, cache=None):
+  """Returns the request handler class bound to a batcher and its cache."""
+
+  class PredictionHandler(server.BaseHTTPRequestHandler):
+    """Serves /predict and /stats."""
+
+    def _send_json(self, status, body):
+      payload = json.dumps(body).encode('utf-8')
+      self.send_response(status)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(payload)))
+      self.end_headers()
+      self.wfile.write(payload)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+      if self.path != '/stats':
+        self._send_json(404, {'error': 'unknown path %s' % self.path})
+        return
+      report = stats.report()
+      if cache is not None:
+        report['cache'] = cache.report()
+      self._send_json(200, report)
+
+    def _predict(self, instances):
+      if cache is None:
+        pending = [batcher.submit(encoder.encode(row)) for row in instances]
+        return [future.result() for future in pending]
+      generation = cache.generation
+      keys = [encoder.cache_key(row) for row in instances]
+      predictions = [cache.get(key) for key in keys]
+      pending = [(i, batcher.submit(encoder.encode(row)))
+                 for i, row in enumerate(instances) if predictions[i] is None]
+      for i, future in pending:
+        predictions[i] = future.result()
+        cache.put(keys[i], predictions[i], generation)
+      return predictions
+
+    def do_POST(self):  # pylint: disable=invalid-name
+      if self.path != '/predict':
+        self._send_json(404, {'error': 'unknown path %s' % self.path})
+        return
+      start = time.time()
+      try:
+        length = int(self.headers.get('Content-Length', 0))
+        instances = json.loads(self.rfile.read(length))['instances']
+        predictions = self._predict(instances)
+      except (KeyError, ValueError, TypeError) as e:
+        self._send_json(400, {'error': str(e)})
+        return
+      except Exception as e:  # pylint: disable=broad-except
+        # A model failure, e.g. a tf.errors.OpError set by MicroBatcher.
+        tf.logging.error('Prediction failed: %s', e)
+        self._send_json(500, {'error': str(e)})
+        return
+      stats.record_request(time.time() - start)
+      self._send_json(200, {'predictions': predictions})
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+      pass
+
+  return PredictionHandler
+
+
+def main():
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--serving_model_dir',
+      help='Directory holding the export/bookings models of the trainer.',
+      required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--port', help='Port to listen on', default=8500, type=int)
+  parser.add_argument(
+      '--max_batch_size',
+      help='Maximum number of rows per model call',
+      default=64,
+      type=int)
+  parser.add_argument(
+      '--max_wait_ms',
+      help='Maximum time a row waits for its batch to fill',
+      default=5,
+      type=float)
+  parser.add_argument(
+      '--export_name',
+      help='Export to serve, e.g. bookings_int8 written by quantize_export.py',
+      default=EXPORT_NAME)
+  parser.add_argument(
+      '--cache_size',
+      help='Maximum number of cached predictions. Use 0 to disable the cache.',
+      default=10000,
+      type=int)
+  parser.add_argument(
+      '--cache_ttl_secs',
+      help='Time after which a cached prediction is recomputed',
+      default=300,
+      type=float)
+  parser.add_argument(
+      '--model_poll_secs',
+      help=('How often a newer export is looked for. Use 0 to keep serving '
+            'the model loaded at start.'),
+      default=30,
+      type=float)
+  args = parser.parse_args()
+
+  export_dir = latest_export_dir(args.serving_model_dir, args.export_name)
+  tf.logging.info('Serving model from %s', export_dir)
+  stats = LatencyStats()
+  predict_fn, close_fn = load_model(export_dir)
+  batcher = MicroBatcher(predict_fn, args.max_batch_size, args.max_wait_ms,
+                         stats)
+  cache = None
+  if args.cache_size > 0:
+    cache = PredictionCache(args.cache_size, args.cache_ttl_secs)
+  if args.model_poll_secs > 0:
+    ModelReloader(args.serving_model_dir, args.export_name, export_dir,
+                  batcher, close_fn, cache, args.model_poll_secs)
+  encoder = ExampleEncoder(bookings.read_schema(args.schema_file))
+  httpd = _ThreadingHTTPServer(('localhost', args.port),
+                               make_handler(encoder, batcher, stats, cache))
+  print('Serving on http://localhost:%d' % args.port)
+  httpd.serve_forever()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,11 @@
+#!/bin/bash
+set -u
+
+echo Starting local prediction server...
+
+python serve.py \
+  --serving_model_dir ../data/train/bookings_output/serving_model_dir \
+  --schema_file ../data/tfdv_output/schema.pbtxt \
+  --port 8500 \
+  --max_batch_size 64 \
+  --max_wait_ms 5
@@ -0,0 +1,166 @@
+"""Fingerprints pipeline stage inputs so unchanged stages can be skipped.
+
+A stage's fingerprint covers its input files and directories, the feature key
+lists of `trainer/bookings.py` and its parameters. After a stage succeeds the
+fingerprint is stored in its output directory (`stamp`); before running it
+again the shell scripts `check` whether the stored fingerprint still matches
+and reuse the previous artifacts if so.
+
+  python stage_cache.py check --output_dir DIR --stage NAME --inputs ... \
+      --params key=value ...
+  python stage_cache.py stamp --output_dir DIR --stage NAME --inputs ... \
+      --params key=value ...
+
+`check` exits with status 0 when the stage is up to date and 1 otherwise.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import ast
+import glob
+import hashlib
+import os
+import sys
+
+BOOKINGS_MODULE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'trainer', 'bookings.py')
+
+# Files up to this size are hashed by content, larger ones by size and mtime.
+DEFAULT_CONTENT_HASH_BYTES = 16 * 1024 * 1024
+
+
+def feature_constants(path=BOOKINGS_MODULE):
+  """Returns the literal module-level constants of bookings.py, by name.
+
+  Only upper case assignments with literal values are kept, so comments,
+  formatting and helper functions do not affect the fingerprint.
+  """
+  with open(path) as f:
+    tree = ast.parse(f.read())
+  constants = {}
+  for node in tree.body:
+    if not isinstance(node, ast.Assign) or len(node.targets) != 1:
+      continue
+    target = node.targets[0]
+    if isinstance(target, ast.Name) and target.id.isupper():
+      try:
+        constants[target.id] = ast.literal_eval(node.value)
+      except ValueError:
+        pass
+  return constants
+
+
+def _file_digest(path, content_hash_bytes):
+  stat = os.stat(path)
+  if stat.st_size > content_hash_bytes:
+    return 'size=%d,mtime=%d' % (stat.st_size, stat.st_mtime_ns)
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(1 << 20), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def _input_files(pattern):
+  """Expands a path or glob into the sorted files it covers."""
+  files = []
+  for path in sorted(glob.glob(pattern)):
+    if os.path.isdir(path):
+      for root, dirs, names in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        files.extend(os.path.join(root, name) for name in sorted(names)
+                     if not name.endswith('.pyc'))
+    else:
+      files.append(path)
+  return files
+
+
+def fingerprint(inputs, params=(),
+                content_hash_bytes=DEFAULT_CONTENT_HASH_BYTES):
+  """Returns the fingerprint of a stage.
+
+  Args:
+    inputs: Paths or glob patterns of input files and directories.
+    params: `key=value` strings of stage parameters.
+    content_hash_bytes: Files up to this size are hashed by content, larger
+      ones by size and modification time.
+
+  Returns:
+    A hex digest.
+  """
+  digest = hashlib.sha256()
+  digest.update(repr(sorted(feature_constants().items())).encode('utf-8'))
+  for param in sorted(params):
+    digest.update(('param:%s\n' % param).encode('utf-8'))
+  for pattern in inputs:
+    files = _input_files(pattern)
+    if not files:
+      digest.update(('missing:%s\n' % pattern).encode('utf-8'))
+    for path in files:
+      digest.update(('file:%s:%s\n' % (
+          os.path.relpath(path, os.path.dirname(pattern) or '.'),
+          _file_digest(path, content_hash_bytes))).encode('utf-8'))
+  return digest.hexdigest()
+
+
+def _fingerprint_file(output_dir, stage):
+  return os.path.join(output_dir, '.fingerprint-%s' % stage)
+
+
+def is_up_to_date(output_dir, stage, stage_fingerprint):
+  path = _fingerprint_file(output_dir, stage)
+  if not os.path.exists(path):
+    return False
+  with open(path) as f:
+    return f.read().strip() == stage_fingerprint
+
+
+def stamp(output_dir, stage, stage_fingerprint):
+  if not os.path.isdir(output_dir):
+    os.makedirs(output_dir)
+  with open(_fingerprint_file(output_dir, stage), 'w') as f:
+    f.write(stage_fingerprint + '\n')
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('command', choices=['check', 'stamp'])
+  parser.add_argument(
+      '--output_dir', help='Directory holding the stage output.',
+      required=True)
+  parser.add_argument(
+      '--stage', help='Name of the stage within the output directory.',
+      required=True)
+  parser.add_argument(
+      '--inputs',
+      help='Input files, directories or glob patterns of the stage.',
+      nargs='*',
+      default=[])
+  parser.add_argument(
+      '--params',
+      help='Parameters of the stage, as key=value.',
+      nargs='*',
+      default=[])
+  parser.add_argument(
+      '--content_hash_bytes',
+      help='Files up to this size are hashed by content.',
+      default=DEFAULT_CONTENT_HASH_BYTES,
+      type=int)
+  args = parser.parse_args()
+
+  stage_fingerprint = fingerprint(args.inputs, args.params,
+                                  args.content_hash_bytes)
+  if args.command == 'stamp':
+    stamp(args.output_dir, args.stage, stage_fingerprint)
+    return
+  if is_up_to_date(args.output_dir, args.stage, stage_fingerprint):
+    print('Stage %s is up to date in %s, reusing it.' % (args.stage,
+                                                         args.output_dir))
+    return
+  sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,268 @@
+"""Merges per-partition TFDV statistics into cumulative statistics.
+
+Counts, value counts, min/max, mean, standard deviation and zero counts are
+merged exactly. The rest is approximated from what the partition statistics
+keep:
+
+  * histograms are re-bucketed assuming values spread uniformly within each
+    source bucket, and the median is read from the merged quantiles;
+  * top values are the top values of the partitions with their frequencies
+    summed, so a value that was outside the top k of some partitions is
+    under-counted;
+  * the number of unique values is the largest partition count, a lower bound.
+
+  python stats_merge.py --inputs stats/2019-*.tfrecord --output stats.tfrecord
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import collections
+
+import numpy as np
+import tensorflow as tf
+
+from tensorflow_metadata.proto.v0 import statistics_pb2
+
+
+def _bucket_counts(histograms, boundaries):
+  """Spreads histogram buckets over new boundaries, uniformly per bucket."""
+  counts = np.zeros(len(boundaries) - 1)
+  for histogram in histograms:
+    for bucket in histogram.buckets:
+      if bucket.sample_count == 0:
+        continue
+      if bucket.high_value <= bucket.low_value:
+        i = np.clip(np.searchsorted(boundaries, bucket.low_value, 'right') - 1,
+                    0, len(counts) - 1)
+        counts[i] += bucket.sample_count
+        continue
+      lows = np.maximum(boundaries[:-1], bucket.low_value)
+      highs = np.minimum(boundaries[1:], bucket.high_value)
+      overlap = np.maximum(highs - lows, 0) / (
+          bucket.high_value - bucket.low_value)
+      counts += overlap * bucket.sample_count
+  return counts
+
+
+def _cumulative(histograms, points):
+  """Returns the number of values below each point, uniform per bucket."""
+  below = np.zeros(len(points))
+  for histogram in histograms:
+    for bucket in histogram.buckets:
+      width = bucket.high_value - bucket.low_value
+      if width > 0:
+        fraction = np.clip((points - bucket.low_value) / width, 0, 1)
+      else:
+        fraction = (points >= bucket.low_value).astype(float)
+      below += fraction * bucket.sample_count
+  return below
+
+
+def merge_histograms(histograms, histogram_type):
+  """Merges histograms of one type into a histogram with as many buckets."""
+  histograms = [h for h in histograms if h.buckets]
+  merged = statistics_pb2.Histogram(type=histogram_type)
+  if not histograms:
+    return merged
+  num_buckets = max(len(h.buckets) for h in histograms)
+  low = min(h.buckets[0].low_value for h in histograms)
+  high = max(h.buckets[-1].high_value for h in histograms)
+  total = sum(b.sample_count for h in histograms for b in h.buckets)
+  if histogram_type == statistics_pb2.Histogram.QUANTILES:
+    # Invert the merged cumulative distribution at equally spaced ranks.
+    points = np.unique(
+        [b.low_value for h in histograms for b in h.buckets] +
+        [b.high_value for h in histograms for b in h.buckets])
+    below = _cumulative(histograms, points)
+    ranks = np.linspace(0, total, num_buckets + 1)
+    boundaries = np.interp(ranks, below, points)
+    counts = np.full(num_buckets, total / num_buckets)
+  else:
+    boundaries = np.linspace(low, high, num_buckets + 1)
+    counts = _bucket_counts(histograms, boundaries)
+  for i in range(num_buckets):
+    merged.buckets.add(
+        low_value=boundaries[i],
+        high_value=boundaries[i + 1],
+        sample_count=counts[i])
+  merged.num_nan = sum(h.num_nan for h in histograms)
+  merged.num_undefined = sum(h.num_undefined for h in histograms)
+  return merged
+
+
+def _merge_histogram_lists(histogram_lists):
+  by_type = collections.OrderedDict()
+  for histograms in histogram_lists:
+    for histogram in histograms:
+      by_type.setdefault(histogram.type, []).append(histogram)
+  return [
+      merge_histograms(histograms, histogram_type)
+      for histogram_type, histograms in by_type.items()
+  ]
+
+
+def _merge_common_stats(stats_list):
+  merged = statistics_pb2.CommonStatistics()
+  present = [s for s in stats_list if s.num_non_missing]
+  merged.num_non_missing = sum(s.num_non_missing for s in stats_list)
+  merged.num_missing = sum(s.num_missing for s in stats_list)
+  merged.tot_num_values = sum(s.tot_num_values for s in stats_list)
+  if present:
+    merged.min_num_values = min(s.min_num_values for s in present)
+    merged.max_num_values = max(s.max_num_values for s in present)
+    merged.avg_num_values = merged.tot_num_values / merged.num_non_missing
+    merged.num_values_histogram.CopyFrom(
+        merge_histograms([s.num_values_histogram for s in present],
+                         statistics_pb2.Histogram.QUANTILES))
+  return merged
+
+
+def _median(histograms):
+  for histogram in histograms:
+    if histogram.type == statistics_pb2.Histogram.QUANTILES and (
+        histogram.buckets):
+      boundaries = [histogram.buckets[0].low_value] + [
+          b.high_value for b in histogram.buckets]
+      return float(np.interp(0.5, np.linspace(0, 1, len(boundaries)),
+                             boundaries))
+  return None
+
+
+def _merge_num_stats(stats_list, common):
+  merged = statistics_pb2.NumericStatistics()
+  merged.common_stats.CopyFrom(common)
+  present = [s for s in stats_list if s.common_stats.tot_num_values]
+  if not present:
+    return merged
+  counts = np.array([s.common_stats.tot_num_values for s in present], float)
+  means = np.array([s.mean for s in present])
+  variances = np.array([s.std_dev**2 for s in present])
+  mean = float(np.sum(counts * means) / counts.sum())
+  variance = np.sum(counts * (variances + (means - mean)**2)) / counts.sum()
+  merged.mean = mean
+  merged.std_dev = float(np.sqrt(variance))
+  merged.num_zeros = sum(s.num_zeros for s in stats_list)
+  merged.min = min(s.min for s in present)
+  merged.max = max(s.max for s in present)
+  merged.histograms.extend(
+      _merge_histogram_lists([s.histograms for s in present]))
+  median = _median(merged.histograms)
+  if median is not None:
+    merged.median = median
+  return merged
+
+
+def _merge_string_stats(stats_list, common):
+  merged = statistics_pb2.StringStatistics()
+  merged.common_stats.CopyFrom(common)
+  present = [s for s in stats_list if s.common_stats.tot_num_values]
+  if not present:
+    return merged
+  merged.unique = max(s.unique for s in present)
+  counts = np.array([s.common_stats.tot_num_values for s in present], float)
+  merged.avg_length = float(
+      np.sum(counts * [s.avg_length for s in present]) / counts.sum())
+  frequencies = collections.Counter()
+  for stats in present:
+    for top_value in stats.top_values:
+      frequencies[top_value.value] += top_value.frequency
+  top_k = max(len(s.top_values) for s in present)
+  for value, frequency in frequencies.most_common(top_k):
+    merged.top_values.add(value=value, frequency=frequency)
+  num_ranks = max(len(s.rank_histogram.buckets) for s in present)
+  for rank, (value, frequency) in enumerate(
+      frequencies.most_common(num_ranks)):
+    merged.rank_histogram.buckets.add(
+        low_rank=rank, high_rank=rank, label=value, sample_count=frequency)
+  return merged
+
+
+def _merge_bytes_stats(stats_list, common):
+  merged = statistics_pb2.BytesStatistics()
+  merged.common_stats.CopyFrom(common)
+  present = [s for s in stats_list if s.common_stats.tot_num_values]
+  if not present:
+    return merged
+  counts = np.array([s.common_stats.tot_num_values for s in present], float)
+  merged.unique = max(s.unique for s in present)
+  merged.avg_num_bytes = float(
+      np.sum(counts * [s.avg_num_bytes for s in present]) / counts.sum())
+  merged.min_num_bytes = min(s.min_num_bytes for s in present)
+  merged.max_num_bytes = max(s.max_num_bytes for s in present)
+  return merged
+
+
+def _merge_feature(features):
+  merged = statistics_pb2.FeatureNameStatistics(
+      name=features[0].name, type=features[0].type)
+  for kind, merge_fn in (('num_stats', _merge_num_stats),
+                         ('string_stats', _merge_string_stats),
+                         ('bytes_stats', _merge_bytes_stats)):
+    stats_list = [
+        getattr(f, kind) for f in features if f.WhichOneof('stats') == kind
+    ]
+    if stats_list:
+      common = _merge_common_stats([s.common_stats for s in stats_list])
+      getattr(merged, kind).CopyFrom(merge_fn(stats_list, common))
+      break
+  return merged
+
+
+def merge_stats(stats_lists):
+  """Merges the statistics of disjoint partitions of a dataset.
+
+  Args:
+    stats_lists: DatasetFeatureStatisticsList protos, each holding the
+      statistics of one partition in its first dataset.
+
+  Returns:
+    A DatasetFeatureStatisticsList with the statistics of the union of the
+    partitions.
+  """
+  datasets = [stats.datasets[0] for stats in stats_lists if stats.datasets]
+  merged = statistics_pb2.DatasetFeatureStatistics(
+      num_examples=sum(d.num_examples for d in datasets))
+  features = collections.OrderedDict()
+  for dataset in datasets:
+    for feature in dataset.features:
+      features.setdefault(feature.name, []).append(feature)
+  for feature_list in features.values():
+    merged.features.add().CopyFrom(_merge_feature(feature_list))
+  return statistics_pb2.DatasetFeatureStatisticsList(datasets=[merged])
+
+
+def write_stats(stats, path):
+  """Writes statistics to a TFRecord file, as `tfdv.load_statistics` reads."""
+  with tf.python_io.TFRecordWriter(path) as writer:
+    writer.write(stats.SerializeToString())
+
+
+def merge_stats_files(input_paths, output_path):
+  """Merges the statistics files of partitions into `output_path`."""
+  import tensorflow_data_validation as tfdv  # pylint: disable=g-import-not-at-top
+  write_stats(
+      merge_stats([tfdv.load_statistics(path) for path in input_paths]),
+      output_path)
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--inputs',
+      help='Statistics files or glob patterns of the partitions to merge.',
+      nargs='+',
+      required=True)
+  parser.add_argument(
+      '--output', help='Path of the merged statistics.', required=True)
+  args = parser.parse_args()
+
+  input_paths = sorted(
+      path for pattern in args.inputs for path in tf.gfile.Glob(pattern))
+  merge_stats_files(input_paths, args.output)
+  print('Merged %d partitions into %s' % (len(input_paths), args.output))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,351 @@
+"""Applies a stored transform_fn to booking CSV files as they land.
+
+`preprocess.py --transform_dir` applies a transform_fn in a one-shot batch
+pipeline. This script instead watches `--input_dir` and transforms every new
+CSV file (with a header line, like the preprocess.py input) as soon as it is
+complete, with the transform_fn loaded once into a long-lived TensorFlow
+session:
+
+  python stream_preprocess.py --input_dir ../data/incoming \
+      --schema_file ../data/tfdv_output/schema.pbtxt \
+      --transform_dir ../data/train/bookings_output \
+      --output_dir ../data/stream/bookings_output
+
+Each input file becomes one shard `<outfile_prefix>-<n>-<file name><suffix>`.
+Shards are written to `<output_dir>/_tmp` and renamed into place, so a reader
+globbing `<outfile_prefix>-*` only ever sees complete shards. The files already
+transformed are recorded in `<outfile_prefix>.stream_state.json`, so a
+restarted watcher picks up where it left off.
+
+The latency of a file runs from its arrival (its modification time) to the
+rename of its shard. The p50/p99/max latency is logged after each file and
+written to `--metrics_file` on exit.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+import tensorflow_transform as tft
+
+from tensorflow_transform.coders import example_proto_coder
+
+import batched_csv
+import pipeline_metrics
+from trainer import bookings
+
+STATE_SUFFIX = '.stream_state.json'
+
+_TMP_DIR = '_tmp'
+
+
+class StreamTransformer(object):
+  """Transforms blocks of CSV lines with a transform_fn loaded once.
+
+  Args:
+    transform_dir: Directory in which the transform output of preprocess.py is
+      located.
+    schema: The schema of the input data.
+  """
+
+  def __init__(self, transform_dir, schema):
+    self._raw_feature_spec = bookings.get_raw_feature_spec(schema)
+    tf_transform_output = tft.TFTransformOutput(transform_dir)
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      self._inputs = {}
+      for key, spec in self._raw_feature_spec.items():
+        if isinstance(spec, tf.VarLenFeature):
+          self._inputs[key] = tf.sparse_placeholder(
+              spec.dtype, shape=[None, None], name=key)
+        else:
+          self._inputs[key] = tf.placeholder(
+              spec.dtype, shape=[None] + list(spec.shape), name=key)
+      transformed = tf_transform_output.transform_raw_features(self._inputs)
+      self._outputs = {
+          key: transformed[key]
+          for key in tf_transform_output.transformed_feature_spec()
+      }
+      table_initializer = tf.tables_initializer()
+    self._session = tf.Session(graph=self._graph)
+    self._session.run(table_initializer)
+    self._coder = example_proto_coder.ExampleProtoCoder(
+        tf_transform_output.transformed_metadata.schema)
+
+  def _feed_dict(self, columns, num_rows):
+    """Feeds columns of `batched_csv.decode_csv_block` to the raw inputs."""
+    feed_dict = {}
+    for key, tensor in self._inputs.items():
+      values, present = columns[key]
+      spec = self._raw_feature_spec[key]
+      if isinstance(spec, tf.VarLenFeature):
+        rows = np.flatnonzero(present)
+        feed_dict[tensor] = tf.SparseTensorValue(
+            indices=np.stack([rows, np.zeros_like(rows)], axis=1),
+            values=values[present],
+            dense_shape=[num_rows, 1])
+      elif present.all() or spec.default_value is not None:
+        feed_dict[tensor] = np.where(present, values, spec.default_value)
+      else:
+        raise ValueError('expected a value on column "%s"' % key)
+    return feed_dict
+
+  def run(self, lines):
+    """Returns the transformed features of CSV lines, as NumPy columns."""
+    columns = batched_csv.decode_csv_block(lines, bookings.CSV_COLUMN_NAMES,
+                                           self._raw_feature_spec)
+    return self._session.run(
+        self._outputs, feed_dict=self._feed_dict(columns, len(lines)))
+
+  def transform(self, lines):
+    """Returns the serialized transformed tf.Examples of CSV lines."""
+    if not lines:
+      return []
+    outputs = self.run(lines)
+    return [
+        self._coder.encode({key: value[i] for key, value in outputs.items()})
+        for i in range(len(lines))
+    ]
+
+  def close(self):
+    self._session.close()
+
+
+def record_options(compression):
+  """Returns the TFRecordOptions of a `bookings.COMPRESSION_SUFFIXES` codec."""
+  return tf.python_io.TFRecordOptions(
+      compression_type=getattr(tf.python_io.TFRecordCompressionType,
+                               compression))
+
+
+def transform_file(transformer, input_path, output_path, compression,
+                   batch_size=batched_csv.DEFAULT_BATCH_SIZE):
+  """Transforms a CSV file into a shard, renamed into place once complete.
+
+  Args:
+    transformer: A `StreamTransformer`.
+    input_path: The CSV file, with a header line.
+    output_path: Path of the transformed example shard.
+    compression: Codec of the shard, one of `bookings.COMPRESSION_SUFFIXES`.
+    batch_size: Number of CSV lines transformed at once.
+
+  Returns:
+    The number of rows transformed.
+  """
+  tmp_path = os.path.join(
+      os.path.dirname(output_path), _TMP_DIR, os.path.basename(output_path))
+  tf.gfile.MakeDirs(os.path.dirname(tmp_path))
+  num_rows = 0
+  with tf.gfile.GFile(input_path) as f, tf.python_io.TFRecordWriter(
+      tmp_path, record_options(compression)) as writer:
+    next(f, None)  # Skip the header line.
+    lines = []
+    for line in f:
+      line = line.rstrip('\r\n')
+      if line:
+        lines.append(line)
+      if len(lines) == batch_size:
+        for example in transformer.transform(lines):
+          writer.write(example)
+        num_rows += len(lines)
+        lines = []
+    for example in transformer.transform(lines):
+      writer.write(example)
+    num_rows += len(lines)
+  tf.gfile.Rename(tmp_path, output_path, overwrite=True)
+  return num_rows
+
+
+def _read_state(state_path):
+  if not tf.gfile.Exists(state_path):
+    return {'processed': {}, 'num_shards': 0}
+  with tf.gfile.GFile(state_path) as f:
+    return json.load(f)
+
+
+def _write_state(state_path, state):
+  tmp_path = state_path + '.tmp'
+  with tf.gfile.GFile(tmp_path, 'w') as f:
+    json.dump(state, f, indent=2, sort_keys=True)
+  tf.gfile.Rename(tmp_path, state_path, overwrite=True)
+
+
+def _arrival_time(path):
+  return tf.gfile.Stat(path).mtime_nsec / 1e9
+
+
+def pending_files(input_dir, processed, settle_secs):
+  """Returns the new CSV files of `input_dir`, oldest first.
+
+  Files whose name starts with '.' or '_' are being written by convention, and
+  files modified in the last `settle_secs` may still be growing, so both are
+  left for a later poll.
+  """
+  now = time.time()
+  files = []
+  for name in tf.gfile.ListDirectory(input_dir):
+    path = os.path.join(input_dir, name)
+    if (name in processed or name.startswith(('.', '_')) or
+        tf.gfile.IsDirectory(path)):
+      continue
+    arrival = _arrival_time(path)
+    if now - arrival >= settle_secs:
+      files.append((arrival, name))
+  return [name for _, name in sorted(files)]
+
+
+def _latency_report(latencies):
+  return {
+      'files': len(latencies),
+      'p50_secs': float(np.percentile(latencies, 50)),
+      'p99_secs': float(np.percentile(latencies, 99)),
+      'max_secs': float(np.max(latencies)),
+  }
+
+
+def watch(input_dir,
+          schema_file,
+          transform_dir,
+          output_dir,
+          outfile_prefix,
+          compression='GZIP',
+          batch_size=batched_csv.DEFAULT_BATCH_SIZE,
+          poll_secs=5,
+          settle_secs=2,
+          once=False):
+  """Transforms the files landing in `input_dir` until interrupted.
+
+  Args:
+    input_dir: Directory in which CSV files land.
+    schema_file: An file path that contains a text-serialized TensorFlow
+      metadata schema of the input data.
+    transform_dir: Directory in which the transform output is located.
+    output_dir: Directory in which transformed example shards are written.
+    outfile_prefix: Filename prefix of the shards.
+    compression: Codec of the shards, one of `bookings.COMPRESSION_SUFFIXES`.
+    batch_size: Number of CSV lines transformed at once.
+    poll_secs: How often `input_dir` is listed.
+    settle_secs: How long a file must be left unmodified before it is read.
+    once: If True, return once the files present at start are transformed.
+
+  Returns:
+    The end-to-end latency report of the files transformed, or None if there
+    were none.
+  """
+  tf.gfile.MakeDirs(output_dir)
+  output_prefix = os.path.join(output_dir, outfile_prefix)
+  state_path = output_prefix + STATE_SUFFIX
+  state = _read_state(state_path)
+  transformer = StreamTransformer(transform_dir,
+                                  bookings.read_schema(schema_file))
+  latencies = []
+  try:
+    while True:
+      names = pending_files(input_dir, state['processed'], settle_secs)
+      for name in names:
+        input_path = os.path.join(input_dir, name)
+        arrival = _arrival_time(input_path)
+        output_path = '%s-%05d-%s%s' % (
+            output_prefix, state['num_shards'], os.path.splitext(name)[0],
+            bookings.COMPRESSION_SUFFIXES[compression])
+        start = time.time()
+        num_rows = transform_file(transformer, input_path, output_path,
+                                  compression, batch_size)
+        latencies.append(time.time() - arrival)
+        state['processed'][name] = os.path.basename(output_path)
+        state['num_shards'] += 1
+        _write_state(state_path, state)
+        bookings.write_output_metadata(output_prefix, {
+            'format': 'tfrecord',
+            'compression': compression,
+            'num_shards': state['num_shards'],
+            'file_pattern': outfile_prefix + '-*',
+        })
+        tf.logging.info(
+            'Transformed %s: %d rows in %.2fs, %.2fs after arrival (%s)',
+            name, num_rows, time.time() - start, latencies[-1],
+            json.dumps(_latency_report(latencies), sort_keys=True))
+      if once:
+        break
+      if not names:
+        time.sleep(poll_secs)
+  except KeyboardInterrupt:
+    pass
+  finally:
+    transformer.close()
+  return _latency_report(latencies) if latencies else None
+
+
+def main():
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--input_dir', help='Directory in which CSV files land.', required=True)
+  parser.add_argument(
+      '--schema_file', help='File holding the schema for the input data',
+      required=True)
+  parser.add_argument(
+      '--transform_dir',
+      help='Directory in which the transform output is located',
+      required=True)
+  parser.add_argument(
+      '--output_dir',
+      help='Directory in which transformed example shards are written.',
+      required=True)
+  parser.add_argument(
+      '--outfile_prefix',
+      help='Filename prefix for emitted transformed examples',
+      default='stream_transformed')
+  parser.add_argument(
+      '--compression',
+      help='Codec of the transformed example shards.',
+      choices=sorted(bookings.COMPRESSION_SUFFIXES),
+      default='GZIP',
+      type=str.upper)
+  parser.add_argument(
+      '--batch_size',
+      help='Number of CSV lines transformed at once',
+      default=batched_csv.DEFAULT_BATCH_SIZE,
+      type=int)
+  parser.add_argument(
+      '--poll_secs', help='How often the input directory is listed',
+      default=5, type=float)
+  parser.add_argument(
+      '--settle_secs',
+      help='How long a file must be left unmodified before it is read',
+      default=2, type=float)
+  parser.add_argument(
+      '--once',
+      help='Exit once the files present at start are transformed.',
+      action='store_true')
+  parser.add_argument(
+      '--metrics_file',
+      help='If set, the latency report is written to this JSON file on exit.',
+      default=None)
+  args = parser.parse_args()
+
+  report = watch(
+      input_dir=args.input_dir,
+      schema_file=args.schema_file,
+      transform_dir=args.transform_dir,
+      output_dir=args.output_dir,
+      outfile_prefix=args.outfile_prefix,
+      compression=args.compression,
+      batch_size=args.batch_size,
+      poll_secs=args.poll_secs,
+      settle_secs=args.settle_secs,
+      once=args.once)
+  print('Latency from arrival to shard: %s' % json.dumps(report))
+  if args.metrics_file and report:
+    pipeline_metrics.write_metrics(args.metrics_file, report)
+
+
+if __name__ == '__main__':
+  main()
@@ -4,18 +4,11 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import os
+import time
 
-import apache_beam as beam
-import numpy as np
-import tensorflow as tf
-import tensorflow_data_validation as tfdv
-
-from tensorflow_data_validation.coders import csv_decoder
-from apache_beam.options.pipeline_options import PipelineOptions
-
-from google.protobuf import text_format
-from tensorflow.python.lib.io import file_io  # pylint: disable=g-direct-tensorflow-import
-from tensorflow_metadata.proto.v0 import statistics_pb2
+# Beam, TensorFlow and TFDV take seconds to import, so each is imported by the
+# functions that use it, once the flags are parsed.
 
 
 def infer_schema(stats_path, schema_path):
@@ -25,6 +18,9 @@ def infer_schema(stats_path, schema_path):
     stats_path: Location of the stats used to infer the schema.
     schema_path: Location where the inferred schema is materialized.
   """
+  import tensorflow_data_validation as tfdv  # pylint: disable=g-import-not-at-top
+  from google.protobuf import text_format  # pylint: disable=g-import-not-at-top
+
   print('Infering schema from statistics.')
   schema = tfdv.infer_schema(
       tfdv.load_statistics(stats_path), infer_feature_shape=False)
@@ -43,6 +39,10 @@ def validate_stats(stats_path, schema_path, anomalies_path):
     schema_path: Location of the schema to be used for validation.
     anomalies_path: Location where the detected anomalies are materialized.
   """
+  import tensorflow_data_validation as tfdv  # pylint: disable=g-import-not-at-top
+  from google.protobuf import text_format  # pylint: disable=g-import-not-at-top
+  from tensorflow.python.lib.io import file_io  # pylint: disable=g-direct-tensorflow-import,g-import-not-at-top
+
   print('Validating schema against the computed statistics.')
   schema = tfdv.load_schema_text(schema_path)
   stats = tfdv.load_statistics(stats_path)
@@ -58,24 +58,80 @@ def validate_stats(stats_path, schema_path, anomalies_path):
 
 def compute_stats(input_handle,
                   stats_path,
+                  input_cache=None,
+                  sample_rate=None,
+                  sample_count=None,
                   pipeline_args=None):
   """Computes statistics on the input data.
 
   Args:
     input_handle: Path to csv file with input data.
     stats_path: Directory in which stats are materialized.
+    input_cache: Directory of a columnar cache built by `columnar_cache.py`.
+      If provided, it is read instead of parsing `input_handle`.
+    sample_rate: If set, statistics are computed on this fraction of the
+      examples, sampled independently.
+    sample_count: If set, statistics are computed on a reservoir sample of
+      this many examples.
   """
+  import apache_beam as beam  # pylint: disable=g-import-not-at-top
+  import tensorflow_data_validation as tfdv  # pylint: disable=g-import-not-at-top
+  from apache_beam.options.pipeline_options import PipelineOptions  # pylint: disable=g-import-not-at-top
+  from tensorflow_metadata.proto.v0 import statistics_pb2  # pylint: disable=g-import-not-at-top
+  import columnar_cache  # pylint: disable=g-import-not-at-top
+
+  stats_options = tfdv.StatsOptions(
+      sample_rate=sample_rate, sample_count=sample_count)
+  if input_cache:
+    with beam.Pipeline(options=PipelineOptions(flags=pipeline_args)) as p:
+      _ = (
+          p
+          | 'ReadFromCache' >> columnar_cache.ReadColumnarCacheExamples(
+              input_cache)
+          | 'GenerateStatistics' >> tfdv.GenerateStatistics(stats_options)
+          | 'WriteStatsOutput' >> beam.io.WriteToTFRecord(
+              stats_path,
+              shard_name_template='',
+              coder=beam.coders.ProtoCoder(
+                  statistics_pb2.DatasetFeatureStatisticsList)))
+    return
 
   train_stats = tfdv.generate_statistics_from_csv(input_handle, 
     delimiter=',',
     output_path=stats_path,
+    stats_options=stats_options,
     pipeline_options= PipelineOptions(flags=pipeline_args))
-  
 
 
-def main():
-  tf.logging.set_verbosity(tf.logging.INFO)
+def compute_partition_stats(input_handle,
+                            partition_stats_dir,
+                            partition,
+                            stats_path,
+                            **kwargs):
+  """Computes the stats of a new partition and merges them with the others.
 
+  Args:
+    input_handle: Path to csv file with the data of the partition.
+    partition_stats_dir: Directory holding one `<partition>.tfrecord` stats
+      file per partition computed so far.
+    partition: Name of the new partition, e.g. its date.
+    stats_path: Path of the cumulative stats of all partitions.
+    **kwargs: Other arguments of `compute_stats`.
+  """
+  import tensorflow as tf  # pylint: disable=g-import-not-at-top
+  import stats_merge  # pylint: disable=g-import-not-at-top
+
+  tf.gfile.MakeDirs(partition_stats_dir)
+  compute_stats(
+      input_handle,
+      os.path.join(partition_stats_dir, partition + '.tfrecord'),
+      **kwargs)
+  stats_merge.merge_stats_files(
+      sorted(tf.gfile.Glob(os.path.join(partition_stats_dir, '*.tfrecord'))),
+      stats_path)
+
+
+def main():
   parser = argparse.ArgumentParser()
   parser.add_argument(
       '--input',
@@ -124,23 +180,89 @@ def main():
       default=None,
       type=str)
 
+  parser.add_argument(
+      '--input_cache',
+      help=('Directory of a columnar cache built by columnar_cache.py, read '
+            'instead of --input.'),
+      default=None,
+      type=str)
+
+  parser.add_argument(
+      '--metrics_file',
+      help='If set, the wall time of each step is written to this JSON file.',
+      default=None,
+      type=str)
+
+  parser.add_argument(
+      '--sample_rate',
+      help='If set, stats are computed on this fraction of the examples.',
+      default=None,
+      type=float)
+
+  parser.add_argument(
+      '--sample_count',
+      help='If set, stats are computed on a reservoir of this many examples.',
+      default=None,
+      type=int)
+
+  parser.add_argument(
+      '--partition_stats_dir',
+      help=('If set, the stats of --input are stored in this directory as '
+            'those of --partition, and --stats_path holds the stats of all '
+            'the partitions stored there.'),
+      default=None,
+      type=str)
+
+  parser.add_argument(
+      '--partition',
+      help='Name of the partition held by --input, e.g. its date.',
+      default=None,
+      type=str)
+
   known_args, pipeline_args = parser.parse_known_args()
+  if known_args.partition_stats_dir and not known_args.partition:
+    parser.error('--partition_stats_dir requires --partition')
 
-  compute_stats(
+  import tensorflow as tf  # pylint: disable=g-import-not-at-top
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  wall_secs = {}
+  start = time.time()
+  stats_args = dict(
       input_handle=known_args.input,
-      stats_path=known_args.stats_path,
-      pipeline_args= pipeline_args)
+      input_cache=known_args.input_cache,
+      sample_rate=known_args.sample_rate,
+      sample_count=known_args.sample_count,
+      pipeline_args=pipeline_args)
+  if known_args.partition_stats_dir:
+    compute_partition_stats(
+        partition_stats_dir=known_args.partition_stats_dir,
+        partition=known_args.partition,
+        stats_path=known_args.stats_path,
+        **stats_args)
+  else:
+    compute_stats(stats_path=known_args.stats_path, **stats_args)
+  wall_secs['compute_stats'] = time.time() - start
   print(f'Stats computation done. Stats are stored in {known_args.stats_path}')
 
   if known_args.infer_schema:
+    start = time.time()
     infer_schema(
         stats_path=known_args.stats_path, schema_path=known_args.schema_path)
+    wall_secs['infer_schema'] = time.time() - start
 
   if known_args.validate_stats:
+    start = time.time()
     validate_stats(
         stats_path=known_args.stats_path,
         schema_path=known_args.schema_path,
         anomalies_path=known_args.anomalies_path)
+    wall_secs['validate_stats'] = time.time() - start
+
+  if known_args.metrics_file:
+    import pipeline_metrics  # pylint: disable=g-import-not-at-top
+    pipeline_metrics.write_metrics(known_args.metrics_file,
+                                   {'wall_secs': wall_secs})
 
 if __name__ == '__main__':
   main()
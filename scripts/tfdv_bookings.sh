@@ -7,23 +7,49 @@ export SCHEMA_PATH=$OUTPUT_DIR/schema.pbtxt
 
 echo Starting local TFDV preprocessing...
 
+# Decode each CSV once into a columnar cache, read by this script and by
+# preprocess.sh. Up-to-date caches are reused.
+TRAIN_CACHE=$DATA_DIR/train/columnar
+EVAL_CACHE=$DATA_DIR/eval/columnar
+python columnar_cache.py --input $DATA_DIR/train/train.csv \
+  --cache_dir $TRAIN_CACHE || exit 1
+python columnar_cache.py --input $DATA_DIR/eval/eval.csv \
+  --cache_dir $EVAL_CACHE || exit 1
+
 # Compute stats on the train file and generate a schema based on the stats.
-rm -R -f $OUTPUT_DIR
-mkdir $OUTPUT_DIR
+TRAIN_INPUTS="$DATA_DIR/train/train.csv tfdv_bookings.py columnar_cache.py"
+if python stage_cache.py check --output_dir $OUTPUT_DIR --stage train_stats \
+    --inputs $TRAIN_INPUTS; then
+  echo Reusing train stats and schema.
+else
+  rm -R -f $OUTPUT_DIR
+  mkdir $OUTPUT_DIR
 
-python tfdv_bookings.py \
-  --input $DATA_DIR/train/train.csv \
-  --stats_path $OUTPUT_DIR/train_stats.tfrecord \
-  --infer_schema \
-  --schema_path $SCHEMA_PATH \
-  --runner DirectRunner
+  python tfdv_bookings.py \
+    --input $DATA_DIR/train/train.csv \
+    --input_cache $TRAIN_CACHE \
+    --stats_path $OUTPUT_DIR/train_stats.tfrecord \
+    --infer_schema \
+    --schema_path $SCHEMA_PATH \
+    --runner DirectRunner && \
+  python stage_cache.py stamp --output_dir $OUTPUT_DIR --stage train_stats \
+    --inputs $TRAIN_INPUTS
+fi
 
 # Compute stats on the eval file and validate against the training schema.
-python tfdv_bookings.py \
-  --input $DATA_DIR/eval/eval.csv \
-  --stats_path $OUTPUT_DIR/eval_stats.tfrecord \
-  --schema_path $SCHEMA_PATH \
-  --anomalies_path $OUTPUT_DIR/anomalies.pbtxt \
-  --validate_stats \
-  --runner DirectRunner
-  
+EVAL_INPUTS="$DATA_DIR/eval/eval.csv $SCHEMA_PATH tfdv_bookings.py columnar_cache.py"
+if python stage_cache.py check --output_dir $OUTPUT_DIR --stage eval_stats \
+    --inputs $EVAL_INPUTS; then
+  echo Reusing eval stats and anomalies.
+else
+  python tfdv_bookings.py \
+    --input $DATA_DIR/eval/eval.csv \
+    --input_cache $EVAL_CACHE \
+    --stats_path $OUTPUT_DIR/eval_stats.tfrecord \
+    --schema_path $SCHEMA_PATH \
+    --anomalies_path $OUTPUT_DIR/anomalies.pbtxt \
+    --validate_stats \
+    --runner DirectRunner && \
+  python stage_cache.py stamp --output_dir $OUTPUT_DIR --stage eval_stats \
+    --inputs $EVAL_INPUTS
+fi
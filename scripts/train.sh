@@ -10,11 +10,28 @@ WORKING_DIR=../data/train/bookings_output
 # Output: dir for both the serving model and eval_model which will go into tfma
 # evaluation
 OUTPUT_DIR=$WORKING_DIR
-rm -R -f $OUTPUT_DIR/serving_model_dir
-rm -R -f $OUTPUT_DIR/eval_model_dir
 
 # Output: dir for trained model
 MODEL_DIR=$WORKING_DIR/trainer_output
+
+TRAIN_STEPS=10000
+EVAL_STEPS=5000
+# Intermediate evals run on an in-memory subset, the full EVAL_STEPS once at the end
+EVAL_SUBSET_STEPS=200
+EVAL_THROTTLE_SECS=60
+EARLY_STOPPING_STEPS=3000
+SCHEMA_FILE=../data/tfdv_output/schema.pbtxt
+
+TRAIN_INPUTS="$WORKING_DIR/train_transformed-* ../data/eval/bookings_output/eval_transformed-* $WORKING_DIR/transform_fn $WORKING_DIR/transformed_metadata $SCHEMA_FILE trainer"
+TRAIN_PARAMS="train_steps=$TRAIN_STEPS eval_steps=$EVAL_STEPS eval_subset_steps=$EVAL_SUBSET_STEPS eval_throttle_secs=$EVAL_THROTTLE_SECS early_stopping_steps=$EARLY_STOPPING_STEPS"
+if python stage_cache.py check --output_dir $OUTPUT_DIR --stage train \
+    --inputs $TRAIN_INPUTS --params $TRAIN_PARAMS; then
+  echo Reusing trained model.
+  exit 0
+fi
+
+rm -R -f $OUTPUT_DIR/serving_model_dir
+rm -R -f $OUTPUT_DIR/eval_model_dir
 rm -R -f $MODEL_DIR
 
 echo Working directory: $WORKING_DIR
@@ -27,9 +44,14 @@ python trainer/task.py \
     --train-files ../data/train/bookings_output/train_transformed-* \
     --verbosity INFO \
     --job-dir $MODEL_DIR \
-    --train-steps 10000 \
-    --eval-steps 5000 \
+    --train-steps $TRAIN_STEPS \
+    --eval-steps $EVAL_STEPS \
+    --eval-subset-steps $EVAL_SUBSET_STEPS \
+    --eval-throttle-secs $EVAL_THROTTLE_SECS \
+    --early-stopping-steps $EARLY_STOPPING_STEPS \
     --tf-transform-dir $WORKING_DIR \
     --output-dir $OUTPUT_DIR \
-    --schema-file ../data/tfdv_output/schema.pbtxt \
-    --eval-files ../data/eval/bookings_output/eval_transformed-*
+    --schema-file $SCHEMA_FILE \
+    --eval-files ../data/eval/bookings_output/eval_transformed-* && \
+python stage_cache.py stamp --output_dir $OUTPUT_DIR --stage train \
+    --inputs $TRAIN_INPUTS --params $TRAIN_PARAMS
@@ -0,0 +1,95 @@
+"""Compares size on disk and read throughput of transformed example codecs.
+
+The transformed examples are rewritten once per format and codec, with the
+same number of shards and the metadata preprocess.py records, and each copy is
+read back through `model.dataset_input_fn`. The 'packed' format holds the
+fixed-width records of `bookings.packed_layout`, which are decoded a batch at
+a time instead of being parsed as tf.Examples.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import time
+
+import tensorflow as tf
+import tensorflow_transform as tft
+
+import benchmark_input
+import bookings
+import model
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--train-files',
+      help='GCS or local paths to transformed training data',
+      nargs='+',
+      required=True)
+  parser.add_argument(
+      '--tf-transform-dir',
+      help='Tf-transform directory with model from preprocessing step',
+      required=True)
+  parser.add_argument(
+      '--work-dir',
+      help='Directory in which the shards are rewritten per codec',
+      required=True)
+  parser.add_argument(
+      '--codecs',
+      help='Codecs to benchmark',
+      nargs='+',
+      choices=sorted(bookings.COMPRESSION_SUFFIXES),
+      default=sorted(bookings.COMPRESSION_SUFFIXES))
+  parser.add_argument(
+      '--formats',
+      help='Formats of the transformed examples to benchmark',
+      nargs='+',
+      choices=bookings.OUTPUT_FORMATS,
+      default=list(bookings.OUTPUT_FORMATS))
+  parser.add_argument(
+      '--batch-size', help='Batch size of the input pipeline', default=200,
+      type=int)
+  parser.add_argument(
+      '--num-batches', help='Number of timed batches', default=200, type=int)
+  parser.add_argument(
+      '--warmup-batches', help='Number of untimed batches', default=20,
+      type=int)
+  parser.add_argument(
+      '--num-parallel-reads',
+      help='Number of input files read concurrently',
+      default=4,
+      type=int)
+  args = parser.parse_args()
+
+  filenames = sorted(
+      name for pattern in args.train_files for name in tf.gfile.Glob(pattern))
+  tf_transform_output = tft.TFTransformOutput(args.tf_transform_dir)
+  layouts = {'tfrecord': None}
+  if 'packed' in args.formats:
+    layouts['packed'] = bookings.packed_layout(
+        tf_transform_output.transformed_feature_spec())
+  for output_format in args.formats:
+    for codec in args.codecs:
+      start = time.time()
+      outputs = model.rewrite_shards(
+          filenames,
+          os.path.join(args.work_dir, output_format, codec.lower(),
+                       'train_transformed'), codec, layouts[output_format])
+      size = sum(tf.gfile.Stat(output).length for output in outputs)
+      write_secs = time.time() - start
+      rate = benchmark_input.examples_per_sec(
+          lambda: model.dataset_input_fn(
+              outputs,
+              tf_transform_output,
+              batch_size=args.batch_size,
+              num_parallel_reads=args.num_parallel_reads),
+          args.batch_size, args.num_batches, args.warmup_batches)
+      print('%s %s: %.1f MB on disk, written in %.1fs, read %.0f examples/sec'
+            % (output_format, codec, size / 2**20, write_secs, rate))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,87 @@
+"""Measures examples/sec of the queue based and tf.data input pipelines."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import time
+
+import tensorflow as tf
+import tensorflow_transform as tft
+
+import model
+
+
+def examples_per_sec(make_input, batch_size, num_batches, warmup_batches):
+  """Pulls batches from an input_fn in a fresh graph and times them."""
+  with tf.Graph().as_default():
+    features_and_label = make_input()
+    if isinstance(features_and_label, tf.data.Dataset):
+      features_and_label = (
+          features_and_label.make_one_shot_iterator().get_next())
+    with tf.train.MonitoredSession() as session:
+      for _ in range(warmup_batches):
+        session.run(features_and_label)
+      start = time.time()
+      for _ in range(num_batches):
+        session.run(features_and_label)
+      elapsed = time.time() - start
+  return num_batches * batch_size / elapsed
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--train-files',
+      help='GCS or local paths to training data',
+      nargs='+',
+      required=True)
+  parser.add_argument(
+      '--tf-transform-dir',
+      help='Tf-transform directory with model from preprocessing step',
+      required=True)
+  parser.add_argument(
+      '--batch-sizes',
+      help='Batch sizes to benchmark',
+      nargs='+',
+      default=[40, 200, 1000],
+      type=int)
+  parser.add_argument(
+      '--num-batches', help='Number of timed batches', default=200, type=int)
+  parser.add_argument(
+      '--warmup-batches', help='Number of untimed batches', default=20,
+      type=int)
+  parser.add_argument(
+      '--num-parallel-reads',
+      help='Number of input files read concurrently (dataset mode)',
+      default=4,
+      type=int)
+  parser.add_argument(
+      '--num-parallel-calls',
+      help='Number of batches parsed concurrently (dataset mode)',
+      default=4,
+      type=int)
+  args = parser.parse_args()
+
+  tf_transform_output = tft.TFTransformOutput(args.tf_transform_dir)
+  for batch_size in args.batch_sizes:
+    queue_rate = examples_per_sec(
+        lambda: model.input_fn(args.train_files, tf_transform_output,
+                               batch_size=batch_size),
+        batch_size, args.num_batches, args.warmup_batches)
+    dataset_rate = examples_per_sec(
+        lambda: model.dataset_input_fn(
+            args.train_files,
+            tf_transform_output,
+            batch_size=batch_size,
+            num_parallel_reads=args.num_parallel_reads,
+            num_parallel_calls=args.num_parallel_calls,
+            shuffle_buffer_size=10000),
+        batch_size, args.num_batches, args.warmup_batches)
+    print('batch_size=%d: queue %.0f examples/sec, dataset %.0f examples/sec '
+          '(%.1fx)' % (batch_size, queue_rate, dataset_rate,
+                       dataset_rate / queue_rate))
+
+
+if __name__ == '__main__':
+  main()
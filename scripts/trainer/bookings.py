@@ -3,6 +3,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
+import os
+import re
+import struct
+
 from tensorflow_transform import coders as tft_coders
 from tensorflow_transform.tf_metadata import dataset_schema
 from tensorflow_transform.tf_metadata import schema_utils
@@ -11,6 +16,13 @@ from google.protobuf import text_format
 from tensorflow.python.lib.io import file_io
 from tensorflow_metadata.proto.v0 import schema_pb2
 
+# This module is imported as `bookings` by the trainer and as
+# `trainer.bookings` by the preprocessing scripts.
+try:
+  import preprocess_options  # pylint: disable=g-import-not-at-top
+except ImportError:
+  from trainer import preprocess_options  # pylint: disable=g-import-not-at-top
+
 # Categorical features are assumed to each have a maximum value in the dataset.
 MAX_CATEGORICAL_FEATURE_VALUES = [2, 53, 505, 1784, 105]
 
@@ -35,8 +47,29 @@ OOV_SIZE = 10
 
 VOCAB_FEATURE_KEYS = []
 
+# Id features that preprocess.py --reindex_ids maps to dense vocabulary
+# indices, instead of passing the raw ids through.
+REINDEX_FEATURE_KEYS = ['city_id', 'hotel_id', 'advertiser_id']
+
+# Ids seen fewer times than this in the training data are out of vocabulary.
+REINDEX_FREQUENCY_THRESHOLD = 5
+
+# Count of out-of-vocab buckets in which unrecognized re-indexed ids are hashed.
+REINDEX_OOV_SIZE = 10
+
 LABEL_KEY = 'bookings'
 
+# File suffix of the transformed example shards, by compression codec.
+COMPRESSION_SUFFIXES = preprocess_options.COMPRESSION_SUFFIXES
+
+# Suffix of the file describing the transformed example shards of a prefix.
+OUTPUT_METADATA_SUFFIX = '.metadata.json'
+
+OUTPUT_FORMATS = preprocess_options.OUTPUT_FORMATS
+
+# File suffix of packed shards, before the compression suffix.
+PACKED_SUFFIX = '.packed'
+
 CSV_COLUMN_NAMES = ["id","yyear","week_of_year","advertiser_id","market","hotel_id",\
           "clicks","cost","bookings","top_pos","beat","meet","lose","impressions","city_id","stars","rating",\
           "distance_to_city_centre","poi_image","longitude","latitude","last_renovation","spa_hotel",\
@@ -45,6 +78,11 @@ CSV_COLUMN_NAMES = ["id","yyear","week_of_year","advertiser_id","market","hotel_
           "family_hotel","total_images","total_hq_images","advertiser_connections"]
 
 
+def reindex_vocab_name(key):
+  """Returns the name of the vocabulary of a re-indexed id feature."""
+  return 'vocab_' + key
+
+
 def transformed_name(key):
   return key + '_xf'
 
@@ -95,3 +133,90 @@ def read_schema(path):
   contents = file_io.read_file_to_string(path)
   text_format.Parse(contents, result)
   return result
+
+
+def write_output_metadata(output_prefix, metadata):
+  """Writes the metadata of the transformed examples under `output_prefix`."""
+  file_io.write_string_to_file(output_prefix + OUTPUT_METADATA_SUFFIX,
+                               json.dumps(metadata, indent=2, sort_keys=True))
+
+
+def read_output_metadata(filename):
+  """Reads the metadata of the transformed examples a shard belongs to.
+
+  Args:
+    filename: Path of a shard written by preprocess.py, such as
+      `train_transformed-00000-of-00004.gz`.
+
+  Returns:
+    The metadata as a dict, or None if the shard has no metadata file.
+  """
+  match = re.match(r'(.*)-\d+-of-\d+', filename)
+  if not match:
+    return None
+  path = match.group(1) + OUTPUT_METADATA_SUFFIX
+  if not file_io.file_exists(path):
+    return None
+  return json.loads(file_io.read_file_to_string(path))
+
+
+def output_format(filename):
+  """Returns the format of a transformed example shard, see OUTPUT_FORMATS."""
+  metadata = read_output_metadata(filename)
+  if metadata is None:
+    return 'tfrecord'
+  return metadata.get('format', 'tfrecord')
+
+
+def packed_layout(feature_spec):
+  """Returns the layout of the packed records of transformed features.
+
+  A packed record holds the int64 features, then the float32 features, each
+  group sorted by name and stored little-endian, so that a batch of records
+  decodes into one matrix per group.
+
+  Args:
+    feature_spec: The transformed feature spec. Every feature must be a scalar
+      int64 or float32 `FixedLenFeature`.
+
+  Returns:
+    A dict with the `int64` and `float32` feature names, in record order, and
+    the `record_bytes` of a record.
+
+  Raises:
+    ValueError: If a feature cannot be packed.
+  """
+  layout = {'int64': [], 'float32': []}
+  for name, spec in sorted(feature_spec.items()):
+    if (spec.dtype.name not in layout or
+        list(getattr(spec, 'shape', [None])) != []):
+      raise ValueError('Feature %s (%s) is not a scalar int64 or float32 '
+                       'feature and cannot be packed' % (name, spec))
+    layout[spec.dtype.name].append(name)
+  layout['record_bytes'] = 8 * len(layout['int64']) + 4 * len(
+      layout['float32'])
+  return layout
+
+
+def pack_instance(instance, layout):
+  """Packs a dict of scalar features into a record of `packed_layout`."""
+  return struct.pack(
+      '<%dq%df' % (len(layout['int64']), len(layout['float32'])),
+      *([int(instance[name]) for name in layout['int64']] +
+        [float(instance[name]) for name in layout['float32']]))
+
+
+def compression_type(filename):
+  """Returns the compression codec of a transformed example shard.
+
+  The codec is read from the shard's metadata file, falling back to the file
+  extension for shards written before metadata was recorded.
+  """
+  metadata = read_output_metadata(filename)
+  if metadata is not None:
+    return metadata['compression']
+  extension = os.path.splitext(filename)[1]
+  for codec, suffix in COMPRESSION_SUFFIXES.items():
+    if suffix and extension == suffix:
+      return codec
+  return 'NONE'
@@ -0,0 +1,150 @@
+"""Training hooks and exporters reporting where the trainer spends its time."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+
+# Collection holding the tf.timestamp() at which the current batch was
+# produced by the input pipeline, see `model.dataset_input_fn`.
+BATCH_PRODUCED_AT_COLLECTION = 'batch_produced_at'
+
+
+class CheckpointTimer(tf.train.CheckpointSaverListener):
+  """Records the start and end time of each checkpoint save."""
+
+  def __init__(self):
+    self.saves = []
+    self._start = None
+
+  def before_save(self, session, global_step_value):
+    self._start = time.time()
+
+  def after_save(self, session, global_step_value):
+    self.saves.append((self._start, time.time()))
+
+
+class ThroughputHook(tf.train.SessionRunHook):
+  """Measures examples/sec and splits step time into input wait and compute.
+
+  The input pipeline and the model run within the same `session.run`, so the
+  input wait of a step is estimated from the time its batch left the input
+  pipeline: a batch produced after the step started kept the model waiting
+  for that long. Without a timestamped input pipeline only step times are
+  reported.
+
+  Checkpoints are saved in the `after_run` of the CheckpointSaverHook, which
+  runs before this hook's. With a `CheckpointTimer` listening to that hook,
+  a step ends where its save starts; the save itself, and the saving
+  listeners after it (e.g. the evaluation of `train_and_evaluate`), are
+  reported apart.
+  """
+
+  def __init__(self, batch_size, checkpoint_timer=None):
+    self._batch_size = batch_size
+    self._checkpoint_timer = checkpoint_timer
+    self._produced_at = None
+    self._global_step = None
+    self._run_start = None
+    self._first_run_start = None
+    self._saves_before_run = 0
+    self._last_run_end = None
+    self._step_secs = []
+    self._input_wait_secs = []
+    self._saving_listener_secs = []
+    self._between_steps_secs = []
+
+  def begin(self):
+    self._global_step = tf.train.get_global_step()
+    produced_at = tf.get_collection(BATCH_PRODUCED_AT_COLLECTION)
+    self._produced_at = produced_at[0] if produced_at else None
+
+  def before_run(self, run_context):
+    self._run_start = time.time()
+    if self._first_run_start is None:
+      self._first_run_start = self._run_start
+    if self._last_run_end is not None:
+      self._between_steps_secs.append(self._run_start - self._last_run_end)
+    if self._checkpoint_timer is not None:
+      self._saves_before_run = len(self._checkpoint_timer.saves)
+    fetches = {'global_step': self._global_step}
+    if self._produced_at is not None:
+      fetches['produced_at'] = self._produced_at
+    return tf.train.SessionRunArgs(fetches)
+
+  def after_run(self, run_context, run_values):
+    self._last_run_end = time.time()
+    step_end = self._last_run_end
+    if self._checkpoint_timer is not None:
+      saves = self._checkpoint_timer.saves[self._saves_before_run:]
+      if saves:
+        step_end = saves[0][0]
+        self._saving_listener_secs.append(
+            self._last_run_end - step_end -
+            sum(end - start for start, end in saves))
+    step_secs = step_end - self._run_start
+    self._step_secs.append(step_secs)
+    if 'produced_at' in run_values.results:
+      wait = run_values.results['produced_at'] - self._run_start
+      self._input_wait_secs.append(min(max(wait, 0.0), step_secs))
+
+  def report(self):
+    """Returns the measurements as a JSON serializable dict."""
+    step_secs = np.array(self._step_secs)
+    total_step_secs = float(step_secs.sum())
+    report = {
+        'steps': len(step_secs),
+        'step_secs_total': total_step_secs,
+        'step_secs_p50': float(np.percentile(step_secs, 50)) if len(
+            step_secs) else None,
+        'examples_per_sec': (len(step_secs) * self._batch_size /
+                             total_step_secs if total_step_secs else None),
+        'batch_size': self._batch_size,
+        # Wall clock times bounding the training window, e.g. to compute the
+        # throughput of several workers together.
+        'first_step_start': self._first_run_start,
+        'last_step_end': self._last_run_end,
+        'checkpoint_secs_total': None,
+        'checkpoints': None,
+        'saving_listener_secs_total': float(sum(self._saving_listener_secs)),
+        'between_steps_secs_total': float(sum(self._between_steps_secs)),
+        'input_wait_secs_total': None,
+        'compute_secs_total': None,
+    }
+    if self._checkpoint_timer is not None:
+      saves = self._checkpoint_timer.saves
+      report['checkpoint_secs_total'] = float(
+          sum(end - start for start, end in saves))
+      report['checkpoints'] = len(saves)
+    if self._input_wait_secs:
+      input_wait = float(sum(self._input_wait_secs))
+      report['input_wait_secs_total'] = input_wait
+      report['compute_secs_total'] = total_step_secs - input_wait
+    return report
+
+  def end(self, session):
+    tf.logging.info('Training throughput: %s', json.dumps(self.report()))
+
+
+class TimedExporter(tf.estimator.Exporter):
+  """Wraps an exporter and records how long each export takes."""
+
+  def __init__(self, exporter):
+    self._exporter = exporter
+    self.export_secs = []
+
+  @property
+  def name(self):
+    return self._exporter.name
+
+  def export(self, estimator, export_path, checkpoint_path, eval_result,
+             is_the_final_export):
+    start = time.time()
+    result = self._exporter.export(estimator, export_path, checkpoint_path,
+                                   eval_result, is_the_final_export)
+    self.export_secs.append(time.time() - start)
+    return result
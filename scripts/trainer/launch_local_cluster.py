@@ -0,0 +1,210 @@
+"""Runs distributed training as a local cluster of task.py processes.
+
+A chief, `num_workers - 1` workers, parameter servers and an evaluator are
+started on localhost, each as a `task.py` process with its own `--task-type`
+and `--task-index`. Arguments not recognized here are passed to every task,
+e.g.
+
+  python launch_local_cluster.py --num-workers 1 2 4 --output-dir /tmp/dist \
+      --train-steps 10000 --report scaling.json -- --train-files ... \
+      --eval-files ... --tf-transform-dir ... --schema-file ...
+
+With several `--num-workers`, one cluster is run per value and the training
+throughput of each is reported, as a scaling benchmark. The throughput counts
+the examples all training replicas processed between the first step of any of
+them and the last, as measured by task.py's `--metrics-file`, so that startup,
+the final evaluation and exports are left out.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+TASK_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'task.py')
+
+
+def _free_port():
+  with contextlib.closing(socket.socket(socket.AF_INET,
+                                        socket.SOCK_STREAM)) as s:
+    s.bind(('localhost', 0))
+    return s.getsockname()[1]
+
+
+def make_cluster_spec(num_workers, num_ps):
+  """Returns a cluster spec of local addresses.
+
+  Args:
+    num_workers: Number of training replicas, including the chief.
+    num_ps: Number of parameter servers.
+
+  Returns:
+    A dict from job name to the list of `host:port` addresses of its tasks.
+    The evaluator is not part of the spec, as TensorFlow expects.
+  """
+  address = lambda: 'localhost:%d' % _free_port()
+  cluster_spec = {
+      'chief': [address()],
+      'ps': [address() for _ in range(num_ps)],
+  }
+  if num_workers > 1:
+    cluster_spec['worker'] = [address() for _ in range(num_workers - 1)]
+  return cluster_spec
+
+
+def training_throughput(train_reports):
+  """Returns the examples/sec of a cluster over its training window.
+
+  Args:
+    train_reports: The `ThroughputHook` reports of the training replicas, as
+      written under `train` in task.py's `--metrics-file`.
+
+  Returns:
+    A (examples_per_sec, train_secs) tuple, both None if no step was timed.
+  """
+  train_reports = [report for report in train_reports if report['steps']]
+  if not train_reports:
+    return None, None
+  train_secs = (max(report['last_step_end'] for report in train_reports) -
+                min(report['first_step_start'] for report in train_reports))
+  examples = sum(report['steps'] * report['batch_size']
+                 for report in train_reports)
+  return examples / train_secs, train_secs
+
+
+def run_cluster(num_workers, num_ps, output_dir, task_args):
+  """Trains with a local cluster and returns its timings.
+
+  Args:
+    num_workers: Number of training replicas, including the chief.
+    num_ps: Number of parameter servers.
+    output_dir: Directory under which the model and checkpoints are written,
+      passed to the tasks as `--output-dir` and `--job-dir`.
+    task_args: Other arguments passed to every task.py process.
+
+  Returns:
+    A (seconds, train_reports) tuple: the seconds until the chief finished
+    training and exporting, and the `ThroughputHook` report of each training
+    replica.
+
+  Raises:
+    subprocess.CalledProcessError: If a training task fails.
+  """
+  cluster_spec = make_cluster_spec(num_workers, num_ps)
+  tasks = [('ps', i) for i in range(num_ps)]
+  tasks += [('worker', i) for i in range(num_workers - 1)]
+  tasks += [('evaluator', 0), ('chief', 0)]
+  log_dir = os.path.join(output_dir, 'logs')
+  if not os.path.isdir(log_dir):
+    os.makedirs(log_dir)
+
+  start = time.time()
+  processes = {}
+  logs = []
+  metrics_files = []
+  for task_type, task_index in tasks:
+    args = [
+        sys.executable, TASK_SCRIPT,
+        '--output-dir', output_dir,
+        '--job-dir', output_dir,
+        '--cluster-spec', json.dumps(cluster_spec),
+        '--task-type', task_type,
+        '--task-index', str(task_index),
+    ] + task_args
+    if task_type in ('chief', 'worker'):
+      metrics_file = os.path.join(
+          log_dir, '%s-%d.metrics.json' % (task_type, task_index))
+      metrics_files.append(metrics_file)
+      args += ['--metrics-file', metrics_file]
+    log = open(os.path.join(log_dir, '%s-%d.log' % (task_type, task_index)),
+               'w')
+    logs.append(log)
+    processes[(task_type, task_index)] = subprocess.Popen(
+        args, stdout=log, stderr=subprocess.STDOUT)
+  try:
+    for task, process in sorted(processes.items()):
+      if task[0] == 'ps':
+        continue
+      if process.wait():
+        raise subprocess.CalledProcessError(process.returncode,
+                                            '%s-%d' % task)
+      if task[0] == 'chief':
+        seconds = time.time() - start
+  finally:
+    # Parameter servers run until they are killed.
+    for process in processes.values():
+      if process.poll() is None:
+        process.kill()
+    for log in logs:
+      log.close()
+  train_reports = []
+  for metrics_file in metrics_files:
+    with open(metrics_file) as f:
+      train_reports.append(json.load(f)['train'])
+  return seconds, train_reports
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--num-workers',
+      help='Numbers of training replicas (chief included) to run',
+      nargs='+',
+      default=[2],
+      type=int)
+  parser.add_argument(
+      '--num-ps', help='Number of parameter servers', default=1, type=int)
+  parser.add_argument(
+      '--output-dir',
+      help='Directory under which each cluster writes its model',
+      required=True)
+  parser.add_argument(
+      '--train-steps',
+      help='Global training steps, passed to task.py',
+      required=True,
+      type=int)
+  parser.add_argument(
+      '--train-batch-size',
+      help='Batch size per worker, passed to task.py',
+      default=40,
+      type=int)
+  parser.add_argument(
+      '--report', help='Path of the JSON report to write', default=None)
+  args, task_args = parser.parse_known_args()
+  if task_args and task_args[0] == '--':
+    task_args = task_args[1:]
+  task_args += [
+      '--train-steps', str(args.train_steps),
+      '--train-batch-size', str(args.train_batch_size),
+  ]
+
+  report = {}
+  for num_workers in args.num_workers:
+    seconds, train_reports = run_cluster(
+        num_workers, args.num_ps,
+        os.path.join(os.path.abspath(args.output_dir),
+                     'workers_%d' % num_workers), task_args)
+    examples_per_sec, train_secs = training_throughput(train_reports)
+    report[str(num_workers)] = {
+        'seconds': seconds,
+        'train_secs': train_secs,
+        'examples_per_sec': examples_per_sec,
+        'replicas': train_reports,
+    }
+    print('%d workers: %.1fs, %.1fs training, %.0f examples/sec' % (
+        num_workers, seconds, train_secs or 0.0, examples_per_sec or 0.0))
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
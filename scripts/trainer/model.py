@@ -3,13 +3,41 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import gzip
+import os
+import zlib
+
+import numpy as np
 import tensorflow as tf
 
-import tensorflow_model_analysis as tfma
 import bookings
+import hooks
+
+# Feature key under which dataset_input_fn can stamp each batch with the time
+# it was produced, see hooks.ThroughputHook.
+PRODUCED_AT_KEY = '__produced_at'
+
 
+def _categorical_num_buckets(tf_transform_output):
+  """Returns the number of buckets of each categorical feature, by key.
 
-def build_estimator(tf_transform_output, config, hidden_units=None):
+  Features re-indexed by preprocess.py --reindex_ids are detected from their
+  vocabulary file and sized by it, the others by the maximum value assumed in
+  `bookings.MAX_CATEGORICAL_FEATURE_VALUES`.
+  """
+  num_buckets = dict(zip(bookings.CATEGORICAL_FEATURE_KEYS,
+                         bookings.MAX_CATEGORICAL_FEATURE_VALUES))
+  for key in bookings.REINDEX_FEATURE_KEYS:
+    vocab_name = bookings.reindex_vocab_name(key)
+    if tf.gfile.Exists(tf_transform_output.vocabulary_file_by_name(vocab_name)):
+      num_buckets[key] = (
+          tf_transform_output.vocabulary_size_by_name(vocab_name) +
+          bookings.REINDEX_OOV_SIZE)
+  return num_buckets
+
+
+def build_estimator(tf_transform_output, config, hidden_units=None,
+                    embed_ids=False, embedding_dimension=8):
   """Build an estimator for predicting number of bookings in hotels.
 
   Args:
@@ -17,6 +45,9 @@ def build_estimator(tf_transform_output, config, hidden_units=None):
     config: tf.contrib.learn.RunConfig defining the runtime environment for the
       estimator (including model_dir).
     hidden_units: [int], the layer sizes of the DNN (input layer first)
+    embed_ids: If True, the id features of `bookings.REINDEX_FEATURE_KEYS` are
+      also fed to the DNN as embeddings.
+    embedding_dimension: Dimension of the id embeddings.
 
   Returns:
     Resulting DNNLinearCombinedClassifier.
@@ -40,13 +71,22 @@ def build_estimator(tf_transform_output, config, hidden_units=None):
           key, num_buckets=bookings.FEATURE_BUCKET_COUNT, default_value=0)
       for key in bookings.transformed_names(bookings.BUCKET_FEATURE_KEYS)
   ]
+  num_buckets = _categorical_num_buckets(tf_transform_output)
+  id_columns = {
+      key: tf.feature_column.categorical_column_with_identity(
+          bookings.transformed_name(key), num_buckets=num_buckets[key],
+          default_value=0)
+      for key in bookings.CATEGORICAL_FEATURE_KEYS
+  }
   categorical_columns += [
-      tf.feature_column.categorical_column_with_identity(
-          key, num_buckets=num_buckets, default_value=0)
-      for key, num_buckets in zip(
-          bookings.transformed_names(bookings.CATEGORICAL_FEATURE_KEYS),  #
-          bookings.MAX_CATEGORICAL_FEATURE_VALUES)
+      id_columns[key] for key in bookings.CATEGORICAL_FEATURE_KEYS
   ]
+  if embed_ids:
+    real_valued_columns += [
+        tf.feature_column.embedding_column(
+            id_columns[key], dimension=embedding_dimension)
+        for key in bookings.REINDEX_FEATURE_KEYS
+    ]
   return tf.estimator.DNNLinearCombinedRegressor(
       config=config,
       linear_feature_columns=categorical_columns,
@@ -78,6 +118,49 @@ def example_serving_receiver_fn(tf_transform_output, schema):
       transformed_features, serving_input_receiver.receiver_tensors)
 
 
+def _dense_to_sparse(tensor):
+  """Wraps a rank 1 tensor into a SparseTensor with one value per row."""
+  batch_size = tf.shape(tensor, out_type=tf.int64)[0]
+  indices = tf.stack(
+      [tf.range(batch_size), tf.zeros([batch_size], dtype=tf.int64)], axis=1)
+  return tf.SparseTensor(indices, tensor, tf.stack([batch_size, 1]))
+
+
+def dense_serving_receiver_fn(tf_transform_output, schema):
+  """Build the serving inputs from typed dense tensors, one per raw feature.
+
+  Unlike `example_serving_receiver_fn`, callers feed a batch of values per
+  feature directly, so no tf.Example has to be built, serialized or parsed.
+  Every row must provide a value for every feature.
+
+  Args:
+    tf_transform_output: A TFTransformOutput.
+    schema: the schema of the input data.
+
+  Returns:
+    Tensorflow graph which applies tf-transform to the fed raw features.
+  """
+  raw_feature_spec = bookings.get_raw_feature_spec(schema)
+
+  receiver_tensors = {}
+  raw_features = {}
+  for key in (bookings.DENSE_FLOAT_FEATURE_KEYS + bookings.VOCAB_FEATURE_KEYS +
+              bookings.BUCKET_FEATURE_KEYS + bookings.CATEGORICAL_FEATURE_KEYS):
+    spec = raw_feature_spec[key]
+    tensor = tf.placeholder(dtype=spec.dtype, shape=[None], name=key)
+    receiver_tensors[key] = tensor
+    if isinstance(spec, tf.VarLenFeature):
+      raw_features[key] = _dense_to_sparse(tensor)
+    else:
+      raw_features[key] = tensor
+
+  transformed_features = tf_transform_output.transform_raw_features(
+      raw_features)
+
+  return tf.estimator.export.ServingInputReceiver(
+      transformed_features, receiver_tensors)
+
+
 def eval_input_receiver_fn(tf_transform_output, schema):
   """Build everything needed for the tf-model-analysis to run the model.
 
@@ -114,26 +197,190 @@ def eval_input_receiver_fn(tf_transform_output, schema):
   # materialized output of TFT, but slicing will happen on raw features.
   features.update(transformed_features)
 
+  # TFMA pulls in Beam, so it is only imported when an eval model is exported.
+  import tensorflow_model_analysis as tfma  # pylint: disable=g-import-not-at-top
   return tfma.export.EvalInputReceiver(
       features=features,
       receiver_tensors=receiver_tensors,
       labels=transformed_features[bookings.transformed_name(bookings.LABEL_KEY)])
 
 
-def _gzip_reader_fn():
-  """Small utility returning a record reader that can read gzip'ed files."""
-  return tf.TFRecordReader(
-      options=tf.python_io.TFRecordOptions(
-          compression_type=tf.python_io.TFRecordCompressionType.GZIP))
+def _glob(filenames):
+  """Expands a list of file patterns into the sorted files they match."""
+  files = sorted(
+      set(name for pattern in filenames for name in tf.gfile.Glob(pattern)))
+  if not files:
+    raise ValueError('No files match %s' % filenames)
+  return files
+
+
+def _compression_type(files):
+  """Returns the codec of the transformed example files, see bookings.py."""
+  codecs = set(bookings.compression_type(name) for name in files)
+  if len(codecs) > 1:
+    raise ValueError('Files use different compression codecs: %s' %
+                     sorted(codecs))
+  return codecs.pop()
+
+
+def _packed_layout(files):
+  """Returns the packed layout of the files, or None for tf.Example files."""
+  formats = set(bookings.output_format(name) for name in files)
+  if len(formats) > 1:
+    raise ValueError('Files use different formats: %s' % sorted(formats))
+  if formats.pop() != 'packed':
+    return None
+  return bookings.read_output_metadata(files[0])['layout']
+
 
+def decode_packed(records, layout):
+  """Decodes a batch of packed records into a dict of feature columns.
 
-def input_fn(filenames, tf_transform_output, batch_size=200):
+  Each group of features of `bookings.packed_layout` is cut out of the records,
+  decoded and reshaped into a [batch, features] matrix at once.
+
+  Args:
+    records: A string Tensor of packed records.
+    layout: The `bookings.packed_layout` of the records.
+
+  Returns:
+    A dict from feature name to a 1-D Tensor.
+  """
+  features = {}
+  offset = 0
+  for dtype, width in ((tf.int64, 8), (tf.float32, 4)):
+    names = layout[dtype.name]
+    if not names:
+      continue
+    values = tf.reshape(
+        tf.decode_raw(tf.substr(records, offset, width * len(names)), dtype,
+                      little_endian=True), [-1, len(names)])
+    for i, name in enumerate(names):
+      features[name] = values[:, i]
+    offset += width * len(names)
+  return features
+
+
+def _record_options(compression_type):
+  return tf.python_io.TFRecordOptions(
+      compression_type=getattr(tf.python_io.TFRecordCompressionType,
+                               compression_type))
+
+
+def _pack_example(record, layout):
+  """Packs a serialized transformed tf.Example into a record of `layout`."""
+  feature = tf.train.Example.FromString(record).features.feature
+  instance = {name: feature[name].int64_list.value[0]
+              for name in layout['int64']}
+  instance.update({name: feature[name].float_list.value[0]
+                   for name in layout['float32']})
+  return bookings.pack_instance(instance, layout)
+
+
+def _write_packed(output, records, compression_type):
+  """Writes packed records back to back, compressed as TensorFlow reads them."""
+  data = b''.join(records)
+  if compression_type == 'GZIP':
+    data = gzip.compress(data)
+  elif compression_type == 'ZLIB':
+    data = zlib.compress(data)
+  with tf.gfile.GFile(output, 'wb') as f:
+    f.write(data)
+
+
+def rewrite_shards(filenames, output_prefix, compression_type, layout=None):
+  """Rewrites transformed example shards with another codec or format.
+
+  The shards are written as `<output_prefix>-<i>-of-<n><suffix>`, along with
+  the metadata preprocess.py records for them.
+
+  Args:
+    filenames: Paths of the transformed example shards, as tf.Examples.
+    output_prefix: Path prefix of the rewritten shards.
+    compression_type: One of the keys of `bookings.COMPRESSION_SUFFIXES`.
+    layout: If set, the shards are rewritten as packed records of this
+      `bookings.packed_layout`.
+
+  Returns:
+    The paths of the rewritten shards.
+
+  Raises:
+    ValueError: If a shard is not made of tf.Examples.
+  """
+  tf.gfile.MakeDirs(os.path.dirname(output_prefix))
+  suffix = bookings.COMPRESSION_SUFFIXES[compression_type]
+  if layout is not None:
+    suffix = bookings.PACKED_SUFFIX + suffix
+  outputs = []
+  for i, filename in enumerate(filenames):
+    if bookings.output_format(filename) != 'tfrecord':
+      raise ValueError('Cannot rewrite %s, which is not made of tf.Examples' %
+                       filename)
+    output = '%s-%05d-of-%05d%s' % (output_prefix, i, len(filenames), suffix)
+    records = tf.python_io.tf_record_iterator(
+        filename, _record_options(bookings.compression_type(filename)))
+    if layout is not None:
+      _write_packed(output, [_pack_example(record, layout)
+                             for record in records], compression_type)
+    else:
+      with tf.python_io.TFRecordWriter(
+          output, _record_options(compression_type)) as writer:
+        for record in records:
+          writer.write(record)
+    outputs.append(output)
+  output_metadata = {
+      'format': 'tfrecord' if layout is None else 'packed',
+      'compression': compression_type,
+      'num_shards': len(outputs),
+      'file_pattern': os.path.basename(output_prefix) + '-*',
+  }
+  if layout is not None:
+    output_metadata['layout'] = layout
+  bookings.write_output_metadata(output_prefix, output_metadata)
+  return outputs
+
+
+def _sharded_records(files, compression_type, layout, num_shards, shard_index):
+  """Returns every `num_shards`-th record of the files, from `shard_index`.
+
+  The files are read one after the other in sorted order, so that every worker
+  sees the same record stream and the shards neither overlap nor miss records.
+  Used when there are fewer files than workers to divide them between.
+  """
+  if compression_type == 'NONE':
+    compression_type = ''
+  if layout is None:
+    dataset = tf.data.TFRecordDataset(files, compression_type=compression_type)
+  else:
+    dataset = tf.data.FixedLengthRecordDataset(
+        files, layout['record_bytes'], compression_type=compression_type)
+  return dataset.shard(num_shards, shard_index)
+
+
+def _make_reader_fn(compression_type):
+  """Returns a record reader factory for files of the given codec."""
+  options = _record_options(compression_type)
+
+  def reader_fn():
+    return tf.TFRecordReader(options=options)
+
+  return reader_fn
+
+
+def input_fn(filenames, tf_transform_output, batch_size=200,
+             shuffle_buffer_size=10000, num_shards=1, shard_index=0):
   """Generates features and labels for training or evaluation.
 
   Args:
     filenames: [str] list of CSV files to read data from.
     tf_transform_output: A TFTransformOutput.
     batch_size: int First dimension size of the Tensors returned by input_fn
+    shuffle_buffer_size: Capacity of the example queue. If positive, the files
+      and the examples in the queue are read in random order.
+    num_shards: Number of workers the files are divided between.
+    shard_index: Index of the worker reading this input, in
+      `[0, num_shards)`. Each worker reads every `num_shards`-th file, or
+      every `num_shards`-th example if there are fewer files than workers.
 
   Returns:
     A (features, indices) tuple where features is a dictionary of
@@ -142,10 +389,203 @@ def input_fn(filenames, tf_transform_output, batch_size=200):
   transformed_feature_spec = (
       tf_transform_output.transformed_feature_spec().copy())
 
-  transformed_features = tf.contrib.learn.io.read_batch_features(
-      filenames, batch_size, transformed_feature_spec, reader=_gzip_reader_fn)
+  files = _glob(filenames)
+  layout = _packed_layout(files)
+  if len(files) < num_shards:
+    # Too few files to divide: the records are divided instead, in the same
+    # way as dataset_input_fn does, and queued for batching.
+    record = _sharded_records(
+        files, _compression_type(files), layout, num_shards,
+        shard_index).repeat().make_one_shot_iterator().get_next()
+    if shuffle_buffer_size > 0:
+      records = tf.train.shuffle_batch(
+          [record], batch_size,
+          capacity=shuffle_buffer_size + batch_size,
+          min_after_dequeue=shuffle_buffer_size)
+    else:
+      records = tf.train.batch([record], batch_size)
+    if layout is None:
+      transformed_features = tf.parse_example(records,
+                                              transformed_feature_spec)
+    else:
+      transformed_features = decode_packed(records, layout)
+  elif layout is None:
+    files = files[shard_index::num_shards]
+    transformed_features = tf.contrib.learn.io.read_batch_features(
+        files, batch_size, transformed_feature_spec,
+        reader=_make_reader_fn(_compression_type(files)),
+        randomize_input=shuffle_buffer_size > 0,
+        queue_capacity=max(shuffle_buffer_size, batch_size))
+  else:
+    files = files[shard_index::num_shards]
+    compression_type = _compression_type(files)
+    records = tf.contrib.learn.io.read_batch_examples(
+        files, batch_size,
+        reader=lambda: tf.FixedLengthRecordReader(
+            layout['record_bytes'],
+            encoding=None if compression_type == 'NONE' else compression_type),
+        randomize_input=shuffle_buffer_size > 0,
+        queue_capacity=max(shuffle_buffer_size, batch_size))
+    transformed_features = decode_packed(records, layout)
 
   # We pop the label because we do not want to use it as a feature while we're
   # training.
   return transformed_features, transformed_features.pop(
       bookings.transformed_name(bookings.LABEL_KEY))
+
+
+def dataset_input_fn(filenames,
+                     tf_transform_output,
+                     batch_size=200,
+                     num_parallel_reads=4,
+                     num_parallel_calls=4,
+                     shuffle_buffer_size=None,
+                     prefetch_buffer_size=1,
+                     cache=False,
+                     take_batches=None,
+                     timestamp_batches=False,
+                     num_shards=1,
+                     shard_index=0):
+  """Generates features and labels for training or evaluation with tf.data.
+
+  The compression codec and format of the files are read from the metadata
+  preprocess.py writes next to them. Shards are read in parallel, examples are
+  batched before parsing so that `parse_example` (or `decode_packed`, for
+  packed shards) runs once per batch, and batches are prefetched while the
+  model consumes the previous one.
+
+  Args:
+    filenames: [str] list of transformed example files to read data from.
+    tf_transform_output: A TFTransformOutput.
+    batch_size: int First dimension size of the Tensors returned by input_fn
+    num_parallel_reads: Number of files read concurrently.
+    num_parallel_calls: Number of batches parsed concurrently.
+    shuffle_buffer_size: If set, the file order and the examples are shuffled,
+      the latter through a buffer of this many examples.
+    prefetch_buffer_size: Number of parsed batches to prefetch.
+    cache: If True, the parsed batches are cached in memory after the first
+      pass. Only useful for datasets that fit in memory, such as eval data.
+    take_batches: If set, only the first this many batches are read, e.g. to
+      evaluate on a subset of the eval data.
+    timestamp_batches: If True, each batch of features also holds the
+      `tf.timestamp()` at which it was produced under `PRODUCED_AT_KEY`.
+    num_shards: Number of workers the input is divided between.
+    shard_index: Index of the worker reading this input, in
+      `[0, num_shards)`. Each worker reads every `num_shards`-th file, or
+      every `num_shards`-th example if there are fewer files than workers.
+
+  Returns:
+    A dataset of (features, indices) tuples where features is a dictionary of
+      Tensors, and indices is a single Tensor of label indices.
+  """
+  transformed_feature_spec = (
+      tf_transform_output.transformed_feature_spec().copy())
+  shuffle = shuffle_buffer_size is not None
+  files = _glob(filenames)
+  compression_type = _compression_type(files)
+  if compression_type == 'NONE':
+    compression_type = ''
+  layout = _packed_layout(files)
+  if layout is None:
+    read = lambda filename: tf.data.TFRecordDataset(
+        filename, compression_type=compression_type)
+    parse = lambda serialized: tf.parse_example(serialized,
+                                                transformed_feature_spec)
+  else:
+    read = lambda filename: tf.data.FixedLengthRecordDataset(
+        filename, layout['record_bytes'], compression_type=compression_type)
+    parse = lambda records: decode_packed(records, layout)
+  if len(files) < num_shards:
+    # Sharded before any shuffling, so that the workers split one stream.
+    dataset = _sharded_records(files, _compression_type(files), layout,
+                               num_shards, shard_index)
+  else:
+    files = files[shard_index::num_shards]
+    dataset = tf.data.Dataset.from_tensor_slices(files)
+    if shuffle:
+      dataset = dataset.shuffle(len(files))
+    dataset = dataset.apply(
+        tf.data.experimental.parallel_interleave(
+            read,
+            cycle_length=num_parallel_reads,
+            sloppy=shuffle))
+  if shuffle:
+    dataset = dataset.shuffle(shuffle_buffer_size)
+  dataset = dataset.batch(batch_size)
+  dataset = dataset.map(parse, num_parallel_calls=num_parallel_calls)
+  if take_batches:
+    dataset = dataset.take(take_batches)
+  if cache:
+    dataset = dataset.cache()
+  dataset = dataset.repeat()
+
+  def split_label(features):
+    # We pop the label because we do not want to use it as a feature while
+    # we're training.
+    return features, features.pop(
+        bookings.transformed_name(bookings.LABEL_KEY))
+
+  dataset = dataset.map(split_label)
+  if timestamp_batches:
+
+    def stamp(features, label):
+      features[PRODUCED_AT_KEY] = tf.timestamp()
+      return features, label
+
+    dataset = dataset.map(stamp)
+  return dataset.prefetch(prefetch_buffer_size)
+
+
+def read_batches(filenames, tf_transform_output, batch_size, num_batches):
+  """Reads the first batches of transformed examples into NumPy arrays.
+
+  Args:
+    filenames: [str] list of transformed example files to read data from.
+    tf_transform_output: A TFTransformOutput.
+    batch_size: Number of examples per batch.
+    num_batches: Number of batches read. The files are read again from the
+      start if they hold fewer batches.
+
+  Returns:
+    A (features, label) tuple, where features is a dictionary of NumPy arrays
+      and label a NumPy array, of `batch_size * num_batches` rows.
+  """
+  with tf.Graph().as_default():
+    next_batch = dataset_input_fn(
+        filenames, tf_transform_output, batch_size=batch_size,
+        take_batches=num_batches).make_one_shot_iterator().get_next()
+    with tf.Session() as session:
+      batches = [session.run(next_batch) for _ in range(num_batches)]
+  features = {
+      key: np.concatenate([batch[0][key] for batch in batches])
+      for key in batches[0][0]
+  }
+  return features, np.concatenate([batch[1] for batch in batches])
+
+
+def in_memory_input_fn(features, label, batch_size):
+  """Returns a dataset repeating batches of in-memory features and labels.
+
+  The arrays are embedded in the graph as constants, so they should be small,
+  such as the output of `read_batches` for an eval subset.
+  """
+  return tf.data.Dataset.from_tensor_slices(
+      (features, label)).batch(batch_size).repeat()
+
+
+def timed_input_tensors(dataset):
+  """Returns the next (features, label) of a timestamped dataset.
+
+  The batch timestamp is removed from the features and registered in the
+  collection read by `hooks.ThroughputHook`.
+
+  Args:
+    dataset: A dataset built by `dataset_input_fn` with timestamp_batches.
+
+  Returns:
+    A (features, label) tuple of tensors.
+  """
+  features, label = dataset.make_one_shot_iterator().get_next()
+  tf.add_to_collection(hooks.BATCH_PRODUCED_AT_COLLECTION,
+                       features.pop(PRODUCED_AT_KEY))
+  return features, label
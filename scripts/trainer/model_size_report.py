@@ -0,0 +1,90 @@
+"""Compares model size, checkpoint size and step time of trained models.
+
+Each run is given as a name, the `--output-dir` of task.py and the
+`--metrics-file` it wrote, e.g. to compare raw ids with re-indexed ids fed as
+embeddings:
+
+  python model_size_report.py \
+      --run raw ../../data/raw_ids ../../data/raw_ids/metrics.json \
+      --run reindexed ../../data/reindexed ../../data/reindexed/metrics.json
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+import task
+
+_OPTIMIZER_SLOT_SUFFIXES = ('/Ftrl', '/Ftrl_1', '/Adagrad')
+
+
+def model_size(output_dir):
+  """Returns the size of the latest checkpoint of a trained model.
+
+  Args:
+    output_dir: The `--output-dir` task.py wrote the model to.
+
+  Returns:
+    A dict with the number of model parameters (optimizer slots excluded), the
+    number of parameters in the linear and DNN parts, and the checkpoint size
+    on disk in bytes.
+  """
+  model_dir = os.path.join(output_dir, task.SERVING_MODEL_DIR)
+  checkpoint = tf.train.latest_checkpoint(model_dir)
+  if checkpoint is None:
+    raise ValueError('No checkpoint found in %s' % model_dir)
+  params = {'linear': 0, 'dnn': 0, 'total': 0}
+  for name, shape in tf.train.list_variables(checkpoint):
+    if name.endswith(_OPTIMIZER_SLOT_SUFFIXES) or name == 'global_step':
+      continue
+    size = int(np.prod(shape))
+    params['total'] += size
+    if name.startswith('linear/'):
+      params['linear'] += size
+    elif name.startswith('dnn/'):
+      params['dnn'] += size
+  checkpoint_bytes = sum(
+      tf.gfile.Stat(path).length for path in tf.gfile.Glob(checkpoint + '.*'))
+  return {'params': params, 'checkpoint_bytes': checkpoint_bytes}
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--run',
+      help='Name, task.py --output-dir and --metrics-file of a trained model',
+      nargs=3,
+      metavar=('NAME', 'OUTPUT_DIR', 'METRICS_FILE'),
+      action='append',
+      required=True)
+  parser.add_argument(
+      '--report', help='Path of the JSON report to write', default=None)
+  args = parser.parse_args()
+
+  report = {}
+  for name, output_dir, metrics_file in args.run:
+    report[name] = model_size(output_dir)
+    with tf.gfile.GFile(metrics_file) as f:
+      train = json.load(f)['train']
+    report[name]['step_secs_p50'] = train['step_secs_p50']
+    report[name]['examples_per_sec'] = train['examples_per_sec']
+    print('%s: %d params (linear %d, dnn %d), checkpoint %.1f MB, '
+          'p50 step %.1f ms' % (
+              name, report[name]['params']['total'],
+              report[name]['params']['linear'],
+              report[name]['params']['dnn'],
+              report[name]['checkpoint_bytes'] / 2**20,
+              report[name]['step_secs_p50'] * 1000))
+  if args.report:
+    with open(args.report, 'w') as f:
+      json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,30 @@
+"""Option values of preprocess.py, shared with the pipeline and the trainer.
+
+This module imports nothing, so that preprocess.py can check its flags before
+Beam, TensorFlow and tf.Transform are imported.
+"""
+
+# File suffix of the transformed example shards, by compression codec.
+COMPRESSION_SUFFIXES = {'GZIP': '.gz', 'ZLIB': '.deflate', 'NONE': ''}
+
+COMPRESSIONS = tuple(sorted(COMPRESSION_SUFFIXES))
+
+# Formats of the transformed example shards: serialized tf.Examples in TFRecord
+# files, or fixed-width records packed back to back (see
+# `bookings.packed_layout`).
+OUTPUT_FORMATS = ('tfrecord', 'packed')
+
+SHUFFLE_STRATEGIES = ('global', 'local', 'none')
+
+# Number of CSV lines decoded together into NumPy columns.
+DEFAULT_DECODE_BATCH_SIZE = 1000
+
+# Number of raw lines each worker holds when shuffling locally.
+DEFAULT_LOCAL_SHUFFLE_BUFFER_SIZE = 100000
+
+# Rows of each stratum kept, at least, by a stratified analysis sample. The
+# sample is proportional by default, see `--min_rows_per_stratum`.
+DEFAULT_MIN_ROWS_PER_STRATUM = 0
+
+# Seed of the analysis sample, so that the transform_fn is reproducible.
+DEFAULT_ANALYZE_SEED = 0
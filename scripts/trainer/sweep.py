@@ -0,0 +1,331 @@
+"""Runs a hyperparameter sweep of task.py trials in parallel.
+
+The search space is a JSON file mapping task.py flags (without the leading
+dashes) to the list of values to try, e.g.
+
+  {"first-dnn-layer-size": [50, 100, 200], "num-dnn-layers": [2, 4],
+   "dnn-decay-factor": [0.5, 0.7], "train-batch-size": [40, 200]}
+
+Trials are the cartesian product of the values, or `--max-trials` of them
+picked at random. They run as concurrent task.py processes, as many as fit in
+the host cores given `--threads-per-trial`, all reading one uncompressed copy
+of the transformed examples that is decoded once before the sweep starts.
+
+A running trial is stopped early when its latest eval loss is worse than the
+median of the other trials' eval losses at the same step (median stopping).
+Once all trials are done, a leaderboard of their final eval metrics and wall
+times is written to `<sweep-dir>/leaderboard.json`. Trials that evaluate on a
+subset of the eval data during training (`--eval-subset-steps`) are ranked on
+the evaluation on the whole eval data that follows training; the subset evals
+only drive median stopping.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import model
+import task
+
+TASK_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'task.py')
+
+# Suffix of the file recording the inputs of a complete decoded copy.
+DECODED_MARKER_SUFFIX = '.decoded.json'
+
+
+def make_trials(search_space, max_trials=None, seed=0):
+  """Returns the trials of a search space, as dicts from flag to value."""
+  names = sorted(search_space)
+  trials = [
+      dict(zip(names, values))
+      for values in itertools.product(*(search_space[name] for name in names))
+  ]
+  if max_trials and max_trials < len(trials):
+    trials = random.Random(seed).sample(trials, max_trials)
+  return trials
+
+
+def read_eval_metrics(trial_dir, eval_name=task.EVAL_NAME):
+  """Returns the eval metrics of a trial by global step.
+
+  Args:
+    trial_dir: The `--output-dir` of the trial.
+    eval_name: Name of the evaluation, see task.py.
+
+  Returns:
+    A dict from global step to a dict of metric name to value, read from the
+    eval event files written so far.
+  """
+  pattern = os.path.join(trial_dir, task.SERVING_MODEL_DIR,
+                         'eval_' + eval_name, 'events.out.tfevents.*')
+  metrics = {}
+  for path in tf.gfile.Glob(pattern):
+    try:
+      for event in tf.train.summary_iterator(path):
+        for value in event.summary.value:
+          metrics.setdefault(event.step, {})[value.tag] = value.simple_value
+    except tf.errors.DataLossError:
+      # The file is still being written.
+      pass
+  return metrics
+
+
+def read_final_metrics(trial_dir):
+  """Returns the metrics a finished trial is ranked on.
+
+  These are the metrics of the evaluation on the whole eval data that task.py
+  runs after training when `--eval-subset-steps` is set, or else those of the
+  last evaluation during training.
+
+  Args:
+    trial_dir: The `--output-dir` of the trial.
+
+  Returns:
+    A (metrics, global_step, eval_name) tuple, where metrics is a dict of
+    metric name to value. All are None if the trial was never evaluated.
+  """
+  metrics_file = os.path.join(trial_dir, 'metrics.json')
+  if tf.gfile.Exists(metrics_file):
+    with tf.gfile.GFile(metrics_file) as f:
+      full_eval = json.load(f).get('full_eval')
+    if full_eval:
+      return (full_eval, full_eval.get('global_step'),
+              task.EVAL_NAME + '-full')
+  for eval_name in (task.EVAL_NAME + '-full', task.EVAL_NAME):
+    metrics = read_eval_metrics(trial_dir, eval_name)
+    if metrics:
+      step = max(metrics)
+      return metrics[step], step, eval_name
+  return None, None, None
+
+
+def _latest_loss(metrics, max_step):
+  steps = [step for step in metrics if step <= max_step and
+           'loss' in metrics[step]]
+  return metrics[max(steps)]['loss'] if steps else None
+
+
+class MedianStopping(object):
+  """Decides whether a trial is worse than the median of the others.
+
+  Args:
+    min_trials: Number of other trials that must have reported an eval loss
+      at or before a step before any trial is stopped at that step.
+  """
+
+  def __init__(self, min_trials=3):
+    self._min_trials = min_trials
+    self._lock = threading.Lock()
+    self._metrics = {}
+
+  def report(self, trial_id, metrics):
+    with self._lock:
+      self._metrics[trial_id] = metrics
+
+  def should_stop(self, trial_id):
+    with self._lock:
+      metrics = self._metrics.get(trial_id)
+      if not metrics:
+        return False
+      step = max(metrics)
+      loss = _latest_loss(metrics, step)
+      others = [
+          _latest_loss(other, step)
+          for other_id, other in self._metrics.items()
+          if other_id != trial_id
+      ]
+      others = [other for other in others if other is not None]
+    if loss is None or len(others) < self._min_trials:
+      return False
+    return loss > np.median(others)
+
+
+def run_trial(trial_id, params, trial_dir, task_args, stopping,
+              poll_secs=10):
+  """Runs one trial to completion or until it is stopped early.
+
+  Args:
+    trial_id: Index of the trial.
+    params: A dict from task.py flag to value.
+    trial_dir: Directory in which the trial writes its outputs.
+    task_args: Arguments passed to task.py besides the trial's own.
+    stopping: A `MedianStopping` shared by all trials.
+    poll_secs: How often the trial's eval metrics are checked.
+
+  Returns:
+    A dict describing the outcome of the trial.
+  """
+  args = [sys.executable, TASK_SCRIPT] + task_args + [
+      '--output-dir', trial_dir,
+      '--job-dir', trial_dir,
+      '--metrics-file', os.path.join(trial_dir, 'metrics.json'),
+  ]
+  for name, value in sorted(params.items()):
+    args += ['--' + name, str(value)]
+  tf.gfile.MakeDirs(trial_dir)
+
+  start = time.time()
+  status = 'completed'
+  with open(os.path.join(trial_dir, 'task.log'), 'w') as log:
+    process = subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT)
+    while process.poll() is None:
+      time.sleep(poll_secs)
+      stopping.report(trial_id, read_eval_metrics(trial_dir))
+      if stopping.should_stop(trial_id):
+        process.kill()
+        process.wait()
+        status = 'stopped'
+  if status == 'completed' and process.returncode:
+    status = 'failed'
+
+  stopping.report(trial_id, read_eval_metrics(trial_dir))
+  final_metrics, final_step, eval_name = read_final_metrics(trial_dir)
+  return {
+      'trial': trial_id,
+      'params': params,
+      'status': status,
+      'wall_secs': time.time() - start,
+      'global_step': final_step,
+      'eval_name': eval_name,
+      'eval_metrics': final_metrics or {},
+  }
+
+
+def _input_signature(files):
+  """Returns the name, size and modification time of each input file."""
+  signature = []
+  for name in files:
+    stat = tf.gfile.Stat(name)
+    signature.append([name, stat.length, stat.mtime_nsec])
+  return signature
+
+
+def decode_once(filenames, output_prefix):
+  """Writes an uncompressed copy of transformed examples for all trials.
+
+  Once the copy is complete, the name, size and modification time of its input
+  files are written to `<output_prefix>.decoded.json`. A later sweep reuses the
+  copy only if they still match; a copy of other inputs, or one left
+  incomplete by an interrupted sweep, is deleted and written again.
+  """
+  files = sorted(
+      name for pattern in filenames for name in tf.gfile.Glob(pattern))
+  signature = _input_signature(files)
+  marker = output_prefix + DECODED_MARKER_SUFFIX
+  if tf.gfile.Exists(marker):
+    with tf.gfile.GFile(marker) as f:
+      if json.load(f) == signature:
+        return [output_prefix + '-*']
+    tf.gfile.Remove(marker)
+  for name in tf.gfile.Glob(output_prefix + '-*'):
+    tf.gfile.Remove(name)
+  model.rewrite_shards(files, output_prefix, 'NONE')
+  with tf.gfile.GFile(marker, 'w') as f:
+    json.dump(signature, f)
+  return [output_prefix + '-*']
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument(
+      '--search-space',
+      help='JSON file mapping task.py flags to the values to try',
+      required=True)
+  parser.add_argument(
+      '--sweep-dir',
+      help='Directory under which the trials and the leaderboard are written',
+      required=True)
+  parser.add_argument(
+      '--train-files',
+      help='GCS or local paths to training data',
+      nargs='+',
+      required=True)
+  parser.add_argument(
+      '--eval-files',
+      help='GCS or local paths to evaluation data',
+      nargs='+',
+      required=True)
+  parser.add_argument(
+      '--max-trials',
+      help='If set, only this many trials of the search space are run',
+      default=None,
+      type=int)
+  parser.add_argument(
+      '--threads-per-trial',
+      help='Intra-op threads of each trial; trials run cores / threads at once',
+      default=2,
+      type=int)
+  parser.add_argument(
+      '--min-trials-for-stopping',
+      help='Other trials needed at a step before a trial is stopped early',
+      default=3,
+      type=int)
+  parser.add_argument(
+      '--seed', help='Seed for picking trials', default=0, type=int)
+  args, task_args = parser.parse_known_args()
+  if task_args and task_args[0] == '--':
+    task_args = task_args[1:]
+
+  sweep_dir = os.path.abspath(args.sweep_dir)
+  with open(args.search_space) as f:
+    trials = make_trials(json.load(f), args.max_trials, args.seed)
+
+  task_args = task_args + [
+      '--train-files'] + decode_once(
+          args.train_files, os.path.join(sweep_dir, 'cache',
+                                         'train_transformed')) + [
+      '--eval-files'] + decode_once(
+          args.eval_files, os.path.join(sweep_dir, 'cache',
+                                        'eval_transformed')) + [
+      '--intra-op-threads', str(args.threads_per_trial),
+      '--inter-op-threads', '1',
+  ]
+  num_parallel = max(1, os.cpu_count() // args.threads_per_trial)
+  print('Running %d trials, %d at a time.' % (len(trials), num_parallel))
+
+  stopping = MedianStopping(args.min_trials_for_stopping)
+  with concurrent.futures.ThreadPoolExecutor(num_parallel) as executor:
+    futures = [
+        executor.submit(run_trial, trial_id, params,
+                        os.path.join(sweep_dir, 'trial-%03d' % trial_id),
+                        task_args, stopping)
+        for trial_id, params in enumerate(trials)
+    ]
+    results = []
+    for future in concurrent.futures.as_completed(futures):
+      result = future.result()
+      print('Trial %d %s after %.0fs: %s' % (
+          result['trial'], result['status'], result['wall_secs'],
+          result['eval_metrics'].get('average_loss')))
+      results.append(result)
+
+  leaderboard = sorted(
+      results,
+      key=lambda result: (result['status'] != 'completed',
+                          result['eval_metrics'].get('average_loss',
+                                                     float('inf'))))
+  with open(os.path.join(sweep_dir, 'leaderboard.json'), 'w') as f:
+    json.dump(leaderboard, f, indent=2, sort_keys=True)
+  for rank, result in enumerate(leaderboard):
+    print('%2d. trial %d (%s) average_loss=%s wall_secs=%.0f %s' % (
+        rank + 1, result['trial'], result['status'],
+        result['eval_metrics'].get('average_loss'), result['wall_secs'],
+        json.dumps(result['params'], sort_keys=True)))
+
+
+if __name__ == '__main__':
+  main()
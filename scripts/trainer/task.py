@@ -4,13 +4,15 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import json
 import os
+import time
 
 import tensorflow as tf
-import tensorflow_model_analysis as tfma
 import tensorflow_transform as tft
 import model
 import bookings
+import hooks
 
 SERVING_MODEL_DIR = 'serving_model_dir'
 EVAL_MODEL_DIR = 'eval_model_dir'
@@ -18,17 +20,27 @@ EVAL_MODEL_DIR = 'eval_model_dir'
 TRAIN_BATCH_SIZE = 40
 EVAL_BATCH_SIZE = 40
 
+# Number of examples buffered when shuffling training data.
+SHUFFLE_BUFFER_SIZE = 10000
+
 # Number of nodes in the first layer of the DNN
 FIRST_DNN_LAYER_SIZE = 100
 NUM_DNN_LAYERS = 4
 DNN_DECAY_FACTOR = 0.7
 
+SAVE_CHECKPOINTS_STEPS = 999
+
+# Name of the EvalSpec, which names the directory of its eval events.
+EVAL_NAME = 'bookings-eval'
+
 
-def train_and_maybe_evaluate(hparams):
+def train_and_maybe_evaluate(hparams, metrics=None):
   """Run the training and evaluate using the high level API.
 
   Args:
     hparams: Holds hyperparameters used to train the model as name/value pairs.
+    metrics: An optional dict, filled with training throughput and export
+      timings.
 
   Returns:
     The estimator that was used for training (and maybe eval)
@@ -36,73 +48,219 @@ def train_and_maybe_evaluate(hparams):
   schema = bookings.read_schema(hparams.schema_file)
   tf_transform_output = tft.TFTransformOutput(hparams.tf_transform_dir)
 
-  train_input = lambda: model.input_fn(
-      hparams.train_files,
-      tf_transform_output,
-      batch_size=TRAIN_BATCH_SIZE
-  )
-
-  eval_input = lambda: model.input_fn(
-      hparams.eval_files,
-      tf_transform_output,
-      batch_size=EVAL_BATCH_SIZE
-  )
-
-  train_spec = tf.estimator.TrainSpec(
-      train_input, max_steps=hparams.train_steps)
-
-  serving_receiver_fn = lambda: model.example_serving_receiver_fn(
-      tf_transform_output, schema)
-
-  exporter = tf.estimator.FinalExporter('bookings', serving_receiver_fn)
-  eval_spec = tf.estimator.EvalSpec(
-      eval_input,
-      steps=hparams.eval_steps,
-      exporters=[exporter],
-      name='bookings-eval')
-
-  run_config = tf.estimator.RunConfig(
-      save_checkpoints_steps=999, keep_checkpoint_max=1)
+  # The cluster, if any, is read from TF_CONFIG, see `set_tf_config`.
+  session_config = tf.ConfigProto(
+      intra_op_parallelism_threads=hparams.intra_op_threads,
+      inter_op_parallelism_threads=hparams.inter_op_threads)
+  if hparams.save_checkpoints_secs:
+    run_config = tf.estimator.RunConfig(
+        save_checkpoints_secs=hparams.save_checkpoints_secs,
+        keep_checkpoint_max=1, session_config=session_config)
+  else:
+    run_config = tf.estimator.RunConfig(
+        save_checkpoints_steps=hparams.save_checkpoints_steps,
+        keep_checkpoint_max=1, session_config=session_config)
 
   serving_model_dir = os.path.join(hparams.output_dir, SERVING_MODEL_DIR)
   run_config = run_config.replace(model_dir=serving_model_dir)
 
+  # Each training replica (the chief and the workers) reads its own shard of
+  # the training data.
+  num_shards = run_config.num_worker_replicas
+  shard_index = 0
+  if run_config.task_type in ('chief', 'worker'):
+    shard_index = run_config.global_id_in_cluster
+
+  if hparams.input_mode == 'dataset':
+    train_input = lambda: model.timed_input_tensors(model.dataset_input_fn(
+        hparams.train_files,
+        tf_transform_output,
+        batch_size=hparams.train_batch_size,
+        num_parallel_reads=hparams.num_parallel_reads,
+        num_parallel_calls=hparams.num_parallel_calls,
+        shuffle_buffer_size=hparams.shuffle_buffer_size or None,
+        prefetch_buffer_size=hparams.prefetch_buffer_size,
+        timestamp_batches=True,
+        num_shards=num_shards,
+        shard_index=shard_index
+    ))
+
+    def eval_input_fn():
+      return model.dataset_input_fn(
+          hparams.eval_files,
+          tf_transform_output,
+          batch_size=hparams.eval_batch_size,
+          num_parallel_reads=hparams.num_parallel_reads,
+          num_parallel_calls=hparams.num_parallel_calls,
+          prefetch_buffer_size=hparams.prefetch_buffer_size,
+          cache=hparams.cache_eval)
+  else:
+    train_input = lambda: model.input_fn(
+        hparams.train_files,
+        tf_transform_output,
+        batch_size=hparams.train_batch_size,
+        shuffle_buffer_size=hparams.shuffle_buffer_size,
+        num_shards=num_shards,
+        shard_index=shard_index
+    )
+
+    def eval_input_fn():
+      return model.input_fn(
+          hparams.eval_files,
+          tf_transform_output,
+          batch_size=hparams.eval_batch_size)
+
+  if hparams.eval_subset_steps:
+    # Intermediate evals run on the first batches of the eval data, read into
+    # NumPy arrays by the first eval and fed from memory by every later one,
+    # whatever the input mode; the full eval data is evaluated once, after
+    # training. Each evaluate builds a new graph, so a dataset cache would be
+    # refilled from disk every time.
+    eval_subset = []
+
+    def eval_input():
+      if not eval_subset:
+        eval_subset.extend(model.read_batches(
+            hparams.eval_files, tf_transform_output, hparams.eval_batch_size,
+            hparams.eval_subset_steps))
+      return model.in_memory_input_fn(eval_subset[0], eval_subset[1],
+                                      hparams.eval_batch_size)
+
+    eval_steps = hparams.eval_subset_steps
+  else:
+    eval_input = lambda: eval_input_fn()
+    eval_steps = hparams.eval_steps
+
   estimator = model.build_estimator(
       tf_transform_output,
 
       # Construct layers sizes with exponetial decay
       hidden_units=[
-          max(2, int(FIRST_DNN_LAYER_SIZE * DNN_DECAY_FACTOR**i))
-          for i in range(NUM_DNN_LAYERS)
+          max(2, int(hparams.first_dnn_layer_size *
+                     hparams.dnn_decay_factor**i))
+          for i in range(hparams.num_dnn_layers)
       ],
+      embed_ids=hparams.embed_ids,
+      embedding_dimension=hparams.embedding_dim,
       config=run_config)
 
+  checkpoint_timer = hooks.CheckpointTimer()
+  throughput_hook = hooks.ThroughputHook(hparams.train_batch_size,
+                                         checkpoint_timer)
+  train_hooks = [throughput_hook]
+  if run_config.is_chief:
+    # Replaces the saver hook the estimator would add, so that saves are timed.
+    # train_and_evaluate attaches its saving listeners to this hook as well.
+    train_hooks.insert(0, tf.train.CheckpointSaverHook(
+        estimator.model_dir,
+        save_secs=run_config.save_checkpoints_secs,
+        save_steps=run_config.save_checkpoints_steps,
+        listeners=[checkpoint_timer]))
+  if hparams.early_stopping_steps:
+    # Stops training once the eval loss has not decreased for that many
+    # steps, as read from the eval event files.
+    train_hooks.append(tf.contrib.estimator.stop_if_no_decrease_hook(
+        estimator,
+        'loss',
+        max_steps_without_decrease=hparams.early_stopping_steps,
+        eval_dir=estimator.eval_dir(EVAL_NAME),
+        min_steps=hparams.early_stopping_min_steps))
+  train_spec = tf.estimator.TrainSpec(
+      train_input, max_steps=hparams.train_steps, hooks=train_hooks)
+
+  serving_receiver_fn = lambda: model.example_serving_receiver_fn(
+      tf_transform_output, schema)
+
+  dense_serving_receiver_fn = lambda: model.dense_serving_receiver_fn(
+      tf_transform_output, schema)
+
+  exporter = hooks.TimedExporter(
+      tf.estimator.FinalExporter('bookings', serving_receiver_fn))
+  dense_exporter = hooks.TimedExporter(
+      tf.estimator.FinalExporter('bookings_dense', dense_serving_receiver_fn))
+  eval_spec = tf.estimator.EvalSpec(
+      eval_input,
+      steps=eval_steps,
+      exporters=[exporter, dense_exporter],
+      name=EVAL_NAME,
+      start_delay_secs=hparams.eval_start_delay_secs,
+      throttle_secs=hparams.eval_throttle_secs)
+
   tf.estimator.train_and_evaluate(estimator, train_spec, eval_spec)
 
+  full_eval = None
+  if hparams.eval_subset_steps and estimator.config.is_chief:
+    full_eval = estimator.evaluate(
+        lambda: eval_input_fn(), steps=hparams.eval_steps,
+        name=EVAL_NAME + '-full')
+
+  if metrics is not None:
+    metrics['train'] = throughput_hook.report()
+    metrics['export_secs'] = {
+        exp.name: sum(exp.export_secs) for exp in (exporter, dense_exporter)
+    }
+    if full_eval is not None:
+      metrics['full_eval'] = {
+          name: float(value) for name, value in full_eval.items()
+      }
+
   return estimator
 
 
+def _write_metrics(metrics_file, metrics):
+  if metrics_file:
+    with tf.gfile.GFile(metrics_file, 'w') as f:
+      json.dump(metrics, f, indent=2, sort_keys=True)
+
+
 def run_experiment(hparams):
   """Train the model then export it for tf.model_analysis evaluation.
 
   Args:
     hparams: Holds hyperparameters used to train the model as name/value pairs.
   """
-  estimator = train_and_maybe_evaluate(hparams)
+  start = time.time()
+  metrics = {}
+  estimator = train_and_maybe_evaluate(hparams, metrics)
+  if not estimator.config.is_chief:
+    # In a cluster, only the chief exports the model for tfma.
+    _write_metrics(hparams.metrics_file, metrics)
+    return
 
   schema = bookings.read_schema(hparams.schema_file)
   tf_transform_output = tft.TFTransformOutput(hparams.tf_transform_dir)
 
-  # Save a model for tfma eval
+  # Save a model for tfma eval. TFMA pulls in Beam, so only the chief imports
+  # it, once training is done.
+  import tensorflow_model_analysis as tfma  # pylint: disable=g-import-not-at-top
   eval_model_dir = os.path.join(hparams.output_dir, EVAL_MODEL_DIR)
 
   receiver_fn = lambda: model.eval_input_receiver_fn(  # pylint: disable=g-long-lambda
       tf_transform_output, schema)
 
+  export_start = time.time()
   tfma.export.export_eval_savedmodel(
       estimator=estimator,
       export_dir_base=eval_model_dir,
       eval_input_receiver_fn=receiver_fn)
+  metrics['export_secs']['eval_model'] = time.time() - export_start
+  metrics['wall_secs'] = time.time() - start
+  _write_metrics(hparams.metrics_file, metrics)
+
+
+def set_tf_config(cluster_spec, task_type, task_index):
+  """Sets TF_CONFIG, from which RunConfig reads the cluster of the task.
+
+  Args:
+    cluster_spec: A dict from job name ('chief', 'worker', 'ps' and
+      'evaluator') to the list of `host:port` addresses of its tasks.
+    task_type: The job of this process.
+    task_index: The index of this process within its job.
+  """
+  os.environ['TF_CONFIG'] = json.dumps({
+      'cluster': cluster_spec,
+      'task': {'type': task_type, 'index': task_index},
+  })
 
 
 def main():
@@ -158,6 +316,151 @@ def main():
   parser.add_argument(
       '--schema-file',
       help='File holding the schema for the input data')
+  # Model arguments
+  parser.add_argument(
+      '--first-dnn-layer-size',
+      help='Number of nodes in the first layer of the DNN',
+      default=FIRST_DNN_LAYER_SIZE,
+      type=int)
+  parser.add_argument(
+      '--num-dnn-layers',
+      help='Number of layers in the DNN',
+      default=NUM_DNN_LAYERS,
+      type=int)
+  parser.add_argument(
+      '--dnn-decay-factor',
+      help='How quickly the size of the DNN layers decays',
+      default=DNN_DECAY_FACTOR,
+      type=float)
+  parser.add_argument(
+      '--embed-ids',
+      help=('Also feed the hotel, city and advertiser ids to the DNN as '
+            'embeddings'),
+      action='store_true')
+  parser.add_argument(
+      '--embedding-dim',
+      help='Dimension of the id embeddings',
+      default=8,
+      type=int)
+  # Input pipeline arguments
+  parser.add_argument(
+      '--input-mode',
+      help=('Read the transformed examples with a tf.data pipeline or with '
+            'the legacy queue based reader'),
+      choices=['dataset', 'queue'],
+      default='dataset')
+  parser.add_argument(
+      '--train-batch-size',
+      help='Batch size for training steps',
+      default=TRAIN_BATCH_SIZE,
+      type=int)
+  parser.add_argument(
+      '--eval-batch-size',
+      help='Batch size for evaluation steps',
+      default=EVAL_BATCH_SIZE,
+      type=int)
+  parser.add_argument(
+      '--num-parallel-reads',
+      help='Number of input files read concurrently (dataset mode)',
+      default=4,
+      type=int)
+  parser.add_argument(
+      '--num-parallel-calls',
+      help='Number of batches parsed concurrently (dataset mode)',
+      default=4,
+      type=int)
+  parser.add_argument(
+      '--prefetch-buffer-size',
+      help='Number of parsed batches to prefetch (dataset mode)',
+      default=1,
+      type=int)
+  parser.add_argument(
+      '--shuffle-buffer-size',
+      help=('Number of training examples shuffled at read time, after the '
+            'shard order is randomized. Use 0 to read in file order.'),
+      default=SHUFFLE_BUFFER_SIZE,
+      type=int)
+  parser.add_argument(
+      '--cache-eval',
+      help='Cache the parsed eval set in memory (dataset mode)',
+      action='store_true')
+  parser.add_argument(
+      '--metrics-file',
+      help=('If set, training throughput, input wait, checkpoint and export '
+            'timings are written to this JSON file'),
+      default=None)
+
+  # Evaluation and checkpointing arguments
+  parser.add_argument(
+      '--eval-throttle-secs',
+      help=('Minimum seconds between evaluations. Evaluations also wait for a '
+            'new checkpoint'),
+      default=600,
+      type=int)
+  parser.add_argument(
+      '--eval-start-delay-secs',
+      help='Seconds to wait before the first evaluation',
+      default=120,
+      type=int)
+  parser.add_argument(
+      '--eval-subset-steps',
+      help=('If set, intermediate evaluations run this many batches of the '
+            'eval data, read once into memory, and --eval-steps of the full eval '
+            'data are only evaluated once training is done'),
+      default=0,
+      type=int)
+  parser.add_argument(
+      '--early-stopping-steps',
+      help=('If set, training stops once the eval loss has not decreased for '
+            'this many steps'),
+      default=0,
+      type=int)
+  parser.add_argument(
+      '--early-stopping-min-steps',
+      help='Steps trained before early stopping can kick in',
+      default=0,
+      type=int)
+  parser.add_argument(
+      '--save-checkpoints-steps',
+      help='Steps between checkpoints',
+      default=SAVE_CHECKPOINTS_STEPS,
+      type=int)
+  parser.add_argument(
+      '--save-checkpoints-secs',
+      help=('If set, checkpoints are saved every this many seconds instead of '
+            'every --save-checkpoints-steps'),
+      default=0,
+      type=int)
+  # Threading arguments
+  parser.add_argument(
+      '--intra-op-threads',
+      help=('Threads used within an op, e.g. a matrix multiplication. Use 0 '
+            'to let TensorFlow pick one per core.'),
+      default=0,
+      type=int)
+  parser.add_argument(
+      '--inter-op-threads',
+      help=('Threads used to run independent ops concurrently. Use 0 to let '
+            'TensorFlow pick one per core.'),
+      default=0,
+      type=int)
+  # Distributed training arguments
+  parser.add_argument(
+      '--cluster-spec',
+      help=('JSON cluster spec, mapping chief, worker, ps and evaluator to '
+            'lists of host:port addresses. Without it training runs in a '
+            'single process.'),
+      default=None)
+  parser.add_argument(
+      '--task-type',
+      help='Job of this process in --cluster-spec',
+      choices=['chief', 'worker', 'ps', 'evaluator'],
+      default='chief')
+  parser.add_argument(
+      '--task-index',
+      help='Index of this process within its job in --cluster-spec',
+      default=0,
+      type=int)
 
   args = parser.parse_args()
 
@@ -167,6 +470,10 @@ def main():
   os.environ['TF_CPP_MIN_LOG_LEVEL'] = str(
       tf.logging.__dict__[args.verbosity] / 10)
 
+  if args.cluster_spec:
+    set_tf_config(json.loads(args.cluster_spec), args.task_type,
+                  args.task_index)
+
   # Run the training job
   hparams = tf.contrib.training.HParams(**args.__dict__)
   run_experiment(hparams)